@@ -15,6 +15,9 @@ source.dir = .
 # (list) Source files to include (let extensions blank to include all)
 source.include_exts = py,png,jpg,kv,atlas,json,appicon,webicon,manifest
 
+# (list) List of directory to exclude (let empty to not exclude anything)
+source.exclude_dirs = tools, tests
+
 # (str) Application versioning (method 1)
 version = 1.0
 
@@ -9,17 +9,91 @@ import os
 import sys
 import subprocess
 import time
+import random
 import json
 import shutil
 import mimetypes
-import socket
 import threading
+import signal
+import heapq
+import stat
+import asyncio
+import itertools
+import collections
+import functools
+import bisect
 import webbrowser
 import shlex
+import tempfile
+import sqlite3
+import queue
+import hashlib
+import zlib
+import base64
+import codecs
+import select
+import struct
+import ctypes
+import ctypes.util
 import importlib.util # Essencial para carregar apps dinâmicos
+import concurrent.futures
+import multiprocessing
 from abc import ABC, abstractmethod
 from datetime import datetime
 
+try:
+    from PIL import Image as PILImage, ImageOps  # Miniaturas (opcional: sem Pillow os ícones ficam genéricos)
+except ImportError:
+    PILImage = ImageOps = None
+
+# ============================================================================
+# 🖼️ POOL DE MINIATURAS (NASCE ANTES DO KIVY E DE QUALQUER THREAD)
+# ============================================================================
+# fork só é seguro num processo de uma thread: aqui ainda não existem janela/GL,
+# loop do Vigia, inotify nem conexões SQLite para os workers herdarem. spawn e
+# forkserver não servem, porque reimportariam este script (e o Kivy abriria outra janela).
+
+def _render_thumbnail(src, dest, size, decode=True):
+    """
+    Roda no pool (processo ou thread). Gera a miniatura em dest se ainda não
+    existe e devolve (largura, altura, rgba, gerou_agora). JPEG é decodificado
+    já reduzido (draft usa a escala do DCT): a foto de 12 MP nunca é aberta inteira.
+    decode=False só garante o arquivo (pré-aquecimento) e devolve rgba vazio.
+    """
+    created = False
+    if os.path.exists(dest):
+        os.utime(dest)  # mtime = último uso (LRU do disco)
+    else:
+        with PILImage.open(src) as img:
+            img.draft("RGB", (size, size))
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((size, size))
+            has_alpha = img.mode in ("RGBA", "LA", "P")
+            img = img.convert("RGBA" if has_alpha else "RGB")
+            tmp = dest + ".tmp"
+            img.save(tmp, "PNG" if has_alpha else "JPEG", quality=85)
+            os.replace(tmp, dest)
+            created = True
+    if not decode: return 0, 0, b"", created
+    with PILImage.open(dest) as thumb:
+        thumb = thumb.convert("RGBA")
+        return thumb.size[0], thumb.size[1], thumb.tobytes(), created
+
+def _start_thumbnail_pool(workers=2):
+    if PILImage is None: return None
+    try:
+        pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("fork"))
+        pool.submit(int).result(timeout=10)  # Com fork todos os workers nascem no primeiro submit: agora
+        return pool
+    except (OSError, ImportError, ValueError, NotImplementedError,
+            concurrent.futures.BrokenExecutor, concurrent.futures.TimeoutError) as e:
+        print(f"⚠️ [Miniaturas] Sem pool de processos ({e}), usando threads")
+        return None
+
+# Só quando roda como app: importar o módulo (ferramentas, testes) não cria processos
+THUMBNAIL_POOL = _start_thumbnail_pool() if __name__ == '__main__' else None
+
 # Kivy / KivyMD Imports
 from kivymd.app import MDApp
 from kivy.lang import Builder
@@ -36,13 +110,16 @@ from kivy.uix.floatlayout import FloatLayout
 from kivymd.uix.floatlayout import MDFloatLayout
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.widget import Widget
-from kivymd.uix.list import OneLineAvatarIconListItem, TwoLineAvatarIconListItem, OneLineIconListItem
+from kivymd.uix.list import TwoLineAvatarIconListItem, OneLineIconListItem
 from kivymd.uix.label import MDLabel, MDIcon
+from kivymd.uix.progressbar import MDProgressBar
 from kivymd.uix.menu import MDDropdownMenu
 from kivy.uix.scrollview import ScrollView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
 from kivymd.uix.textfield import MDTextFieldRect, MDTextField
 from kivy.uix.modalview import ModalView
 from kivy.graphics import Color, Ellipse, Rectangle
+from kivy.graphics.texture import Texture
 from kivy.utils import platform
 from kivy.core.clipboard import Clipboard
 from kivy.storage.jsonstore import JsonStore # Persistência
@@ -363,6 +440,117 @@ ICON_ALIASES = {
     "weather-partly-cloudy": ["weather"]
 }
 
+# ============================================================================
+# 🎨 ÍNDICE DE ÍCONES (NOME -> CAMINHO, PERSISTENTE POR TEMA)
+# ============================================================================
+
+class IconIndex:
+    """
+    Mapa nome -> arquivo para cada tema (Colloid-Light / Colloid-Dark).
+    Faz UMA varredura do ICONS_ROOT por tema, expande os ICON_ALIASES e salva o
+    resultado em ICONS_ROOT/.index/<tema>.json. O índice só é refeito quando
+    o mtime de alguma pasta do tema de ícones muda.
+    """
+    INDEX_VERSION = 1
+
+    def __init__(self):
+        self._maps = {}  # theme_folder -> {nome: caminho}
+        self._lock = threading.Lock()
+
+    def _index_file(self, theme_folder):
+        # Pasta oculta própria: gravar o índice não mexe no mtime das pastas monitoradas
+        return os.path.join(ICONS_ROOT, ".index", f"{theme_folder}.json")
+
+    @staticmethod
+    def _is_fresh(dir_mtimes):
+        # Um stat por pasta em vez de um listdir por pasta
+        if not dir_mtimes: return False
+        for d, mtime in dir_mtimes.items():
+            try:
+                if os.stat(d).st_mtime != mtime: return False
+            except OSError:
+                return False
+        return True
+
+    def _build(self, theme_folder):
+        symbolic_path = os.path.join(ICONS_ROOT, theme_folder, "status", "symbolic")
+        symbolic = {}  # Prioridade 1: pasta symbolic do tema ativo
+        walked = {}    # Prioridade 2: primeira ocorrência na árvore inteira
+        dir_mtimes = {}
+
+        for root, dirs, files in os.walk(ICONS_ROOT):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            try: dir_mtimes[root] = os.stat(root).st_mtime
+            except OSError: pass
+            in_symbolic = os.path.normpath(root) == os.path.normpath(symbolic_path)
+            for f in files:
+                if not f.endswith(".png"): continue
+                name = f[:-4]
+                full = os.path.join(root, f)
+                if name not in walked: walked[name] = full
+                if in_symbolic:
+                    if name.endswith("-symbolic"):
+                        symbolic[name[:-len("-symbolic")]] = full
+                    elif name not in symbolic:
+                        symbolic[name] = full
+
+        def resolve(targets):
+            for t in targets:
+                if t in symbolic: return symbolic[t]
+            for t in targets:
+                if t in walked: return walked[t]
+            return None
+
+        icons = {}
+        for name in set(walked) | set(symbolic):
+            icons[name] = resolve([name])
+        for name, aliases in ICON_ALIASES.items():
+            path = resolve([name] + aliases)
+            if path: icons[name] = path
+
+        return icons, dir_mtimes
+
+    def _load(self, theme_folder):
+        index_file = self._index_file(theme_folder)
+        if os.path.exists(index_file):
+            try:
+                with open(index_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get("version") == self.INDEX_VERSION and self._is_fresh(data.get("dir_mtimes", {})):
+                    return data.get("icons", {})
+            except Exception as e:
+                print(f"⚠️ [Ícones] Índice inválido, refazendo: {e}")
+
+        os.makedirs(os.path.dirname(index_file), exist_ok=True)
+        icons, dir_mtimes = self._build(theme_folder)
+        try:
+            with open(index_file, 'w', encoding='utf-8') as f:
+                json.dump({"version": self.INDEX_VERSION, "dir_mtimes": dir_mtimes, "icons": icons}, f)
+        except Exception as e:
+            print(f"⚠️ [Ícones] Não foi possível salvar o índice: {e}")
+        print(f"🎨 Índice de ícones {theme_folder}: {len(icons)} nomes")
+        return icons
+
+    def get_map(self, theme_folder):
+        icons = self._maps.get(theme_folder)
+        if icons is None:
+            with self._lock:
+                icons = self._maps.get(theme_folder)
+                if icons is None:
+                    icons = self._load(theme_folder) if os.path.exists(ICONS_ROOT) else {}
+                    self._maps[theme_folder] = icons
+        return icons
+
+    def resolve(self, name, theme_folder):
+        return self.get_map(theme_folder).get(name, "")
+
+    def invalidate(self):
+        """Descarta os mapas em memória (ex: ICONS_ROOT mudou de lugar)."""
+        with self._lock:
+            self._maps = {}
+
+ICON_INDEX = IconIndex()
+
 # ============================================================================
 # 📦 LÓGICA DO NÚCLEO (CONTAINER & APPICON)
 # ============================================================================
@@ -373,6 +561,72 @@ class MicroAndroidContainer:
         print(f"📦 [Micro-Android] Inicializando sandbox para: {package_name}")
         SofiaShell._launch_android_intent_raw(package_name)
 
+# Manifesto já interpretado: chave de validade, dados, nome de exibição e ícone resolvido
+ManifestEntry = collections.namedtuple("ManifestEntry", "key manifest display_name icon")
+
+class ManifestCache:
+    """
+    Manifestos dos .appicon lidos uma vez por processo (Mesa, lançador e
+    bandeja de tarefas usam a mesma entrada). A chave é a pasta do app e a
+    validade é o mtime do app.manifest + o da pasta (ícone novo ao lado do
+    manifesto). O arquivo de ícone local já vem resolvido. O watcher da Mesa
+    chama invalidate() quando um bundle é criado, renomeado ou apagado.
+    """
+    ICON_EXTS = (".png", ".svg", ".jpg")
+    _entries = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, bundle_path, dir_mtime_ns=None):
+        """dir_mtime_ns: mtime da pasta se quem chama já fez o stat (ex: scandir)"""
+        key = cls._key(bundle_path, dir_mtime_ns)
+        with cls._lock:
+            entry = cls._entries.get(bundle_path)
+        if entry and entry.key == key: return entry
+        entry = cls._load(bundle_path, key)
+        with cls._lock:
+            cls._entries[bundle_path] = entry
+        return entry
+
+    @classmethod
+    def invalidate(cls, path):
+        """Esquece o bundle em path (ou o que contém path)"""
+        with cls._lock:
+            for bundle in [b for b in cls._entries if path == b or path.startswith(b + os.sep)]:
+                del cls._entries[bundle]
+
+    @staticmethod
+    def _key(bundle_path, dir_mtime_ns):
+        try: manifest_mtime = os.stat(os.path.join(bundle_path, "app.manifest")).st_mtime_ns
+        except OSError: manifest_mtime = None
+        if dir_mtime_ns is None:
+            try: dir_mtime_ns = os.stat(bundle_path).st_mtime_ns
+            except OSError: pass
+        return (manifest_mtime, dir_mtime_ns)
+
+    @classmethod
+    def _load(cls, bundle_path, key):
+        name = os.path.basename(bundle_path)
+        manifest = {}
+        if key[0] is not None:
+            try:
+                with open(os.path.join(bundle_path, "app.manifest"), 'r') as f:
+                    manifest = json.load(f)
+            except Exception as e:
+                print(f"⚠️ [Manifesto] Erro ao ler {name}: {e}")
+        # Tenta ler das chaves novas ou antigas
+        display_name = manifest.get("nome_exibicao") or \
+                       manifest.get("mobile", {}).get("nome_exibicao") or \
+                       name.replace(".appicon", "")
+        icon = manifest.get("icon") or manifest.get("icon_name", "app-encap")
+        # Procura ícone local na pasta do app
+        for ext in cls.ICON_EXTS:
+            local_icon = os.path.join(bundle_path, f"{icon}{ext}")
+            if os.path.exists(local_icon):
+                icon = local_icon
+                break
+        return ManifestEntry(key, manifest, display_name, icon)
+
 class AppIcon(ABC):
     def __init__(self, path):
         self.path = path
@@ -403,33 +657,16 @@ class AppIcon(ABC):
             return None
 
 class UniversalDotAppIcon(AppIcon):
-    def __init__(self, path):
+    def __init__(self, path, dir_mtime_ns=None):
         super().__init__(path)
-        self.manifest = {}
-        self._load_manifest()
-
-    def _load_manifest(self):
-        manifest_path = os.path.join(self.path, "app.manifest")
-        try:
-            if os.path.exists(manifest_path):
-                with open(manifest_path, 'r') as f:
-                    self.manifest = json.load(f)
-        except Exception as e:
-            print(f"⚠️ [Manifesto] Erro ao ler {self.name}: {e}")
+        self._entry = ManifestCache.get(path, dir_mtime_ns)
+        self.manifest = self._entry.manifest
 
     def get_display_name(self):
-        # Tenta ler das chaves novas ou antigas
-        return self.manifest.get("nome_exibicao") or \
-               self.manifest.get("mobile", {}).get("nome_exibicao") or \
-               self.name.replace(".appicon", "")
+        return self._entry.display_name
 
     def get_display_icon(self):
-        icon_name = self.manifest.get("icon") or self.manifest.get("icon_name", "app-encap")
-        # Procura ícone local na pasta do app
-        for ext in [".png", ".svg", ".jpg"]:
-            local_icon = os.path.join(self.path, f"{icon_name}{ext}")
-            if os.path.exists(local_icon): return local_icon
-        return icon_name
+        return self._entry.icon
 
     def execute(self):
         print(f"🚀 [AppIcon] Executando: {self.name}")
@@ -563,95 +800,1711 @@ class SofiaShell:
 # 📡 REDE VIGIA E UTILITÁRIOS (COM AUTHENTICAÇÃO)
 # ============================================================================
 
+class VigiaWireCodec:
+    """
+    Empacotamento das mensagens do Vigia.
+    - "frame/1": [4 bytes big-endian com o tamanho][JSON UTF-8], negociado no handshake.
+    - "json": JSONs colados um no outro (modo antigo, reserva para gateways velhos).
+    O buffer de recepção é um bytearray reaproveitado: recv_into escreve direto
+    nele e os quadros saem por fatias de memoryview, sem concatenar strings.
+    """
+    FRAMED = "frame/1"
+    LEGACY = "json"
+    SUPPORTED = [FRAMED, LEGACY]  # Ordem de preferência enviada no handshake
+    HEADER = struct.Struct("!I")
+    MAX_FRAME = 64 * 1024 * 1024
+    MIN_FREE = 16 * 1024
+
+    def __init__(self, mode=LEGACY, initial_size=64 * 1024):
+        self.mode = mode
+        self._buf = bytearray(initial_size)
+        self._start = 0  # Primeiro byte ainda não consumido
+        self._end = 0    # Fim dos bytes recebidos
+        self._need = 0   # Tamanho do quadro incompleto que está chegando
+        self._json = json.JSONDecoder()
+        # surrogateescape: bytes binários que chegam colados ao handshake (já em frame/1)
+        # sobrevivem intactos até o switch_mode
+        self._utf8 = codecs.getincrementaldecoder("utf-8")("surrogateescape")
+        self._text = ""  # Só no modo antigo: texto decodificado ainda sem objeto completo
+        self._tried_len = 0
+
+    def encode(self, obj):
+        payload = json.dumps(obj).encode('utf-8')
+        if self.mode == self.FRAMED:
+            return self.HEADER.pack(len(payload)) + payload
+        return payload
+
+    def switch_mode(self, mode):
+        """Troca de modo após o handshake; bytes que já chegaram são reaproveitados."""
+        if mode == self.mode: return
+        if self.mode == self.LEGACY:
+            leftover = self._text.encode('utf-8', 'surrogateescape') + self._utf8.getstate()[0]
+            self._utf8.reset()
+            self._text, self._tried_len = "", 0
+            self.feed(leftover)
+        self.mode = mode
+
+    def feed(self, data):
+        view = self.get_buffer(len(data))
+        view[:len(data)] = data
+        view.release()
+        self.buffer_updated(len(data))
+
+    def get_buffer(self, sizehint=-1):
+        """Espaço livre no fim do buffer (para sock.recv_into / BufferedProtocol)."""
+        wanted = max(self.MIN_FREE, sizehint if sizehint and sizehint > 0 else 0, self._need - (self._end - self._start))
+        if len(self._buf) - self._end < wanted:
+            pending = self._end - self._start
+            if self._start:
+                # Compacta: traz os bytes pendentes para o começo (mesmo tamanho, sem realocar)
+                self._buf[:pending] = self._buf[self._start:self._end]
+                self._start, self._end = 0, pending
+            if len(self._buf) - self._end < wanted:
+                self._buf.extend(bytes(max(len(self._buf), wanted)))
+        return memoryview(self._buf)[self._end:]
+
+    def buffer_updated(self, nbytes):
+        self._end += nbytes
+
+    def messages(self):
+        """Drena e devolve todas as mensagens completas já recebidas."""
+        if self.mode == self.FRAMED:
+            return self._framed_messages()
+        return self._legacy_messages()
+
+    def _framed_messages(self):
+        msgs = []
+        header_size = self.HEADER.size
+        with memoryview(self._buf) as view:
+            while self._end - self._start >= header_size:
+                (length,) = self.HEADER.unpack_from(self._buf, self._start)
+                if length > self.MAX_FRAME:
+                    raise ValueError(f"Quadro grande demais: {length} bytes")
+                body = self._start + header_size
+                if self._end - body < length:
+                    self._need = header_size + length
+                    break
+                msgs.append(json.loads(str(view[body:body + length], 'utf-8')))
+                self._start = body + length
+                self._need = 0
+        if self._start == self._end:
+            self._start = self._end = 0
+        return msgs
+
+    def _legacy_messages(self):
+        if self._end > self._start:
+            # O decodificador incremental segura o pedaço de um caractere multibyte cortado no recv
+            self._text += self._utf8.decode(bytes(self._buf[self._start:self._end]))
+            self._start = self._end = 0
+        text = self._text
+        stripped = text.rstrip()
+        # Só tenta decodificar se o texto pode ter fechado um objeto ou dobrou de tamanho
+        # (evita reparsear um payload enorme a cada 4 KB que chega)
+        if not stripped or (stripped[-1] not in "}]" and len(text) < 2 * self._tried_len):
+            return []
+        msgs, pos, size = [], 0, len(text)
+        while True:
+            while pos < size and text[pos] in " \t\r\n": pos += 1
+            if pos >= size: break
+            try:
+                obj, pos = self._json.raw_decode(text, pos)
+            except ValueError:
+                break
+            msgs.append(obj)
+        self._text = text[pos:]
+        self._tried_len = len(self._text)
+        return msgs
+
+class RemoteListing:
+    """
+    Cópia local da listagem do PC remoto. O gateway numera cada estado da
+    pasta com uma geração; um "listing_delta" só é aplicado se partir da
+    geração que temos (base), senão a cópia divergiu e é preciso listar tudo.
+    As entradas ficam ordenadas (pastas primeiro, depois nome) para que cada
+    mudança vire uma inserção/remoção pontual na grade.
+    """
+    def __init__(self):
+        self.generation = None
+        self.entries = {}
+        self._keys = []  # Chaves de ordenação, paralelas à grade
+        self.resyncing = False
+
+    @staticmethod
+    def sort_key(entry):
+        name = entry.get('name', '')
+        return (not entry.get('is_dir', False), name.lower(), name)
+
+    def names(self):
+        return [key[2] for key in self._keys]
+
+    def load(self, files, generation=None):
+        """Listagem completa: substitui tudo e devolve as entradas na ordem da grade"""
+        self.entries = {f.get('name', 'Desconhecido'): f for f in files}
+        for name, f in self.entries.items(): f.setdefault('name', name)
+        self._keys = sorted(self.sort_key(f) for f in self.entries.values())
+        self.generation = generation
+        self.resyncing = False
+        return [self.entries[key[2]] for key in self._keys]
+
+    def clear(self):
+        self.__init__()
+
+    def invalidate(self):
+        """Mantém as entradas (cache/tela), mas nenhum delta vale até a próxima listagem completa"""
+        self.generation = None
+        self.resyncing = False
+
+    def entries_in_order(self):
+        return [self.entries[key[2]] for key in self._keys]
+
+    def reconcile(self, files, generation=None):
+        """
+        Listagem completa comparada com o que já está na grade (ex.: cache
+        mostrado offline): devolve só as operações do que mudou.
+        """
+        incoming = {}
+        for f in files:
+            name = f.setdefault('name', 'Desconhecido')
+            incoming[name] = f
+        removed = [name for name in self.entries if name not in incoming]
+        changed = [f for name, f in incoming.items() if self.entries.get(name) != f]
+        ops = self._apply(removed, changed)
+        self.generation = generation
+        self.resyncing = False
+        return ops
+
+    def apply_delta(self, delta):
+        """
+        Aplica um delta e devolve a lista de operações para a grade:
+        ("remove", idx, None), ("insert", idx, entry), ("replace", idx, entry).
+        Devolve None se a geração base não bate (precisa de resync completo).
+        """
+        if self.resyncing or self.generation is None or delta.get("base") != self.generation:
+            return None
+        ops = self._apply(delta.get("removed", []), delta.get("added", []) + delta.get("changed", []))
+        self.generation = delta.get("generation", self.generation)
+        return ops
+
+    def _apply(self, removed, upserts):
+        ops = []
+        for name in removed:
+            ops.extend(self._remove(name))
+        for entry in upserts:
+            name = entry.get('name')
+            if not name: continue
+            old = self.entries.get(name)
+            if old is not None and self.sort_key(old) == self.sort_key(entry):
+                self.entries[name] = entry
+                ops.append(("replace", bisect.bisect_left(self._keys, self.sort_key(entry)), entry))
+                continue
+            ops.extend(self._remove(name))
+            key = self.sort_key(entry)
+            idx = bisect.bisect_left(self._keys, key)
+            self._keys.insert(idx, key)
+            self.entries[name] = entry
+            ops.append(("insert", idx, entry))
+        return ops
+
+    def _remove(self, name):
+        old = self.entries.pop(name, None)
+        if old is None: return []
+        idx = bisect.bisect_left(self._keys, self.sort_key(old))
+        self._keys.pop(idx)
+        return [("remove", idx, None)]
+
+class RemoteListingCache:
+    """
+    Última listagem conhecida de cada gateway (Sistema/Vigia/<ip>_<porta>.json),
+    para a página remota aparecer na hora na abertura e sem rede. A gravação é
+    atômica e fora da thread da UI.
+    """
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key(ip, port=DEFAULT_PORT):
+        return "".join(c if c.isalnum() or c in ".-" else "_" for c in f"{ip}_{port}")
+
+    def _path(self, key):
+        return os.path.join(self.root, key + ".json")
+
+    def load(self, key):
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                return json.load(f).get("files", [])
+        except (OSError, ValueError):
+            return None
+
+    def save(self, key, files, generation=None):
+        snapshot = {"saved": time.time(), "generation": generation, "files": list(files)}
+        threading.Thread(target=self._write, args=(key, snapshot), daemon=True).start()
+
+    def _write(self, key, snapshot):
+        path = self._path(key)
+        tmp = path + ".tmp"
+        try:
+            with self._lock:
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump(snapshot, f)
+                os.replace(tmp, path)
+        except Exception as e:
+            print(f"⚠️ Erro ao salvar cache do Vigia: {e}")
+
+class VigiaProtocol(asyncio.BufferedProtocol):
+    """Ponte entre o transporte asyncio e o VigiaNetworkClient (recebe direto no buffer do codec)"""
+    def __init__(self, client):
+        self.client = client
+
+    def connection_made(self, transport):
+        self.client._transport = transport
+
+    def get_buffer(self, sizehint):
+        return self.client.codec.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes):
+        codec = self.client.codec
+        codec.buffer_updated(nbytes)
+        try:
+            # Repete porque o handshake pode trocar o modo do codec no meio do lote
+            msgs = codec.messages()
+            while msgs:
+                for msg in msgs:
+                    self.client._on_message(msg)
+                msgs = codec.messages()
+        except ValueError as e:
+            print(f"⚠️ Quadro inválido do Vigia: {e}")
+            self.client._transport.close()
+
+    def pause_writing(self):
+        self.client._can_write.clear()
+
+    def resume_writing(self):
+        self.client._can_write.set()
+
+    def connection_lost(self, exc):
+        self.client._on_transport_lost(exc)
+
 class VigiaNetworkClient:
-    def __init__(self, app_ref):
+    """
+    Cliente do Vigia rodando num event loop asyncio em thread própria: a UI
+    nunca espera rede. Envios entram numa fila limitada (cheia = recusa, em
+    vez de travar quem chamou), pedidos com resposta levam um req_id e as
+    mensagens recebidas chegam ao Kivy em lotes, um Clock por frame.
+    Se a conexão cai sem o usuário pedir, reconecta com backoff exponencial e
+    retoma a sessão (token + última geração da listagem): o gateway só manda
+    o que mudou enquanto estávamos fora.
+    """
+    CONNECT_TIMEOUT = 5
+    REQUEST_TIMEOUT = 15
+    OUTBOX_LIMIT = 256
+    FEATURES = ["listing_delta", "resume", "heartbeat", "sync", "exec_reply", "exec_batch", "xfer"]
+    HEARTBEAT_INTERVAL = 10
+    HEARTBEAT_MISSES = 2      # Pings sem resposta antes de considerar a conexão morta
+    RECONNECT_BASE = 0.5
+    RECONNECT_MAX_DELAY = 30
+    RECONNECT_GIVE_UP = 120   # Segundos tentando antes de desistir e limpar a grade
+
+    def __init__(self, app_ref, post=None):
         self.app = app_ref
-        self.sock = None
         self.connected = False
+        self.connecting = False
         self.ip = None
+        self.codec = VigiaWireCodec()
+        self.listing = RemoteListing()
+        self.delta_sync = False  # Gateway manda listing_delta sozinho
+        # Entrega na thread da UI; substituível (ex.: gateway de teste sem Kivy)
+        self._post = post or self._post_to_kivy
+        self._inbox = []
+        self._inbox_lock = threading.Lock()
+        self._inbox_event = None
+        self._loop = None
+        self._transport = None
+        self._auth_future = None
+        self._outbox = None
+        self._writer_task = None
+        self._can_write = None
+        self._outbox_slots = threading.BoundedSemaphore(self.OUTBOX_LIMIT)
+        self._pending = {}
+        self._req_ids = itertools.count(1)
+        # Sessão resiliente
+        self.session_token = None
+        self.reconnecting = False
+        self._credentials = None
+        self._closing = False
+        self._reconnect_task = None
+        self._heartbeat_task = None
+        self.heartbeat = False
+        self.rtt_ms = None       # Último RTT medido pelo ping
+        self.rtt_avg_ms = None   # Média móvel (EWMA) do RTT
+        self._auth_rejected = False
+        self.transfers = VigiaTransferManager(self)
+        self.features = set()  # O que o gateway anunciou no auth
+        self.bandwidth_bps = None  # Vazão medida nas transferências (EWMA)
+
+    # --- EVENT LOOP ---
+    def _ensure_loop(self):
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(target=self._loop.run_forever, daemon=True, name="vigia-loop").start()
+        return self._loop
+
+    def _post_to_kivy(self, fn, *args):
+        """Junta tudo o que chegou num único Clock: uma rajada de mensagens = um frame"""
+        with self._inbox_lock:
+            self._inbox.append((fn, args))
+            if self._inbox_event is not None: return
+            self._inbox_event = Clock.schedule_once(self._drain_inbox, 0)
+
+    def _drain_inbox(self, dt):
+        with self._inbox_lock:
+            batch, self._inbox = self._inbox, []
+            self._inbox_event = None
+        for fn, args in batch:
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"⚠️ Erro ao processar mensagem do Vigia: {e}")
 
-    def connect(self, ip, pin, port=DEFAULT_PORT):
+    # --- CONEXÃO ---
+    def connect(self, ip, pin, port=DEFAULT_PORT, callback=None):
+        """Não bloqueia: callback(sucesso) é chamado na thread da UI quando terminar"""
+        if self.connected or self.connecting: return
         self.ip = ip
+        self.connecting = True
+        self._closing = False
+        self.session_token = None
+        self._credentials = (ip, pin, port)
+        future = asyncio.run_coroutine_threadsafe(self._connect(ip, pin, port), self._ensure_loop())
+
+        def done(f):
+            ok = not f.cancelled() and f.exception() is None and f.result()
+            self.connecting = False
+            if callback: self._post(callback, bool(ok))
+        future.add_done_callback(done)
+        return future
+
+    async def _connect(self, ip, pin, port, resume=False):
+        loop = asyncio.get_running_loop()
+        self._auth_rejected = False
+        self.codec = VigiaWireCodec(VigiaWireCodec.LEGACY)
+        self._auth_future = loop.create_future()
+        self._can_write = asyncio.Event()
+        self._can_write.set()
         try:
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.sock.settimeout(5)
-            self.sock.connect((ip, port))
+            await asyncio.wait_for(loop.create_connection(lambda: VigiaProtocol(self), ip, port), self.CONNECT_TIMEOUT)
 
             # --- HANDSHAKE DE AUTENTICAÇÃO ---
+            # O handshake é sempre JSON puro; o gateway escolhe o protocolo na resposta
             print(f"🔐 Enviando PIN para {ip}...")
-            auth_payload = json.dumps({"auth_pin": pin}).encode('utf-8')
-            self.sock.sendall(auth_payload)
-
-            # Espera resposta de confirmação (até 1KB é suficiente para status)
-            resp = self.sock.recv(1024)
-            if not resp:
-                print("⛔ Servidor fechou conexão durante Auth.")
-                self.sock.close()
-                return False
-
-            resp_data = json.loads(resp.decode('utf-8'))
+            hello = {
+                "auth_pin": pin,
+                "protocols": VigiaWireCodec.SUPPORTED,
+                "features": self.FEATURES
+            }
+            if resume and self.session_token:
+                # Pede só o que mudou desde a última geração que a grade conhece
+                hello["resume"] = self.session_token
+                hello["since_generation"] = self.listing.generation
+            self._transport.write(self.codec.encode(hello))
+            resp_data = await asyncio.wait_for(self._auth_future, self.CONNECT_TIMEOUT)
 
             if resp_data.get("status") != "auth_ok":
+                self._auth_rejected = True
                 print("⛔ PIN Recusado pelo Gateway.")
-                self.sock.close()
+                self._transport.close()
                 return False
             # ---------------------------------
 
-            self.sock.settimeout(None)
-            self.connected = True
-            print(f"✅ Conectado e Autenticado em {ip}:{port}")
-            self.app.spawn_bubble("Vigia Conectado!", "lan-connect")
-            threading.Thread(target=self.listen_loop, daemon=True).start()
+            if resume:
+                print(f"🔁 Sessão com {ip}:{port} retomada ({'delta' if resp_data.get('resumed') else 'listagem completa'})")
+                return True
+            print(f"✅ Conectado e Autenticado em {ip}:{port} ({self.codec.mode})")
+            self._post(self.app.spawn_bubble, "Vigia Conectado!", "lan-connect")
             # Não precisa pedir list_desktop aqui, o gateway já manda no _send_initial_state após auth
             return True
         except Exception as e:
-            print(f"❌ Falha na conexão/auth: {e}")
-            self.connected = False
+            print(f"❌ Falha na conexão/auth: {e!r}")
+            if self._transport: self._transport.close()
             return False
 
-    def send_command(self, data):
-        if not self.connected or not self.sock: return
+    def _start_session(self, resp_data):
+        """Roda no loop, no mesmo instante em que o auth_ok chega (antes de ler o resto do lote)"""
+        # Gateway antigo não responde "protocol": continua no JSON concatenado
+        self.codec.switch_mode(resp_data.get("protocol", VigiaWireCodec.LEGACY))
+        features = resp_data.get("features", [])
+        self.features = set(features)
+        self.delta_sync = "listing_delta" in features
+        self.heartbeat = "heartbeat" in features
+        self.session_token = resp_data.get("session", self.session_token if resp_data.get("resumed") else None)
+        loop = asyncio.get_running_loop()
+        self._outbox = asyncio.Queue()
+        self._writer_task = loop.create_task(self._writer())
+        if self.heartbeat:
+            self._heartbeat_task = loop.create_task(self._heartbeat())
+        self.connected = True
+        if not resp_data.get("resumed"):
+            # Sessão nova: a listagem completa vem a seguir, a geração antiga não vale mais
+            # (as entradas ficam na tela até o diff com a listagem nova)
+            self._post(self.listing.invalidate)
+
+    def disconnect(self):
+        if self._loop is None: return
+        self._closing = True
+        def close():
+            if self._reconnect_task: self._reconnect_task.cancel()
+            if self._transport: self._transport.close()
+        self._loop.call_soon_threadsafe(close)
+
+    def _on_transport_lost(self, exc):
+        was_connected = self.connected
+        self.connected = False
+        self._transport = None
+        if self._auth_future and not self._auth_future.done():
+            self._auth_future.set_exception(ConnectionError("Servidor fechou conexão durante Auth."))
+        if self._writer_task: self._writer_task.cancel()
+        if self._heartbeat_task: self._heartbeat_task.cancel()
+        self._drop_outbox()
+        for fut in self._pending.values():
+            if not fut.done(): fut.set_exception(ConnectionError("Conexão com o Vigia perdida"))
+        self._pending.clear()
+        if exc: print(f"Erro na escuta (Socket): {exc}")
+        if not was_connected or self.reconnecting: return
+        if self._closing or not self._credentials:
+            self._post(self.app.on_connection_lost)
+            return
+        # Queda inesperada: mantém a grade e tenta voltar sozinho
+        self.reconnecting = True
+        self._post(self.app.on_connection_interrupted)
+        self._reconnect_task = asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _reconnect(self):
+        ip, pin, port = self._credentials
+        started = time.monotonic()
+        delay = self.RECONNECT_BASE
+        attempt = 0
         try:
-            msg = json.dumps(data).encode('utf-8')
-            self.sock.sendall(msg)
-        except Exception as e:
-            print(f"Erro no envio: {e}")
-            self.connected = False
-            Clock.schedule_once(lambda dt: self.app.on_connection_lost(), 0)
-
-    def listen_loop(self):
-        buffer = ""
-        decoder = json.JSONDecoder()
+            while not self._closing:
+                attempt += 1
+                # Jitter para vários aparelhos não baterem no gateway ao mesmo tempo
+                await asyncio.sleep(delay * (0.5 + random.random() / 2))
+                print(f"🔌 Reconectando ao Vigia (tentativa {attempt})...")
+                if await self._connect(ip, pin, port, resume=True):
+                    self.reconnecting = False
+                    self._post(self.app.on_connection_resumed)
+                    return
+                if self._auth_rejected:
+                    break  # PIN recusado: não adianta insistir
+                if time.monotonic() - started > self.RECONNECT_GIVE_UP:
+                    break
+                delay = min(delay * 2, self.RECONNECT_MAX_DELAY)
+        except asyncio.CancelledError:
+            pass
+        self.reconnecting = False
+        self.session_token = None
+        self._post(self.app.on_connection_lost)
+
+    async def _heartbeat(self):
+        """Ping periódico: mede o RTT e derruba conexões mortas (Wi-Fi que some sem RST)"""
+        misses = 0
         while self.connected:
+            await asyncio.sleep(self.HEARTBEAT_INTERVAL)
+            sent = time.monotonic()
             try:
-                chunk = self.sock.recv(4096)
-                if not chunk:
-                    self.connected = False
-                    break
-                buffer += chunk.decode('utf-8')
-                while buffer:
-                    buffer = buffer.strip()
-                    if not buffer: break
-                    try:
-                        obj, idx = decoder.raw_decode(buffer)
-                        Clock.schedule_once(lambda dt, m=obj: self.process_message(m), 0)
-                        buffer = buffer[idx:]
-                    except ValueError:
-                        break
+                await self._request({"command": "ping"}, self.HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                misses += 1
+                print(f"⚠️ Vigia não respondeu ao ping ({misses}/{self.HEARTBEAT_MISSES})")
+                if misses >= self.HEARTBEAT_MISSES and self._transport:
+                    self._transport.abort()
+                    return
+                continue
+            except ConnectionError:
+                return
+            misses = 0
+            rtt = (time.monotonic() - sent) * 1000
+            self.rtt_ms = rtt
+            self.rtt_avg_ms = rtt if self.rtt_avg_ms is None else self.rtt_avg_ms * 0.8 + rtt * 0.2
+            self._post(self.app.on_vigia_rtt, rtt)
+
+    # --- ENVIO ---
+    def send_command(self, data):
+        """Enfileira sem bloquear (qualquer thread). Devolve False se não deu para enfileirar."""
+        if not self.connected: return False
+        if not self._outbox_slots.acquire(blocking=False):
+            print("⚠️ Fila de envio do Vigia cheia, comando descartado.")
+            return False
+        self._loop.call_soon_threadsafe(self._enqueue, data)
+        return True
+
+    def _enqueue(self, data):
+        # No loop: a conexão pode ter caído (e a fila sido trocada) entre o send_command e aqui
+        if not self.connected or self._outbox is None:
+            self._outbox_slots.release()
+            return
+        self._outbox.put_nowait(data)
+
+    def _drop_outbox(self):
+        """Sessão acabou: o que ficou na fila não sai mais, mas devolve as vagas (senão a fila 'enche' sozinha)"""
+        outbox, self._outbox = self._outbox, None
+        while outbox is not None and not outbox.empty():
+            outbox.get_nowait()
+            self._outbox_slots.release()
+
+    def request(self, data, callback=None, timeout=None):
+        """
+        Envia um comando que espera resposta (casada pelo req_id). O callback
+        recebe (resposta, erro) na thread da UI. Devolve um concurrent Future.
+        """
+        if not self.connected:
+            if callback: self._post(callback, None, ConnectionError("Vigia desconectado"))
+            return None
+        future = asyncio.run_coroutine_threadsafe(
+            self._request(dict(data), timeout or self.REQUEST_TIMEOUT), self._loop
+        )
+        if callback:
+            def done(f):
+                if f.cancelled(): self._post(callback, None, asyncio.CancelledError())
+                elif f.exception(): self._post(callback, None, f.exception())
+                else: self._post(callback, f.result(), None)
+            future.add_done_callback(done)
+        return future
+
+    async def _request(self, data, timeout):
+        req_id = next(self._req_ids)
+        data["req_id"] = req_id
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[req_id] = fut
+        try:
+            if not self.send_command(data):
+                raise ConnectionError("Fila de envio cheia")
+            return await asyncio.wait_for(fut, timeout)
+        finally:
+            self._pending.pop(req_id, None)
+
+    async def _writer(self):
+        """Esvazia a fila respeitando o controle de fluxo do transporte (pause_writing)"""
+        while True:
+            data = await self._outbox.get()
+            try:
+                await self._can_write.wait()
+                if self._transport is None: return
+                self._transport.write(self.codec.encode(data))
             except Exception as e:
-                print(f"Erro na escuta (Socket): {e}")
-                self.connected = False
-                break
-        Clock.schedule_once(lambda dt: self.app.on_connection_lost(), 0)
+                print(f"Erro no envio: {e}")
+                if self._transport: self._transport.close()
+                return
+            finally:
+                self._outbox_slots.release()
+
+    # --- RECEPÇÃO (thread do loop) ---
+    def _on_message(self, msg):
+        if not self.connected:
+            # Handshake: a primeira mensagem é a resposta do auth
+            if self._auth_future and not self._auth_future.done():
+                self._auth_future.set_result(msg)
+                if msg.get("status") == "auth_ok": self._start_session(msg)
+            return
+        req_id = msg.get("req_id")
+        if req_id is not None and req_id in self._pending:
+            fut = self._pending[req_id]
+            if not fut.done(): fut.set_result(msg)
+            return
+        self._post(self.process_message, msg)
 
     def process_message(self, msg):
         cmd = msg.get("type") or msg.get("command")
         if "files" in msg:
-            self.app.update_remote_files(msg["files"])
+            # Reconciliação por diff: a grade pode estar mostrando o cache offline
+            ops = self.listing.reconcile(msg["files"], msg.get("generation"))
+            self.app.apply_remote_ops(ops, full=True)
+        elif cmd == "listing_delta":
+            ops = self.listing.apply_delta(msg)
+            if ops is None:
+                self.request_resync()
+            else:
+                self.app.apply_remote_ops(ops)
         elif cmd == "batch_update" or cmd == "fs_event":
-            self.send_command({"command": "list_desktop"})
+            # Com delta sync as mudanças já chegam como listing_delta
+            if not self.delta_sync:
+                self.send_command({"command": "list_desktop"})
+
+    def request_resync(self):
+        """Geração divergiu: ignora deltas até chegar a listagem completa"""
+        if self.listing.resyncing: return
+        print(f"🔄 Listagem remota divergiu (geração {self.listing.generation}), pedindo resync...")
+        self.listing.resyncing = True
+        self.send_command({"command": "list_desktop"})
+
+class VigiaTransfer:
+    """Estado de uma transferência (lido pela UI; só o loop do Vigia escreve)"""
+    def __init__(self, xfer_id, direction, local_path, remote_path, compress):
+        self.xfer_id = xfer_id
+        self.direction = direction  # "upload" (celular → PC) ou "download"
+        self.local_path = local_path
+        self.remote_path = remote_path
+        self.compress = compress
+        self.size = 0
+        self.done_bytes = 0
+        self.wire_bytes = 0  # Bytes úteis que realmente passaram na rede (depois do zlib)
+        self.state = "pending"  # pending, running, waiting, done, error, cancelled
+        self.error = None
+        self.started = time.monotonic()
+        self.finished = None
+        self.resumes = 0
+
+    @property
+    def name(self):
+        return os.path.basename(self.local_path if self.direction == "upload" else self.remote_path)
+
+    @property
+    def fraction(self):
+        return self.done_bytes / self.size if self.size else (1.0 if self.state == "done" else 0.0)
+
+    @property
+    def throughput(self):
+        """Bytes/s do arquivo (não do fio) desde o início"""
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return self.done_bytes / elapsed if elapsed > 0 else 0.0
+
+class VigiaTransferManager:
+    """
+    Canal de arquivos sobre a conexão do Vigia. Os bytes vão em pedaços
+    (CHUNK_SIZE) com CRC32 cada, até WINDOW pedaços em voo ao mesmo tempo, e
+    zlib por pedaço quando compensa. Se a conexão cai, espera o cliente
+    reconectar e continua do offset confirmado: no upload o gateway informa
+    quanto já tem; no download o .part local só guarda o prefixo contíguo.
+
+    Mensagens (todas com req_id, respostas com "status"):
+      xfer_open  {xfer_id, direction, path, size, sha256, chunk_size} -> {offset | size, sha256}
+      xfer_chunk {xfer_id, offset, data(b64), z, crc}                  -> {offset}
+      xfer_read  {xfer_id, offset, length, compress}                   -> {data(b64), z, crc}
+      xfer_close {xfer_id}                                             -> {sha256}
+    """
+    CHUNK_SIZE = 256 * 1024
+    WINDOW = 4
+    CHUNK_RETRIES = 3
+    RESUME_RETRIES = 5  # Interrupções seguidas sem avançar um byte (com o Vigia conectado) antes de desistir
+    PROGRESS_INTERVAL = 0.2
+    # Já comprimidos: zlib só gastaria CPU
+    INCOMPRESSIBLE = (".jpg", ".jpeg", ".png", ".webp", ".gif", ".mp4", ".mkv", ".webm",
+                      ".mp3", ".ogg", ".zip", ".gz", ".xz", ".7z", ".apk", ".pdf")
+
+    def __init__(self, client):
+        self.client = client
+        self.transfers = {}
+        self._tasks = {}
+
+    # --- API (qualquer thread) ---
+    def upload(self, local_path, remote_path=None, compress=None):
+        remote_path = remote_path or os.path.basename(local_path)
+        return self._start("upload", local_path, remote_path, compress)
+
+    def download(self, remote_path, local_path, compress=None):
+        return self._start("download", local_path, remote_path, compress)
+
+    def cancel(self, xfer_id):
+        task = self._tasks.get(xfer_id)
+        if task and self.client._loop:
+            self.client._loop.call_soon_threadsafe(task.cancel)
+
+    async def run(self, direction, local_path, remote_path, compress=None):
+        """Versão aguardável (dentro do loop do Vigia), usada pelo MesaSyncEngine"""
+        transfer = self._new_transfer(direction, local_path, remote_path, compress)
+        await self._run(transfer)
+        return transfer
+
+    def _new_transfer(self, direction, local_path, remote_path, compress):
+        if compress is None:
+            compress = not local_path.lower().endswith(self.INCOMPRESSIBLE)
+        transfer = VigiaTransfer(hashlib.sha1(f"{direction}:{local_path}:{remote_path}".encode()).hexdigest()[:16],
+                                 direction, local_path, remote_path, compress)
+        self.transfers[transfer.xfer_id] = transfer
+        return transfer
+
+    def _start(self, direction, local_path, remote_path, compress):
+        xfer_id = hashlib.sha1(f"{direction}:{local_path}:{remote_path}".encode()).hexdigest()[:16]
+        running = self.transfers.get(xfer_id)
+        if running is not None and xfer_id in self._tasks:
+            return running  # Já em andamento
+        transfer = self._new_transfer(direction, local_path, remote_path, compress)
+        loop = self.client._ensure_loop()
+
+        def spawn():
+            task = loop.create_task(self._run(transfer))
+            self._tasks[transfer.xfer_id] = task
+            task.add_done_callback(lambda t: self._tasks.pop(transfer.xfer_id, None))
+        loop.call_soon_threadsafe(spawn)
+        return transfer
+
+    # --- LOOP DO VIGIA ---
+    async def _run(self, t):
+        run = self._upload if t.direction == "upload" else self._download
+        last_progress = [0.0]
+        failures, failed_at = 0, None
+        try:
+            while True:
+                if not self.client.connected:
+                    t.state = "waiting"
+                    self._progress(t, last_progress, force=True)
+                    if not await self._wait_online():
+                        raise ConnectionError("Vigia desconectado")
+                    t.resumes += 1
+                # Confere a cada (re)conexão: o gateway pode ter sido trocado por um sem o canal de arquivos
+                if "xfer" not in self.client.features:
+                    raise RuntimeError("Gateway não suporta transferências")
+                t.state = "running"
+                try:
+                    await run(t, last_progress)
+                    break
+                except (ConnectionError, asyncio.TimeoutError) as e:
+                    # Queda no meio: o cliente reconecta sozinho, aqui só esperamos e retomamos
+                    print(f"⏸️ Transferência {t.name} interrompida em {t.done_bytes} bytes: {e!r}")
+                    if self.client.connected:
+                        # Conectado e mesmo assim falhando: gateway não responde ao canal de arquivos
+                        failures = failures + 1 if failed_at == t.done_bytes else 1
+                        failed_at = t.done_bytes
+                        if failures >= self.RESUME_RETRIES:
+                            raise ConnectionError(f"sem resposta do PC após {failures} tentativas") from e
+                        await asyncio.sleep(1)
+            t.state = "done"
+            t.finished = time.monotonic()
+            elapsed = t.finished - t.started
+            if t.wire_bytes >= 256 * 1024 and elapsed > 0:
+                bps = t.wire_bytes / elapsed
+                previous = self.client.bandwidth_bps
+                self.client.bandwidth_bps = bps if previous is None else previous * 0.7 + bps * 0.3
+            print(f"📊 {t.direction} {t.name}: {t.size} bytes em {t.finished - t.started:.2f}s "
+                  f"({t.throughput / 1048576:.2f} MiB/s, {t.wire_bytes} no fio, {t.resumes} retomadas)")
+        except asyncio.CancelledError:
+            t.state = "cancelled"
+            if self.client.connected:
+                self.client.send_command({"command": "xfer_close", "xfer_id": t.xfer_id, "abort": True})
+        except Exception as e:
+            t.state = "error"
+            t.error = str(e)
+            print(f"❌ Transferência {t.name} falhou: {e}")
+        t.finished = t.finished or time.monotonic()
+        # Só as em andamento ficam aqui; quem quer o resultado recebe o objeto no on_transfer_finished
+        if self.transfers.get(t.xfer_id) is t: del self.transfers[t.xfer_id]
+        self.client._post(self.client.app.on_transfer_finished, t)
+
+    async def _wait_online(self):
+        """Espera o cliente reconectar (ou desistir de reconectar)"""
+        deadline = time.monotonic() + self.client.RECONNECT_GIVE_UP + self.client.CONNECT_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.client.connected: return True
+            if not self.client.reconnecting: return False
+            await asyncio.sleep(0.5)
+        return False
+
+    def _progress(self, t, last, force=False):
+        now = time.monotonic()
+        if force or now - last[0] >= self.PROGRESS_INTERVAL:
+            last[0] = now
+            self.client._post(self.client.app.on_transfer_progress, t)
+
+    @staticmethod
+    def _file_sha256(path):
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(1024 * 1024)
+                if not block: break
+                h.update(block)
+        return h.hexdigest()
+
+    @staticmethod
+    def _pack_chunk(raw, compress):
+        """CRC sempre do conteúdo original; zlib só fica se diminuiu"""
+        crc = zlib.crc32(raw)
+        payload, z = raw, False
+        if compress:
+            packed = zlib.compress(raw, 1)
+            if len(packed) < len(raw): payload, z = packed, True
+        return base64.b64encode(payload).decode('ascii'), z, crc, len(payload)
+
+    @staticmethod
+    def _unpack_chunk(resp):
+        payload = base64.b64decode(resp.get("data", ""))
+        raw = zlib.decompress(payload) if resp.get("z") else payload
+        if zlib.crc32(raw) != resp.get("crc"):
+            raise ValueError("CRC não confere")
+        return raw, len(payload)
+
+    async def _call(self, msg, timeout=None):
+        resp = await self.client._request(msg, timeout or self.client.REQUEST_TIMEOUT)
+        if resp.get("status") != "ok":
+            raise RuntimeError(resp.get("error") or resp.get("status") or "resposta inválida")
+        return resp
+
+    async def _upload(self, t, last_progress):
+        loop = asyncio.get_running_loop()
+        t.size = os.path.getsize(t.local_path)
+        sha = await loop.run_in_executor(None, self._file_sha256, t.local_path)
+        resp = await self._call({
+            "command": "xfer_open", "xfer_id": t.xfer_id, "direction": "upload",
+            "path": t.remote_path, "size": t.size, "sha256": sha, "chunk_size": self.CHUNK_SIZE
+        })
+        # O gateway diz até onde já tem (retomada); nunca confiamos além do tamanho
+        offset = min(max(int(resp.get("offset", 0)), 0), t.size)
+        t.done_bytes = offset
+
+        def read_chunk(f, pos):
+            f.seek(pos)
+            return self._pack_chunk(f.read(self.CHUNK_SIZE), t.compress)
+
+        async def send_chunk(pos, packed):
+            data, z, crc, wire = packed
+            for attempt in range(self.CHUNK_RETRIES):
+                try:
+                    await self._call({"command": "xfer_chunk", "xfer_id": t.xfer_id, "offset": pos,
+                                      "data": data, "z": z, "crc": crc})
+                    break
+                except RuntimeError:
+                    if attempt == self.CHUNK_RETRIES - 1: raise  # CRC recusado várias vezes
+            t.wire_bytes += wire
+
+        inflight = {}
+        try:
+            with open(t.local_path, 'rb') as f:
+                while offset < t.size or inflight:
+                    while offset < t.size and len(inflight) < self.WINDOW:
+                        packed = await loop.run_in_executor(None, read_chunk, f, offset)
+                        size = min(self.CHUNK_SIZE, t.size - offset)
+                        inflight[loop.create_task(send_chunk(offset, packed))] = size
+                        offset += size
+                    done, _ = await asyncio.wait(inflight, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        size = inflight.pop(task)
+                        task.result()
+                        t.done_bytes += size
+                    self._progress(t, last_progress)
+        finally:
+            for task in inflight: task.cancel()
+
+        resp = await self._call({"command": "xfer_close", "xfer_id": t.xfer_id})
+        if resp.get("sha256", sha) != sha:
+            raise RuntimeError("Checksum final não confere no PC")
+
+    async def _download(self, t, last_progress):
+        loop = asyncio.get_running_loop()
+        # Oculto (ponto na frente): o watcher da Mesa não põe o arquivo pela metade na grade
+        part = os.path.join(os.path.dirname(t.local_path), f".{os.path.basename(t.local_path)}.part")
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        resp = await self._call({
+            "command": "xfer_open", "xfer_id": t.xfer_id, "direction": "download",
+            "path": t.remote_path, "offset": offset, "chunk_size": self.CHUNK_SIZE
+        })
+        t.size = int(resp.get("size", 0))
+        sha = resp.get("sha256")
+        if offset > t.size:
+            offset = 0  # O arquivo no PC mudou/encolheu: o .part não serve
+        t.done_bytes = offset
+
+        async def read_chunk(pos, length):
+            for attempt in range(self.CHUNK_RETRIES):
+                r = await self._call({"command": "xfer_read", "xfer_id": t.xfer_id, "offset": pos,
+                                      "length": length, "compress": t.compress})
+                try:
+                    return await loop.run_in_executor(None, self._unpack_chunk, r)
+                except (ValueError, zlib.error):
+                    if attempt == self.CHUNK_RETRIES - 1: raise
+
+        # Pedaços podem chegar fora de ordem; só gravamos o prefixo contíguo,
+        # assim o tamanho do .part é sempre um ponto de retomada válido
+        inflight, ready = {}, {}
+        next_request = next_write = offset
+        try:
+            with open(part, 'r+b' if offset else 'wb') as f:
+                f.truncate(offset)
+                f.seek(offset)
+                while next_write < t.size:
+                    while next_request < t.size and len(inflight) + len(ready) < self.WINDOW:
+                        length = min(self.CHUNK_SIZE, t.size - next_request)
+                        inflight[loop.create_task(read_chunk(next_request, length))] = next_request
+                        next_request += length
+                    done, _ = await asyncio.wait(inflight, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        ready[inflight.pop(task)] = task.result()
+                    while next_write in ready:
+                        raw, wire = ready.pop(next_write)
+                        await loop.run_in_executor(None, f.write, raw)
+                        next_write += len(raw)
+                        t.done_bytes = next_write
+                        t.wire_bytes += wire
+                        if not raw: raise RuntimeError("Pedaço vazio antes do fim do arquivo")
+                    self._progress(t, last_progress)
+        finally:
+            for task in inflight: task.cancel()
+
+        if sha and await loop.run_in_executor(None, self._file_sha256, part) != sha:
+            os.remove(part)
+            raise RuntimeError("Checksum final não confere (arquivo mudou no PC?)")
+        os.replace(part, t.local_path)
+        self.client.send_command({"command": "xfer_close", "xfer_id": t.xfer_id})
+
+class MetadataStore:
+    """
+    Banco único (SQLite) com os atributos semânticos de todos os arquivos.
+    'attrs' guarda o JSON completo; status/state/tags são copiados para colunas
+    e tabelas indexadas, para consultas por pasta, tag, status ou estado.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            dir TEXT NOT NULL,
+            name TEXT NOT NULL,
+            status TEXT,
+            state TEXT,
+            attrs TEXT NOT NULL DEFAULT '{}'
+        );
+        CREATE INDEX IF NOT EXISTS idx_files_dir ON files(dir);
+        CREATE INDEX IF NOT EXISTS idx_files_status ON files(status);
+        CREATE INDEX IF NOT EXISTS idx_files_state ON files(state);
+        CREATE TABLE IF NOT EXISTS tags (
+            path TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            PRIMARY KEY (path, tag)
+        );
+        CREATE INDEX IF NOT EXISTS idx_tags_tag ON tags(tag);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.generation = 0  # Sobe a cada escrita (índices de busca usam para saber se estão velhos)
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self.conn.commit()
+
+    @staticmethod
+    def _norm(path):
+        return os.path.abspath(path)
+
+    def _write(self, path, attrs):
+        self.generation += 1
+        path = self._norm(path)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (path, dir, name, status, state, attrs) VALUES (?, ?, ?, ?, ?, ?)",
+            (path, os.path.dirname(path), os.path.basename(path), attrs.get("status"), attrs.get("state"), json.dumps(attrs))
+        )
+        self.conn.execute("DELETE FROM tags WHERE path = ?", (path,))
+        tags = {str(t).strip().lower() for t in attrs.get("tags", []) if str(t).strip()}
+        self.conn.executemany("INSERT INTO tags (path, tag) VALUES (?, ?)", [(path, t) for t in tags])
+
+    def get(self, path):
+        with self._lock:
+            row = self.conn.execute("SELECT attrs FROM files WHERE path = ?", (self._norm(path),)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def get_directory(self, directory):
+        """Todos os atributos de uma pasta numa consulta: {nome: attrs}"""
+        with self._lock:
+            rows = self.conn.execute("SELECT name, attrs FROM files WHERE dir = ?", (self._norm(directory),)).fetchall()
+        return {name: json.loads(attrs) for name, attrs in rows}
+
+    def update_many(self, updates):
+        """Mescla {caminho: {chave: valor}} numa única transação"""
+        with self._lock:
+            try:
+                with self.conn:
+                    for path, changes in updates.items():
+                        row = self.conn.execute("SELECT attrs FROM files WHERE path = ?", (self._norm(path),)).fetchone()
+                        attrs = json.loads(row[0]) if row else {}
+                        attrs.update(changes)
+                        self._write(path, attrs)
+                return True
+            except sqlite3.Error as e:
+                print(f"Erro ao salvar metadados: {e}")
+                return False
+
+    def update(self, path, changes):
+        return self.update_many({path: changes})
+
+    def delete(self, path):
+        path = self._norm(path)
+        prefix = path.rstrip(os.sep) + os.sep
+        self.generation += 1
+        with self._lock, self.conn:
+            # Pastas levam junto os atributos de tudo que estava dentro
+            self.conn.execute("DELETE FROM files WHERE path = ? OR substr(path, 1, ?) = ?", (path, len(prefix), prefix))
+            self.conn.execute("DELETE FROM tags WHERE path = ? OR substr(path, 1, ?) = ?", (path, len(prefix), prefix))
+
+    def move(self, old_path, new_path):
+        old, new = self._norm(old_path), self._norm(new_path)
+        prefix = old.rstrip(os.sep) + os.sep
+        self.generation += 1
+        with self._lock, self.conn:
+            # O destino fica com as tags da origem (não soma com as que já tinha)
+            self.conn.execute("DELETE FROM tags WHERE path = ? AND EXISTS (SELECT 1 FROM files WHERE path = ?)", (new, old))
+            self.conn.execute("UPDATE OR REPLACE files SET path = ?, dir = ?, name = ? WHERE path = ?",
+                              (new, os.path.dirname(new), os.path.basename(new), old))
+            self.conn.execute("UPDATE OR REPLACE tags SET path = ? WHERE path = ?", (new, old))
+            # Pastas levam junto os atributos de tudo que estava dentro
+            self.conn.execute("UPDATE OR REPLACE files SET path = ? || substr(path, ?), dir = ? || substr(dir, ?) "
+                              "WHERE substr(path, 1, ?) = ?", (new, len(old) + 1, new, len(old) + 1, len(prefix), prefix))
+            self.conn.execute("UPDATE OR REPLACE tags SET path = ? || substr(path, ?) WHERE substr(path, 1, ?) = ?",
+                              (new, len(old) + 1, len(prefix), prefix))
+
+    def migrate_sidecars(self, root):
+        """Importa os antigos .<nome>.json uma única vez (os arquivos ficam no disco)"""
+        with self._lock:
+            if self.conn.execute("SELECT 1 FROM meta WHERE key = 'sidecars_migrated'").fetchone():
+                return 0
+        count = 0
+        with self._lock, self.conn:
+            for directory, dirs, files in os.walk(root):
+                dirs[:] = [d for d in dirs if not d.startswith('.')]
+                names = set(files) | set(dirs)
+                for f in files:
+                    if not (f.startswith('.') and f.endswith('.json')): continue
+                    target = f[1:-5]
+                    if target not in names: continue
+                    try:
+                        with open(os.path.join(directory, f), 'r') as fh: attrs = json.load(fh)
+                    except Exception:
+                        continue
+                    if isinstance(attrs, dict):
+                        self._write(os.path.join(directory, target), attrs)
+                        count += 1
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('sidecars_migrated', ?)", (str(time.time()),))
+        print(f"🗃️ Metadados: {count} sidecars migrados para {self.db_path}")
+        return count
+
+class MesaSyncEngine:
+    """
+    Sincronização em duas vias entre a Mesa do celular e uma pasta do PC
+    (via Vigia). Para cada arquivo guarda o hash do último estado sincronizado
+    (a "base"): mudou só de um lado = copia para o outro; mudou dos dois =
+    conflito, vence o mais recente e o perdedor vira versão no VersionStore.
+
+    Arquivos modificados não vão inteiros: cada lado troca assinaturas de
+    pedaços (cortes definidos pelo conteúdo, os mesmos do VersionStore) e só os
+    pedaços que o outro lado não tem viajam. Arquivos novos ou grandes demais
+    para um delta usam o canal de transferência (resumível).
+
+    Mensagens (com req_id, respostas com "status"):
+      sync_manifest  {root}                                  -> {files: [{path, size, mtime, sha256}]}
+      sync_signature {root, path, chunking}                  -> {sha256, signature: [[hash, len], ...]}
+      sync_delta     {root, path, chunking, signature}       -> {sha256, mtime, ops}
+      sync_patch     {root, path, base_sha256, sha256, ops}  -> {}  ("conflict" se a base mudou)
+      sync_delete    {root, path, base_sha256}               -> {}
+    Ops: ["c", offset, tamanho] copia da base de quem recebe; ["d", base64] dados novos.
+    """
+    SIG_MIN_CHUNK = 4 * 1024
+    SIG_MAX_CHUNK = 64 * 1024
+    SIG_CUT_MASK = 0xFF
+    INLINE_LIMIT = 8 * 1024 * 1024  # Delta com mais dados novos que isso vai pelo canal de transferência
+    DEBOUNCE = 5                    # Espera a pasta sossegar depois de uma mudança local
+    INTERVAL = 60                   # Rodada periódica para pegar mudanças do PC
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sync_state (
+            pair TEXT NOT NULL,
+            path TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            size INTEGER,
+            mtime REAL,
+            PRIMARY KEY (pair, path)
+        );
+    """
+
+    def __init__(self, client, db_path, local_root, remote_root="Mesa", max_bytes_per_sec=0):
+        self.client = client
+        self.local_root = local_root
+        self.remote_root = remote_root
+        self.max_bytes_per_sec = max_bytes_per_sec  # 0 = sem limite
+        self.paused = False
+        self.running = False
+        self.pair = None
+        self.stats = {"runs": 0, "pushed": 0, "pulled": 0, "deleted": 0, "conflicts": 0,
+                      "bytes_sent": 0, "bytes_received": 0, "bytes_saved": 0}
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(self.SCHEMA)
+        self.conn.commit()
+        self._task = None
+        self._wake = None
+        self._bucket = (0.0, time.monotonic())  # (bytes disponíveis, último refil)
+
+    @property
+    def chunking(self):
+        return {"min": self.SIG_MIN_CHUNK, "max": self.SIG_MAX_CHUNK, "mask": self.SIG_CUT_MASK}
+
+    # --- API (qualquer thread) ---
+    def start(self):
+        if self._task: return
+        ip, _pin, port = self.client._credentials
+        self.pair = f"{RemoteListingCache.key(ip, port)}:{self.remote_root}"
+        loop = self.client._ensure_loop()
+        def spawn():
+            self._wake = asyncio.Event()
+            self._task = loop.create_task(self._loop())
+        loop.call_soon_threadsafe(spawn)
+
+    def stop(self):
+        if self._task and self.client._loop:
+            self.client._loop.call_soon_threadsafe(self._task.cancel)
+        self._task = None
+
+    def request_run(self):
+        """Mudança local: agenda uma rodada (com debounce)"""
+        if self._task and self._wake:
+            self.client._loop.call_soon_threadsafe(self._wake.set)
+
+    def set_throttle(self, max_bytes_per_sec):
+        self.max_bytes_per_sec = max(0, int(max_bytes_per_sec))
+
+    def pause(self): self.paused = True
+
+    def resume(self):
+        self.paused = False
+        self.request_run()
+
+    # --- ESTADO (base da última sincronização) ---
+    def _state(self):
+        with self._lock:
+            rows = self.conn.execute("SELECT path, hash, size, mtime FROM sync_state WHERE pair = ?", (self.pair,)).fetchall()
+        return {r[0]: {"hash": r[1], "size": r[2], "mtime": r[3]} for r in rows}
+
+    def _set_state(self, rel, file_hash, size=None, mtime=None):
+        with self._lock, self.conn:
+            if file_hash is None:
+                self.conn.execute("DELETE FROM sync_state WHERE pair = ? AND path = ?", (self.pair, rel))
+            else:
+                self.conn.execute("INSERT OR REPLACE INTO sync_state (pair, path, hash, size, mtime) VALUES (?, ?, ?, ?, ?)",
+                                  (self.pair, rel, file_hash, size, mtime))
+
+    # --- LOOP DO VIGIA ---
+    async def _loop(self):
+        first = True
+        while True:
+            if not first:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.INTERVAL)
+                    await asyncio.sleep(self.DEBOUNCE)  # Junta uma rajada de mudanças numa rodada só
+                except asyncio.TimeoutError:
+                    pass
+            first = False
+            self._wake.clear()
+            if self.paused or not self.client.connected: continue
+            try:
+                self.running = True
+                summary = await self.sync_once()
+                self.client._post(self.client.app.on_sync_finished, summary)
+            except (ConnectionError, asyncio.TimeoutError) as e:
+                print(f"⏸️ Sincronização interrompida: {e!r}")
+            except Exception as e:
+                print(f"❌ Erro na sincronização: {e}")
+            finally:
+                self.running = False
+
+    async def sync_once(self):
+        """Uma rodada completa; devolve {pushed, pulled, deleted, conflicts}"""
+        loop = asyncio.get_running_loop()
+        base = await loop.run_in_executor(None, self._state)
+        local = await loop.run_in_executor(None, self._scan_local, base)
+        resp = await self._call({"command": "sync_manifest", "root": self.remote_root})
+        remote = {f["path"]: f for f in resp.get("files", [])}
+        summary = {"pushed": 0, "pulled": 0, "deleted": 0, "conflicts": 0}
+
+        for rel in sorted(set(local) | set(remote) | set(base)):
+            while self.paused:
+                await asyncio.sleep(1)
+            if not self.client.connected:
+                raise ConnectionError("Vigia desconectado")
+            l, r, b = local.get(rel), remote.get(rel), base.get(rel)
+            lh, rh, bh = l and l["hash"], r and r["sha256"], b and b["hash"]
+            if lh == rh:
+                if lh != bh:
+                    await loop.run_in_executor(None, self._set_state, rel, lh, l and l["size"], l and l["mtime"])
+                continue
+            try:
+                if lh == bh:
+                    await self._apply_remote_side(rel, l, r, summary)
+                elif rh == bh:
+                    await self._apply_local_side(rel, l, r, summary)
+                else:
+                    await self._resolve_conflict(rel, l, r, summary)
+            except RuntimeError as e:
+                # Um arquivo com problema (ex: mudou no PC durante o patch) não para a rodada
+                print(f"⚠️ Sync de {rel} adiado: {e}")
+
+        self.stats["runs"] += 1
+        for key, value in summary.items(): self.stats[key] += value
+        return summary
+
+    async def _apply_remote_side(self, rel, l, r, summary):
+        """Só o PC mudou"""
+        if r is None:
+            await self._delete_local(rel)
+            summary["deleted"] += 1
+        else:
+            await self._pull(rel, l, r)
+            summary["pulled"] += 1
+
+    async def _apply_local_side(self, rel, l, r, summary):
+        """Só o celular mudou"""
+        if l is None:
+            await self._call({"command": "sync_delete", "root": self.remote_root, "path": rel,
+                              "base_sha256": r["sha256"]})
+            await asyncio.get_running_loop().run_in_executor(None, self._set_state, rel, None)
+            summary["deleted"] += 1
+        else:
+            await self._push(rel, l, r)
+            summary["pushed"] += 1
+
+    async def _resolve_conflict(self, rel, l, r, summary):
+        """Os dois lados mudaram: vence o mais recente, o perdedor fica no histórico"""
+        loop = asyncio.get_running_loop()
+        summary["conflicts"] += 1
+        local_path = self._local_path(rel)
+        if l is None or r is None:
+            # Apagado de um lado e editado do outro: a edição vence
+            if l is None: await self._pull(rel, None, r)
+            else: await self._push(rel, l, None)
+            return
+        print(f"⚔️ Conflito em {rel}: celular {l['mtime']:.0f} x PC {r.get('mtime', 0):.0f}")
+        if l["mtime"] >= r.get("mtime", 0):
+            # Celular vence: guarda a versão do PC no histórico do arquivo local antes de sobrescrever
+            tmp = os.path.join(os.path.dirname(local_path), f".{os.path.basename(local_path)}.sync-remote")
+            try:
+                await self._fetch_to(rel, local_path, tmp, r)
+                if MetadataManager.versions:
+                    await loop.run_in_executor(None, lambda: MetadataManager.versions.save(local_path, source_path=tmp))
+            finally:
+                if os.path.exists(tmp): os.remove(tmp)
+            await self._push(rel, l, r)
+        else:
+            await loop.run_in_executor(None, MetadataManager.save_version, local_path)
+            await self._pull(rel, l, r)
+
+    # --- OPERAÇÕES ---
+    def _local_path(self, rel):
+        return os.path.join(self.local_root, *rel.split("/"))
+
+    def _remote_path(self, rel):
+        return f"{self.remote_root}/{rel}"
+
+    async def _call(self, msg):
+        resp = await self.client._request(msg, self.client.REQUEST_TIMEOUT)
+        if resp.get("status") != "ok":
+            raise RuntimeError(resp.get("error") or resp.get("status") or "resposta inválida")
+        return resp
+
+    async def _push(self, rel, l, r):
+        loop = asyncio.get_running_loop()
+        local_path = self._local_path(rel)
+        remote_sig = []
+        if r is not None:
+            resp = await self._call({"command": "sync_signature", "root": self.remote_root, "path": rel,
+                                     "chunking": self.chunking})
+            remote_sig = resp.get("signature", [])
+        ops, literal, size = await loop.run_in_executor(None, self._build_delta, local_path, remote_sig)
+        if literal > self.INLINE_LIMIT:
+            # Quase tudo novo e grande: canal de transferência (resumível, com progresso no feed)
+            await self._throttle(literal)
+            t = await self.client.transfers.run("upload", local_path, self._remote_path(rel))
+            if t.state != "done": raise RuntimeError(t.error or t.state)
+        else:
+            await self._throttle(literal)
+            await self._call({"command": "sync_patch", "root": self.remote_root, "path": rel,
+                              "base_sha256": r and r["sha256"], "sha256": l["hash"], "ops": ops})
+        self.stats["bytes_sent"] += literal
+        self.stats["bytes_saved"] += size - literal
+        await loop.run_in_executor(None, self._set_state, rel, l["hash"], l["size"], l["mtime"])
+
+    async def _fetch_to(self, rel, base_path, out_path, r):
+        """Reconstrói em out_path o arquivo do PC, usando base_path (se existir) como base do delta"""
+        loop = asyncio.get_running_loop()
+        local_sig = []
+        if base_path and os.path.exists(base_path):
+            local_sig = await loop.run_in_executor(None, self._signature, base_path)
+        if not local_sig and r.get("size", 0) > self.INLINE_LIMIT:
+            await self._throttle(r["size"])
+            t = await self.client.transfers.run("download", out_path, self._remote_path(rel))
+            if t.state != "done": raise RuntimeError(t.error or t.state)
+            self.stats["bytes_received"] += r["size"]
+            return
+        resp = await self._call({"command": "sync_delta", "root": self.remote_root, "path": rel,
+                                 "chunking": self.chunking, "signature": local_sig})
+        literal = await loop.run_in_executor(None, self._apply_delta, base_path, resp.get("ops", []), out_path, resp.get("sha256"))
+        await self._throttle(literal)
+        self.stats["bytes_received"] += literal
+        self.stats["bytes_saved"] += max(r.get("size", 0) - literal, 0)
+
+    async def _pull(self, rel, l, r):
+        loop = asyncio.get_running_loop()
+        local_path = self._local_path(rel)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        # Oculto, como o .part das transferências: não aparece na grade durante o pull
+        tmp = os.path.join(os.path.dirname(local_path), f".{os.path.basename(local_path)}.sync-tmp")
+        try:
+            await self._fetch_to(rel, local_path if l else None, tmp, r)
+            os.replace(tmp, local_path)
+        finally:
+            if os.path.exists(tmp): os.remove(tmp)
+        st = os.stat(local_path)
+        await loop.run_in_executor(None, self._set_state, rel, r["sha256"], st.st_size, st.st_mtime)
+
+    async def _delete_local(self, rel):
+        loop = asyncio.get_running_loop()
+        local_path = self._local_path(rel)
+        # Apagado no PC: some daqui também, mas o conteúdo fica recuperável no histórico
+        await loop.run_in_executor(None, MetadataManager.save_version, local_path)
+        if os.path.exists(local_path): os.remove(local_path)
+        MetadataManager.forget(local_path)
+        await loop.run_in_executor(None, self._set_state, rel, None)
+
+    async def _throttle(self, nbytes):
+        """Balde de fichas: no máximo max_bytes_per_sec em média (rajada de 1s)"""
+        rate = self.max_bytes_per_sec
+        if not rate or nbytes <= 0: return
+        tokens, last = self._bucket
+        now = time.monotonic()
+        tokens = min(rate, tokens + (now - last) * rate) - nbytes
+        self._bucket = (tokens, now)
+        if tokens < 0:
+            await asyncio.sleep(-tokens / rate)
+
+    # --- ARQUIVOS (executor) ---
+    def _scan_local(self, base):
+        """{rel: {hash, size, mtime}}; só recalcula o hash de quem mudou de tamanho/mtime"""
+        found = {}
+        for dirpath, dirnames, filenames in os.walk(self.local_root):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            for name in filenames:
+                if name.startswith('.') or name.endswith((".part", ".tmp", ".sync-tmp", ".sync-remote")): continue
+                full = os.path.join(dirpath, name)
+                rel = os.path.relpath(full, self.local_root).replace(os.sep, "/")
+                try:
+                    st = os.stat(full)
+                except OSError:
+                    continue
+                known = base.get(rel)
+                if known and known["size"] == st.st_size and known["mtime"] == st.st_mtime:
+                    file_hash = known["hash"]
+                else:
+                    file_hash = VigiaTransferManager._file_sha256(full)
+                found[rel] = {"hash": file_hash, "size": st.st_size, "mtime": st.st_mtime}
+        return found
+
+    def _chunks(self, path):
+        with open(path, 'rb') as f:
+            yield from VersionStore.iter_content_chunks(f, self.SIG_MIN_CHUNK, self.SIG_MAX_CHUNK, self.SIG_CUT_MASK)
+
+    def _signature(self, path):
+        return [[hashlib.sha256(chunk).hexdigest(), len(chunk)] for chunk in self._chunks(path)]
+
+    def _build_delta(self, path, remote_sig):
+        """Ops para transformar o arquivo do outro lado (remote_sig) no nosso. Devolve (ops, bytes novos, tamanho)"""
+        offsets, pos = {}, 0
+        for chunk_hash, length in remote_sig:
+            offsets.setdefault(chunk_hash, (pos, length))
+            pos += length
+        ops, literal, size, pending = [], 0, 0, bytearray()
+        for chunk in self._chunks(path):
+            size += len(chunk)
+            known = offsets.get(hashlib.sha256(chunk).hexdigest())
+            if known is None:
+                pending += chunk
+                continue
+            if pending:
+                ops.append(["d", base64.b64encode(pending).decode('ascii')])
+                literal += len(pending)
+                pending = bytearray()
+            start, length = known
+            if ops and ops[-1][0] == "c" and ops[-1][1] + ops[-1][2] == start:
+                ops[-1][2] += length  # Pedaços vizinhos na base viram uma cópia só
+            else:
+                ops.append(["c", start, length])
+        if pending:
+            ops.append(["d", base64.b64encode(pending).decode('ascii')])
+            literal += len(pending)
+        return ops, literal, size
+
+    @staticmethod
+    def _apply_delta(base_path, ops, out_path, expected_sha=None):
+        """Monta out_path a partir da base + ops; confere o sha256. Devolve os bytes novos recebidos."""
+        digest, literal = hashlib.sha256(), 0
+        base = open(base_path, 'rb') if base_path and os.path.exists(base_path) else None
+        try:
+            with open(out_path, 'wb') as out:
+                for op in ops:
+                    if op[0] == "c":
+                        if base is None: raise RuntimeError("Delta referencia uma base que não existe")
+                        base.seek(op[1])
+                        data = base.read(op[2])
+                    else:
+                        data = base64.b64decode(op[1])
+                        literal += len(data)
+                    digest.update(data)
+                    out.write(data)
+        finally:
+            if base: base.close()
+        if expected_sha and digest.hexdigest() != expected_sha:
+            raise RuntimeError("Checksum do arquivo reconstruído não confere")
+        return literal
+
+class VersionStore:
+    """
+    Histórico de versões endereçado por conteúdo. Cada arquivo é quebrado em
+    pedaços (cortes em fim de linha escolhidos pelo próprio conteúdo, então uma
+    edição no meio de um texto grande só gera pedaços novos ao redor dela), cada
+    pedaço é gravado uma única vez em objects/<hash> (zlib opcional) e o log de
+    versões de cada arquivo fica numa tabela SQLite.
+    """
+    MIN_CHUNK = 16 * 1024
+    MAX_CHUNK = 256 * 1024
+    CUT_MASK = 0x3FF          # ~1 corte a cada 1024 linhas depois do mínimo
+    KEEP_LAST = 10            # Sempre mantém as N últimas versões
+    KEEP_DAILY_DAYS = 30      # Depois disso, uma por dia durante 30 dias
+    KEEP_WEEKLY_WEEKS = 52    # E uma por semana durante um ano
+    GC_EVERY = 20             # Varre blobs órfãos a cada N versões podadas
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS versions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            path TEXT NOT NULL,
+            ts REAL NOT NULL,
+            size INTEGER NOT NULL,
+            hash TEXT NOT NULL,
+            chunks TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_versions_path_ts ON versions(path, ts);
+        CREATE TABLE IF NOT EXISTS legacy_imports (dir TEXT PRIMARY KEY, ts REAL);
+    """
+    LEGACY_TS_FORMAT = "%Y-%m-%d_%H-%M-%S"  # Prefixo das cópias antigas em .versions
+
+    def __init__(self, root, compress=True):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.compress = compress
+        self._lock = threading.RLock()
+        self._pruned_since_gc = 0
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(root, "versions.db"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(self.SCHEMA)
+        self.conn.commit()
+
+    @staticmethod
+    def _norm(path):
+        return os.path.abspath(path)
+
+    def _object_path(self, chunk_hash):
+        return os.path.join(self.objects_dir, chunk_hash[:2], chunk_hash[2:])
+
+    def _iter_chunks(self, f):
+        return self.iter_content_chunks(f, self.MIN_CHUNK, self.MAX_CHUNK, self.CUT_MASK)
+
+    @staticmethod
+    def iter_content_chunks(f, min_chunk, max_chunk, cut_mask):
+        """Cortes definidos pelo conteúdo (também usado nas assinaturas do MesaSyncEngine)"""
+        buf = bytearray()
+        while True:
+            line = f.readline(max_chunk)
+            if not line: break
+            buf += line
+            if len(buf) >= max_chunk or (len(buf) >= min_chunk and (zlib.crc32(line) & cut_mask) == 0):
+                yield bytes(buf)
+                buf.clear()
+        if buf: yield bytes(buf)
+
+    def _put_chunk(self, data):
+        chunk_hash = hashlib.sha256(data).hexdigest()
+        obj = self._object_path(chunk_hash)
+        if not os.path.exists(obj):  # Dedup: pedaço já conhecido não é regravado
+            os.makedirs(os.path.dirname(obj), exist_ok=True)
+            payload = b"R" + data
+            if self.compress:
+                packed = zlib.compress(data, 6)
+                if len(packed) < len(data): payload = b"Z" + packed
+            tmp = f"{obj}.{threading.get_ident()}.tmp"
+            with open(tmp, 'wb') as f: f.write(payload)
+            os.replace(tmp, obj)
+        return chunk_hash
+
+    def _get_chunk(self, chunk_hash):
+        with open(self._object_path(chunk_hash), 'rb') as f: payload = f.read()
+        return zlib.decompress(payload[1:]) if payload[:1] == b"Z" else payload[1:]
+
+    def save(self, file_path, ts=None, source_path=None):
+        """Guarda o conteúdo atual como versão. Devolve o id (ou o da última, se nada mudou).
+        source_path permite registrar outro arquivo (ex: cópia antiga) como versão de file_path."""
+        path = self._norm(file_path)
+        with self._lock:
+            file_hash = hashlib.sha256()
+            chunks, size = [], 0
+            with open(source_path or path, 'rb') as f:
+                for chunk in self._iter_chunks(f):
+                    file_hash.update(chunk)
+                    size += len(chunk)
+                    chunks.append(self._put_chunk(chunk))
+            digest = file_hash.hexdigest()
+            if source_path:
+                same = self.conn.execute("SELECT id FROM versions WHERE path = ? AND hash = ?", (path, digest)).fetchone()
+                if same: return same[0]
+            else:
+                last = self.conn.execute("SELECT id, hash FROM versions WHERE path = ? ORDER BY ts DESC LIMIT 1", (path,)).fetchone()
+                if last and last[1] == digest:
+                    return last[0]
+            with self.conn:
+                cur = self.conn.execute(
+                    "INSERT INTO versions (path, ts, size, hash, chunks) VALUES (?, ?, ?, ?, ?)",
+                    (path, ts if ts is not None else time.time(), size, digest, json.dumps(chunks))
+                )
+            self.apply_retention(path)
+            return cur.lastrowid
+
+    def list(self, file_path, offset=0, limit=-1):
+        """Uma página do histórico (mais nova primeiro), direto do índice (path, ts)"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT id, ts, size, hash FROM versions WHERE path = ? ORDER BY ts DESC LIMIT ? OFFSET ?",
+                (self._norm(file_path), limit, offset)
+            ).fetchall()
+        return [{"id": r[0], "ts": r[1], "size": r[2], "hash": r[3]} for r in rows]
+
+    def count(self, file_path):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM versions WHERE path = ?", (self._norm(file_path),)).fetchone()[0]
+
+    def import_legacy_dir(self, directory):
+        """
+        Traz as cópias antigas de <pasta>/.versions para o índice, uma vez por pasta.
+        O nome é interpretado como '<data>_<arquivo>' com o nome EXATO do arquivo
+        (o endswith antigo misturava 'a.txt' com 'nota.txt').
+        """
+        directory = self._norm(directory)
+        legacy_dir = os.path.join(directory, ".versions")
+        with self._lock:
+            if self.conn.execute("SELECT 1 FROM legacy_imports WHERE dir = ?", (directory,)).fetchone():
+                return 0
+            imported = 0
+            if os.path.isdir(legacy_dir):
+                prefix_len = len(datetime.now().strftime(self.LEGACY_TS_FORMAT))
+                for backup in os.listdir(legacy_dir):
+                    try:
+                        ts = datetime.strptime(backup[:prefix_len], self.LEGACY_TS_FORMAT).timestamp()
+                    except ValueError:
+                        continue
+                    filename = backup[prefix_len + 1:]
+                    if not filename: continue
+                    try:
+                        self.save(os.path.join(directory, filename), ts=ts, source_path=os.path.join(legacy_dir, backup))
+                        imported += 1
+                    except OSError as e:
+                        print(f"⚠️ [Versões] Cópia antiga ignorada ({backup}): {e}")
+            with self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO legacy_imports (dir, ts) VALUES (?, ?)", (directory, time.time()))
+        if imported: print(f"🗂️ [Versões] {imported} cópias antigas indexadas de {legacy_dir}")
+        return imported
+
+    def restore(self, file_path, version_id):
+        path = self._norm(file_path)
+        with self._lock:
+            row = self.conn.execute("SELECT chunks FROM versions WHERE id = ? AND path = ?", (version_id, path)).fetchone()
+            if not row: return False
+            # Nome com ponto, como o .part dos downloads: a cópia a meio caminho não vai para a grade
+            tmp = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.restore.tmp")
+            with open(tmp, 'wb') as f:
+                for chunk_hash in json.loads(row[0]):
+                    f.write(self._get_chunk(chunk_hash))
+            os.replace(tmp, path)
+        return True
+
+    def move(self, old_path, new_path):
+        old, new = self._norm(old_path), self._norm(new_path)
+        prefix = old.rstrip(os.sep) + os.sep
+        with self._lock, self.conn:
+            # Pasta renomeada leva junto o histórico de tudo que estava dentro
+            self.conn.execute("UPDATE versions SET path = ? WHERE path = ?", (new, old))
+            self.conn.execute("UPDATE versions SET path = ? || substr(path, ?) WHERE substr(path, 1, ?) = ?",
+                              (new, len(old) + 1, len(prefix), prefix))
+            self.conn.execute("UPDATE OR REPLACE legacy_imports SET dir = ? || substr(dir, ?) WHERE dir = ? OR substr(dir, 1, ?) = ?",
+                              (new, len(old) + 1, old, len(prefix), prefix))
+
+    def forget(self, file_path):
+        path = self._norm(file_path)
+        prefix = path.rstrip(os.sep) + os.sep
+        with self._lock, self.conn:
+            # Pasta apagada leva junto o histórico de tudo que estava dentro
+            cur = self.conn.execute("DELETE FROM versions WHERE path = ? OR substr(path, 1, ?) = ?", (path, len(prefix), prefix))
+        self._schedule_gc(max(cur.rowcount, 1))
+
+    def apply_retention(self, file_path):
+        """Últimas N sempre; depois uma por dia, depois uma por semana; o resto sai."""
+        now = time.time()
+        rows = self.conn.execute("SELECT id, ts FROM versions WHERE path = ? ORDER BY ts DESC", (file_path,)).fetchall()
+        doomed, seen_buckets = [], set()
+        for i, (version_id, ts) in enumerate(rows):
+            if i < self.KEEP_LAST: continue
+            age_days = (now - ts) / 86400
+            if age_days <= self.KEEP_DAILY_DAYS:
+                bucket = ("d", int(ts // 86400))
+            elif age_days <= self.KEEP_DAILY_DAYS + self.KEEP_WEEKLY_WEEKS * 7:
+                bucket = ("w", int(ts // (86400 * 7)))
+            else:
+                doomed.append(version_id)
+                continue
+            # Linhas vêm da mais nova para a mais antiga: fica a mais nova de cada balde
+            if bucket in seen_buckets: doomed.append(version_id)
+            else: seen_buckets.add(bucket)
+        if doomed:
+            with self.conn:
+                self.conn.executemany("DELETE FROM versions WHERE id = ?", [(d,) for d in doomed])
+            self._schedule_gc(len(doomed))
+
+    def _schedule_gc(self, pruned):
+        self._pruned_since_gc += pruned
+        if self._pruned_since_gc >= self.GC_EVERY:
+            self._pruned_since_gc = 0
+            threading.Thread(target=self.gc, daemon=True).start()
+
+    def gc(self):
+        """Marca e varre: apaga blobs que nenhuma versão referencia mais."""
+        with self._lock:
+            referenced = set()
+            for (chunks,) in self.conn.execute("SELECT chunks FROM versions"):
+                referenced.update(json.loads(chunks))
+            removed = 0
+            for prefix in os.listdir(self.objects_dir):
+                sub = os.path.join(self.objects_dir, prefix)
+                if not os.path.isdir(sub): continue
+                for name in os.listdir(sub):
+                    if prefix + name not in referenced:
+                        try:
+                            os.remove(os.path.join(sub, name))
+                            removed += 1
+                        except OSError:
+                            pass
+        if removed: print(f"🧹 [Versões] {removed} blobs órfãos removidos")
+        return removed
 
 class MetadataManager:
+    store = None  # MetadataStore; sem ele, cai nos sidecars JSON antigos
+    versions = None  # VersionStore (histórico deduplicado)
+    @staticmethod
+    def init_store(db_path, migrate_root=None):
+        try:
+            MetadataManager.store = MetadataStore(db_path)
+            if migrate_root: MetadataManager.store.migrate_sidecars(migrate_root)
+        except Exception as e:
+            print(f"⚠️ Banco de metadados indisponível, usando sidecars: {e}")
+            MetadataManager.store = None
+    @staticmethod
+    def init_versions(root, compress=True):
+        try:
+            MetadataManager.versions = VersionStore(root, compress=compress)
+        except Exception as e:
+            print(f"⚠️ Repositório de versões indisponível: {e}")
+            MetadataManager.versions = None
     @staticmethod
     def get_sidecar_path(file_path):
         directory = os.path.dirname(file_path)
@@ -663,6 +2516,7 @@ class MetadataManager:
         return os.path.join(directory, ".versions")
     @staticmethod
     def get_attributes(file_path):
+        if MetadataManager.store: return MetadataManager.store.get(file_path)
         json_path = MetadataManager.get_sidecar_path(file_path)
         if os.path.exists(json_path):
             try:
@@ -670,44 +2524,769 @@ class MetadataManager:
             except: return {}
         return {}
     @staticmethod
+    def get_directory_attributes(directory):
+        """{nome: attrs} de uma pasta inteira (uma consulta em vez de N arquivos)"""
+        if MetadataManager.store: return MetadataManager.store.get_directory(directory)
+        result = {}
+        try: names = os.listdir(directory)
+        except OSError: return result
+        for name in names:
+            if name.startswith('.'): continue
+            attrs = MetadataManager.get_attributes(os.path.join(directory, name))
+            if attrs: result[name] = attrs
+        return result
+    @staticmethod
     def set_attribute(file_path, key, value):
+        MetadataManager.set_attributes(file_path, {key: value})
+    @staticmethod
+    def set_attributes(file_path, changes):
+        if MetadataManager.store:
+            MetadataManager.store.update(file_path, changes)
+            return
         attrs = MetadataManager.get_attributes(file_path)
-        attrs[key] = value
+        attrs.update(changes)
         json_path = MetadataManager.get_sidecar_path(file_path)
         try:
             with open(json_path, 'w') as f: json.dump(attrs, f)
         except Exception as e: print(f"Erro ao salvar: {e}")
     @staticmethod
+    def forget(file_path):
+        if MetadataManager.store: MetadataManager.store.delete(file_path)
+        sidecar = MetadataManager.get_sidecar_path(file_path)
+        if os.path.exists(sidecar): os.remove(sidecar)
+    @staticmethod
+    def move(old_path, new_path):
+        if MetadataManager.store: MetadataManager.store.move(old_path, new_path)
+        if MetadataManager.versions: MetadataManager.versions.move(old_path, new_path)
+    @staticmethod
     def save_version(file_path):
         if not os.path.exists(file_path) or os.path.isdir(file_path): return False
-        versions_dir = MetadataManager.get_versions_dir(file_path)
-        if not os.path.exists(versions_dir): os.makedirs(versions_dir)
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        filename = os.path.basename(file_path)
-        backup_name = f"{timestamp}_{filename}"
-        backup_path = os.path.join(versions_dir, backup_name)
+        if not MetadataManager.versions: return False
         try:
-            shutil.copy2(file_path, backup_path)
+            MetadataManager.versions.save(file_path)
             return True
-        except: return False
+        except Exception as e:
+            print(f"Erro ao salvar versão: {e}")
+            return False
     @staticmethod
-    def get_versions(file_path):
-        versions_dir = MetadataManager.get_versions_dir(file_path)
-        if not os.path.exists(versions_dir): return []
-        filename = os.path.basename(file_path)
-        versions = []
-        for f in os.listdir(versions_dir):
-            if f.endswith(filename) and f != filename:
-                versions.append(os.path.join(versions_dir, f))
-        versions.sort(reverse=True)
-        return versions
+    def get_versions(file_path, offset=0, limit=-1):
+        """[{id, ts, size, hash}] da mais nova para a mais antiga (paginado)"""
+        if not MetadataManager.versions: return []
+        MetadataManager.versions.import_legacy_dir(os.path.dirname(file_path))
+        return MetadataManager.versions.list(file_path, offset, limit)
+    @staticmethod
+    def count_versions(file_path):
+        if not MetadataManager.versions: return 0
+        MetadataManager.versions.import_legacy_dir(os.path.dirname(file_path))
+        return MetadataManager.versions.count(file_path)
     @staticmethod
-    def restore_version(file_path, version_path):
+    def restore_version(file_path, version_id):
         try:
             MetadataManager.save_version(file_path)
-            shutil.copy2(version_path, file_path)
+            return MetadataManager.versions.restore(file_path, version_id)
+        except Exception as e:
+            print(f"Erro ao restaurar versão: {e}")
+            return False
+    @staticmethod
+    def forget_versions(file_path):
+        if MetadataManager.versions: MetadataManager.versions.forget(file_path)
+
+# ============================================================================
+# 🔎 MOTOR DE BUSCA DA MESA (NOMES + TAGS/STATUS, EM THREAD PRÓPRIA)
+# ============================================================================
+
+class _FolderSearchIndex:
+    """Índice de UMA pasta: nomes (substring/prefixo) e metadados (tag/status/estado).
+    Os conjuntos guardam posições em 'names' (já em ordem alfabética)."""
+    def __init__(self, path):
+        self.path = path
+        self.dirty = False
+        self.meta_generation = None
+        names = []
+        try:
+            with os.scandir(path) as it:
+                names = [e.name for e in it if not e.name.startswith('.')]
+        except OSError:
+            pass
+        self.names = sorted(names)
+        self.position = {n: i for i, n in enumerate(self.names)}
+        self.lower = [n.lower() for n in self.names]
+        # Todos os nomes num único texto: a busca por substring vira str.find (C puro)
+        self.joined = "\n".join(self.lower) + "\n"
+        self.offsets = []
+        pos = 0
+        for n in self.lower:
+            self.offsets.append(pos)
+            pos += len(n) + 1
+        self.load_metadata()
+
+    def load_metadata(self):
+        self.attrs = MetadataManager.get_directory_attributes(self.path)
+        store = MetadataManager.store
+        self.meta_generation = store.generation if store else None
+        self.by_key = {"tags": {}, "status": {}, "state": {}}
+        for name, attrs in self.attrs.items():
+            i = self.position.get(name)
+            if i is None: continue
+            for tag in attrs.get("tags", []):
+                self.by_key["tags"].setdefault(str(tag).lower(), set()).add(i)
+            for key in ("status", "state"):
+                if attrs.get(key):
+                    self.by_key[key].setdefault(str(attrs[key]).lower(), set()).add(i)
+
+    def metadata_is_stale(self):
+        store = MetadataManager.store
+        return store is None or store.generation != self.meta_generation
+
+    def name_matches(self, term):
+        # Termo muito comum: varrer a lista direto sai mais barato que pular de acerto em acerto
+        if self.joined.count(term) * 8 > len(self.lower):
+            return {i for i, n in enumerate(self.lower) if term in n}
+        hits = set()
+        start = self.joined.find(term)
+        while start != -1:
+            i = bisect.bisect_right(self.offsets, start) - 1
+            hits.add(i)
+            # Pula para o próximo nome (um nome conta uma vez só)
+            start = self.joined.find(term, self.offsets[i] + len(self.lower[i]) + 1)
+        return hits
+
+    def meta_matches(self, key, value, prefix=True):
+        hits = set()
+        for meta_value, positions in self.by_key[key].items():
+            if meta_value.startswith(value) if prefix else value in meta_value:
+                hits |= positions
+        return hits
+
+class DesktopSearchEngine:
+    """
+    Busca da Mesa fora da UI. Aceita texto livre e filtros estruturados
+    (ex: "tag:cliente status:aprovado relatorio"). Só a consulta mais recente
+    roda; o resultado volta ranqueado em lotes, um lote por frame.
+    """
+    FILTER_KEYS = {"tag": "tags", "tags": "tags", "status": "status", "state": "state", "estado": "state", "name": "name", "nome": "name"}
+    FIRST_BATCH = 48   # Mais ou menos uma tela de ícones
+    BATCH_SIZE = 200
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._generation = 0
+        self._index = None
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    # --- API (thread da UI) ---
+    def search(self, path, text, on_batch):
+        """on_batch(nomes, attrs_por_nome, primeiro, ultimo) é chamado na thread do Kivy"""
+        self._generation += 1
+        self._queue.put((self._generation, path, text, on_batch))
+
+    def cancel(self):
+        self._generation += 1
+
+    def invalidate(self):
+        index = self._index
+        if index: index.dirty = True
+
+    # --- THREAD DE BUSCA ---
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            while not self._queue.empty():
+                job = self._queue.get_nowait()
+            generation, path, text, on_batch = job
+            if generation != self._generation: continue
+            try:
+                index = self._get_index(path)
+                results = self._query(index, text)
+            except Exception as e:
+                print(f"Erro na busca: {e}")
+                continue
+            if generation != self._generation: continue
+            batches = [results[:self.FIRST_BATCH]]
+            for i in range(self.FIRST_BATCH, len(results), self.BATCH_SIZE):
+                batches.append(results[i:i + self.BATCH_SIZE])
+            Clock.schedule_once(lambda dt, g=generation, b=batches, a=index.attrs, cb=on_batch: self._deliver(g, b, 0, a, cb))
+
+    def _deliver(self, generation, batches, i, attrs, on_batch):
+        if generation != self._generation: return
+        last = i == len(batches) - 1
+        on_batch(batches[i], attrs, i == 0, last)
+        if not last:
+            Clock.schedule_once(lambda dt: self._deliver(generation, batches, i + 1, attrs, on_batch))
+
+    def _get_index(self, path):
+        index = self._index
+        if index is None or index.path != path or index.dirty:
+            index = self._index = _FolderSearchIndex(path)
+        elif index.metadata_is_stale():
+            index.load_metadata()
+        return index
+
+    @classmethod
+    def parse(cls, text):
+        terms, filters = [], []
+        for token in text.lower().split():
+            key, sep, value = token.partition(":")
+            if sep and key in cls.FILTER_KEYS:
+                if value: filters.append((cls.FILTER_KEYS[key], value))
+            else:
+                terms.append(token)
+        return terms, filters
+
+    @staticmethod
+    def _score(lname, term):
+        pos = lname.find(term)
+        if pos == 0: return 0 if lname == term else 1
+        if pos < 0: return 4  # Só bateu nos metadados
+        if lname[pos - 1] in " ._-": return 2  # Começo de palavra
+        return 3
+
+    def _query(self, index, text):
+        terms, filters = self.parse(text)
+        candidates = None
+        for key, value in filters:
+            hits = index.name_matches(value) if key == "name" else index.meta_matches(key, value)
+            candidates = hits if candidates is None else candidates & hits
+        for term in terms:
+            # Mesmo critério de antes: nome, tag, status ou estado contendo o termo
+            hits = index.name_matches(term)
+            for key in ("tags", "status", "state"):
+                hits |= index.meta_matches(key, term, prefix=False)
+            candidates = hits if candidates is None else candidates & hits
+        if candidates is None: return list(index.names)
+        ordered = sorted(candidates)  # Posições já seguem a ordem alfabética
+        if not terms: return [index.names[i] for i in ordered]
+        # Ranking por baldes (exato, prefixo, palavra, meio, metadado): sem sort por chave
+        buckets = ([], [], [], [], [])
+        first, score, lower, names = terms[0], self._score, index.lower, index.names
+        for i in ordered:
+            buckets[score(lower[i], first)].append(names[i])
+        return [n for bucket in buckets for n in bucket]
+
+# ============================================================================
+# 🖼️ MINIATURAS (PILLOW FORA DA THREAD DA UI + CACHE EM DISCO)
+# ============================================================================
+
+class ThumbnailService:
+    """
+    Miniaturas de imagens decodificadas no THUMBNAIL_POOL (threads se o
+    sistema não deixou criar processos, como no Android, ou se o pool
+    quebrar) e entregues como
+    textura na thread da UI. Cache em disco (Sistema/Thumbs) com chave
+    caminho + mtime + tamanho + dimensão, limitado em bytes com despejo
+    LRU; as texturas pequenas (ícone, seletor) também ficam em memória.
+    Sem Pillow, request() devolve False e quem chamou usa a imagem original.
+    """
+    SIZES = {"icon": 128, "picker": 320, "preview": 1600}
+    MEMORY_KINDS = ("icon", "picker")  # Preview é grande demais para segurar
+    MEMORY_TEXTURES = 192
+    MAX_DISK_BYTES = 64 * 1024 * 1024
+    EVICT_EVERY = 32  # Confere o tamanho do cache a cada N miniaturas novas
+
+    def __init__(self, cache_dir, pool=None, workers=2):
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.enabled = PILImage is not None
+        self._pool = pool  # Pool de processos criado no topo do script (ou None = threads)
+        self._lock = threading.Lock()
+        self._inflight = {}  # chave -> callbacks esperando
+        self._textures = collections.OrderedDict()
+        self._created = 0
+        if self.enabled:
+            os.makedirs(cache_dir, exist_ok=True)
+            threading.Thread(target=self._evict, daemon=True).start()
+
+    def request(self, path, kind, callback):
+        """callback(texture) na thread da UI. False = sem miniatura (use o arquivo original)"""
+        if not self.enabled: return False
+        key = self._key(path, kind)
+        if key is None: return False
+        texture = self._textures.get(key)
+        if texture is not None:
+            self._textures.move_to_end(key)
+            callback(texture)
             return True
-        except: return False
+        with self._lock:
+            waiting = self._inflight.get(key)
+            if waiting is not None:
+                waiting.append(callback)
+                return True
+            self._inflight[key] = [callback]
+        dest = os.path.join(self.cache_dir, key + ".thumb")
+        self._render(key, kind, (path, dest, self.SIZES[kind]))
+        return True
+
+    def _render(self, key, kind, args):
+        future = self._submit(_render_thumbnail, *args)
+        future.add_done_callback(lambda f: self._on_rendered(key, kind, args, f))
+
+    def prefetch(self, path, kind):
+        """Só deixa a miniatura pronta no disco (sem textura): quem abrir depois lê o arquivo pequeno"""
+        if not self.enabled: return
+        key = self._key(path, kind)
+        if key is None or key in self._textures: return
+        dest = os.path.join(self.cache_dir, key + ".thumb")
+        if os.path.exists(dest): return
+        future = self._submit(_render_thumbnail, path, dest, self.SIZES[kind], False)
+        future.add_done_callback(self._on_prefetched)
+
+    def _on_prefetched(self, future):
+        if future.cancelled(): return
+        error = future.exception()
+        if isinstance(error, concurrent.futures.BrokenExecutor): self._use_threads(error)
+        elif error: print(f"⚠️ [Miniaturas] Falhou: {error}")
+
+    def _key(self, path, kind):
+        try: st = os.stat(path)
+        except OSError: return None
+        return hashlib.sha1(f"{path}|{st.st_mtime_ns}|{st.st_size}|{self.SIZES[kind]}".encode('utf-8', 'surrogateescape')).hexdigest()
+
+    def _submit(self, fn, *args):
+        if self._pool is None: self._use_threads()
+        try:
+            return self._pool.submit(fn, *args)
+        except (concurrent.futures.BrokenExecutor, OSError, RuntimeError) as e:
+            self._use_threads(e)
+            return self._pool.submit(fn, *args)
+
+    def _use_threads(self, error=None):
+        """Troca o pool de processos (ausente ou quebrado) por threads, de vez"""
+        with self._lock:
+            broken = self._pool
+            if isinstance(broken, concurrent.futures.ThreadPoolExecutor): return
+            self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="thumb")
+        if error is not None: print(f"⚠️ [Miniaturas] Pool de processos quebrou ({error}), usando threads")
+        if broken is not None: broken.shutdown(wait=False, cancel_futures=True)
+
+    def _on_rendered(self, key, kind, args, future):
+        """Thread do pool: a textura só pode nascer na thread da UI"""
+        try:
+            result = future.result()
+        except concurrent.futures.BrokenExecutor as e:
+            # Um worker morreu (OOM, sinal...): o pool de processos não se recupera; refaz em thread
+            self._use_threads(e)
+            self._render(key, kind, args)
+            return
+        except Exception as e:
+            print(f"⚠️ [Miniaturas] Falhou: {e}")
+            result = None
+        if result and result[3]:
+            self._created += 1
+            if self._created % self.EVICT_EVERY == 0:
+                threading.Thread(target=self._evict, daemon=True).start()
+        Clock.schedule_once(lambda dt: self._deliver(key, kind, result), 0)
+
+    def _deliver(self, key, kind, result):
+        with self._lock:
+            callbacks = self._inflight.pop(key, [])
+        if not result: return
+        width, height, rgba, _ = result
+        texture = Texture.create(size=(width, height), colorfmt='rgba')
+        texture.blit_buffer(rgba, colorfmt='rgba', bufferfmt='ubyte')
+        texture.flip_vertical()
+        if kind in self.MEMORY_KINDS:
+            self._textures[key] = texture
+            while len(self._textures) > self.MEMORY_TEXTURES: self._textures.popitem(last=False)
+        for callback in callbacks:
+            try: callback(texture)
+            except Exception as e: print(f"⚠️ [Miniaturas] Callback: {e}")
+
+    def _evict(self):
+        """Apaga as miniaturas usadas há mais tempo até o cache caber em 80% do limite"""
+        try:
+            with os.scandir(self.cache_dir) as it:
+                files = [(e.stat().st_mtime, e.stat().st_size, e.path) for e in it if e.is_file()]
+        except OSError:
+            return
+        total = sum(size for _, size, _ in files)
+        if total <= self.MAX_DISK_BYTES: return
+        for _, size, path in sorted(files):
+            try: os.remove(path)
+            except OSError: continue
+            total -= size
+            if total <= self.MAX_DISK_BYTES * 0.8: break
+
+    def shutdown(self):
+        # Fila descartada; só espera as miniaturas que já estão sendo geradas
+        if self._pool: self._pool.shutdown(wait=True, cancel_futures=True)
+
+def _render_wallpaper(src, dest, size):
+    """
+    Roda na thread do WallpaperCache. Recorta e escala a origem para cobrir
+    exatamente size (sem distorcer, como um "cover") e grava um JPEG compacto.
+    """
+    width, height = size
+    with PILImage.open(src) as img:
+        img.draft("RGB", (width, height))
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        img = ImageOps.fit(img, (width, height))
+        tmp = dest + ".tmp"
+        img.save(tmp, "JPEG", quality=88)
+        os.replace(tmp, dest)
+    return dest
+
+class WallpaperCache:
+    """
+    Wallpaper já no tamanho da janela, gerado uma vez numa thread de fundo e
+    guardado em Sistema/WallpaperCache como <hash da origem>_<L>x<A>.jpg. O
+    hash cobre caminho + mtime + tamanho do arquivo, então trocar a imagem no
+    lugar também gera variante nova. Girar a tela só cria a outra orientação;
+    variantes de wallpapers antigos são apagadas. Sem Pillow, entrega a origem.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.enabled = PILImage is not None
+        self._pool = None
+        self._inflight = {}  # destino -> callbacks esperando
+        if self.enabled: os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def source_key(src):
+        st = os.stat(src)
+        ident = f"{os.path.realpath(src)}|{st.st_mtime_ns}|{st.st_size}"
+        return hashlib.sha1(ident.encode('utf-8', 'surrogateescape')).hexdigest()[:20]
+
+    def variant_path(self, src, size):
+        return os.path.join(self.cache_dir, f"{self.source_key(src)}_{int(size[0])}x{int(size[1])}.jpg")
+
+    def request(self, src, size, callback):
+        """callback(caminho) na thread da UI: a variante pronta, ou a origem se não der para gerar"""
+        size = (int(size[0]), int(size[1]))
+        if not self.enabled or size[0] <= 0 or size[1] <= 0:
+            callback(src)
+            return
+        try: dest = self.variant_path(src, size)
+        except OSError:
+            callback(src)
+            return
+        if os.path.exists(dest):
+            callback(dest)
+            return
+        waiting = self._inflight.get(dest)
+        if waiting is not None:
+            waiting.append(callback)
+            return
+        self._inflight[dest] = [callback]
+        if self._pool is None:
+            self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="wallpaper")
+        future = self._pool.submit(_render_wallpaper, src, dest, size)
+        future.add_done_callback(lambda f: Clock.schedule_once(lambda dt: self._deliver(src, dest, size, f), 0))
+
+    def _deliver(self, src, dest, size, future):
+        callbacks = self._inflight.pop(dest, [])
+        try:
+            path = future.result()
+            self._prune(os.path.basename(dest), size)
+        except Exception as e:
+            print(f"⚠️ [Wallpaper] Variante falhou ({e}), usando o original")
+            path = src
+        for callback in callbacks:
+            try: callback(path)
+            except Exception as e: print(f"⚠️ [Wallpaper] Callback: {e}")
+
+    def _prune(self, name, size):
+        """Fica só a variante nova e a da outra orientação do mesmo wallpaper"""
+        key = name.split("_", 1)[0]
+        keep = {name, f"{key}_{size[1]}x{size[0]}.jpg"}
+        try:
+            with os.scandir(self.cache_dir) as it:
+                stale = [e.path for e in it if e.is_file() and e.name not in keep]
+        except OSError:
+            return
+        for path in stale:
+            try: os.remove(path)
+            except OSError: pass
+
+    def shutdown(self):
+        if self._pool: self._pool.shutdown(wait=True, cancel_futures=True)
+
+# ============================================================================
+# 📂 MODELO DE DIRETÓRIO (UMA PASSADA DE SCANDIR -> REGISTROS IMUTÁVEIS)
+# ============================================================================
+
+# O que a grade da Mesa precisa saber de cada item; imutável (a view recebe um dict novo)
+DesktopEntry = collections.namedtuple("DesktopEntry", "name path kind icon display_name mtime status")
+
+class DirectoryModel:
+    """
+    Lê a pasta com um os.scandir só, reaproveitando o stat do DirEntry (um
+    syscall por item: tipo e mtime saem dele), busca o status de todos numa
+    consulta ao MetadataStore e devolve DesktopEntry prontos para a grade.
+    Ícone por extensão fica em cache; nada de isdir/getmtime repetidos.
+    """
+    ICON_BY_EXT = {
+        ".png": "image", ".jpg": "image", ".jpeg": "image", ".webp": "image",
+        ".mp4": "video", ".mkv": "video", ".webm": "video",
+        ".mp3": "audio", ".wav": "audio", ".ogg": "audio",
+    }
+    TEXT_EXTS = (".txt", ".md", ".json", ".py", ".sh")
+
+    def scan(self, path, attrs_by_name=None):
+        """Todos os itens visíveis da pasta, em ordem de nome"""
+        if attrs_by_name is None: attrs_by_name = MetadataManager.get_directory_attributes(path)
+        entries = (self.from_dir_entry(d, attrs_by_name.get(d.name, {})) for d in self.listing(path))
+        return [e for e in entries if e]
+
+    @staticmethod
+    def listing(path):
+        """DirEntry visíveis em ordem de nome (sem stat ainda: dá para montar aos poucos)"""
+        try:
+            with os.scandir(path) as it:
+                found = [d for d in it if not d.name.startswith('.')]
+        except OSError:
+            return []
+        found.sort(key=lambda d: d.name)
+        return found
+
+    def from_dir_entry(self, dir_entry, attrs):
+        """Registro a partir do DirEntry (o stat dele é reaproveitado); None se sumiu"""
+        try: st = dir_entry.stat()
+        except OSError:
+            # Link quebrado aparece como arquivo; se sumiu entre a listagem e o stat, pula
+            try: st = dir_entry.stat(follow_symlinks=False)
+            except OSError: return None
+        return self._make(dir_entry.name, dir_entry.path, st, attrs)
+
+    def entries(self, path, names, attrs_by_name):
+        """Itens escolhidos (ex: resultados da busca), na ordem dada"""
+        out = []
+        for name in names:
+            entry = self.entry(path, name, attrs_by_name.get(name, {}))
+            if entry: out.append(entry)
+        return out
+
+    def entry(self, path, name, attrs):
+        """Um item (patch do watcher); None se não existe mais"""
+        full_path = os.path.join(path, name)
+        try: st = os.stat(full_path)
+        except OSError: return None
+        return self._make(name, full_path, st, attrs)
+
+    def _make(self, name, full_path, st, attrs):
+        is_dir = stat.S_ISDIR(st.st_mode)
+        if is_dir and name.endswith(".appicon"):
+            # O stat do scandir já dá o mtime da pasta: só o do manifesto é conferido
+            bundle = ManifestCache.get(full_path, st.st_mtime_ns)
+            kind, display_name, icon = "app", bundle.display_name, bundle.icon
+        elif name.endswith(".webicon"):
+            kind, display_name, icon = "web", name.replace(".webicon", ""), "text-html"
+        elif is_dir:
+            kind, display_name, icon = "dir", name, "folder"
+        else:
+            kind, display_name, icon = "file", name, self._file_icon(name)
+        return DesktopEntry(name, full_path, kind, icon, display_name, st.st_mtime, attrs.get("status") or "")
+
+    @classmethod
+    @functools.lru_cache(maxsize=512)
+    def _file_icon(cls, name):
+        ext = os.path.splitext(name)[1].lower()
+        if ext in cls.ICON_BY_EXT: return cls.ICON_BY_EXT[ext]
+        if "pdf" in name.lower(): return "pdf"
+        if name.endswith(cls.TEXT_EXTS): return "text"
+        mime_type, _ = mimetypes.guess_type(name)
+        if mime_type and mime_type.startswith('image'): return "image"
+        return "text"
+
+# ============================================================================
+# 👁️ OBSERVADOR DE PASTAS (INOTIFY + POLLING DE RESERVA, FORA DA UI)
+# ============================================================================
+
+class _Inotify:
+    """Acesso mínimo ao inotify do kernel via ctypes (Linux e Android)."""
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c") or ("libc.so" if IS_ANDROID else "libc.so.6")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 falhou")
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch falhou em {path}")
+        return wd
+
+    def rm_watch(self, wd):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """Lê um lote do kernel e devolve [(mask, cookie, nome)]."""
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+        header_size = self.EVENT_HEADER.size
+        while offset + header_size <= len(data):
+            wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += header_size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((mask, cookie, name))
+        return events
+
+    def close(self):
+        try: os.close(self.fd)
+        except OSError: pass
+
+class FolderWatcher:
+    """
+    Observa UMA pasta por vez numa thread própria e entrega lotes de eventos na
+    thread do Kivy: ("created", nome), ("deleted", nome), ("modified", nome),
+    ("renamed", antigo, novo) e ("resync", None) quando é preciso reler tudo.
+    Usa inotify quando o kernel deixa; senão cai num polling leve via scandir.
+    Arquivos ocultos (sidecars, .versions) são ignorados.
+    """
+    def __init__(self, on_events, poll_interval=2.0, coalesce_delay=0.1):
+        self.on_events = on_events
+        self.poll_interval = poll_interval
+        self.coalesce_delay = coalesce_delay
+        self._target = None
+        self._lock = threading.Lock()
+        self._pending = []
+        self._pending_path = None
+        self._flush_scheduled = False
+        self._running = True
+        self._wake_r, self._wake_w = os.pipe()
+        try:
+            self._inotify = _Inotify()
+        except Exception as e:
+            print(f"⚠️ [Watcher] inotify indisponível, usando polling: {e}")
+            self._inotify = None
+        threading.Thread(target=self._run, daemon=True).start()
+
+    # --- API (thread da UI) ---
+    def watch(self, path):
+        with self._lock:
+            self._target = path
+            self._pending = []
+        self._wake()
+
+    def stop(self):
+        self._running = False
+        self._wake()
+
+    def _wake(self):
+        try: os.write(self._wake_w, b"x")
+        except OSError: pass
+
+    # --- THREAD DO OBSERVADOR ---
+    def _emit(self, path, events):
+        if not events: return
+        with self._lock:
+            if path != self._target: return
+            if self._pending_path != path: self._pending = []
+            self._pending_path = path
+            self._pending.extend(events)
+            if self._flush_scheduled: return
+            self._flush_scheduled = True
+        # Agrupa rajadas (ex: cópia de 200 arquivos) num único patch na UI
+        Clock.schedule_once(self._flush, self.coalesce_delay)
+
+    def _flush(self, dt):
+        with self._lock:
+            events, path = self._pending, self._pending_path
+            self._pending = []
+            self._flush_scheduled = False
+        if events and path == self._target:
+            self.on_events(path, events)
+
+    def _run(self):
+        current, wd, snapshot = None, None, None
+        while self._running:
+            with self._lock:
+                target = self._target
+            if target != current:
+                if wd is not None and self._inotify:
+                    self._inotify.rm_watch(wd)
+                wd, snapshot, current = None, None, target
+                if current and self._inotify:
+                    try: wd = self._inotify.add_watch(current)
+                    except OSError as e: print(f"⚠️ [Watcher] {e}; usando polling")
+                if current and wd is None:
+                    snapshot = self._snapshot(current)
+
+            fds = [self._wake_r]
+            timeout = None
+            if wd is not None: fds.append(self._inotify.fd)
+            elif current: timeout = self.poll_interval
+
+            try:
+                ready, _, _ = select.select(fds, [], [], timeout)
+            except (OSError, ValueError):
+                break
+            if self._wake_r in ready:
+                os.read(self._wake_r, 1024)
+            if wd is not None and self._inotify.fd in ready:
+                self._emit(current, self._translate(self._inotify.read_events()))
+            elif wd is None and current and not ready:
+                new_snapshot = self._snapshot(current)
+                self._emit(current, self._diff(snapshot, new_snapshot))
+                snapshot = new_snapshot
+
+        if self._inotify: self._inotify.close()
+        os.close(self._wake_r); os.close(self._wake_w)
+
+    def _translate(self, raw_events):
+        events = []
+        moved_from = {}
+        for mask, cookie, name in raw_events:
+            if mask & (_Inotify.IN_Q_OVERFLOW | _Inotify.IN_DELETE_SELF | _Inotify.IN_MOVE_SELF):
+                events.append(("resync", None))
+                continue
+            if mask & _Inotify.IN_IGNORED or not name or name.startswith('.'):
+                continue
+            if mask & _Inotify.IN_MOVED_FROM:
+                moved_from[cookie] = name
+            elif mask & _Inotify.IN_MOVED_TO:
+                old = moved_from.pop(cookie, None)
+                events.append(("renamed", old, name) if old else ("created", name))
+            elif mask & _Inotify.IN_CREATE:
+                events.append(("created", name))
+            elif mask & _Inotify.IN_DELETE:
+                events.append(("deleted", name))
+            elif mask & (_Inotify.IN_CLOSE_WRITE | _Inotify.IN_ATTRIB):
+                events.append(("modified", name))
+        # Movido para fora da pasta observada = apagado
+        events.extend(("deleted", name) for name in moved_from.values())
+        return events
+
+    @staticmethod
+    def _snapshot(path):
+        snap = {}
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.name.startswith('.'): continue
+                    try:
+                        st = entry.stat()
+                        snap[entry.name] = (st.st_mtime_ns, st.st_size)
+                    except OSError:
+                        pass
+        except OSError:
+            return None
+        return snap
+
+    @staticmethod
+    def _diff(old, new):
+        if old is None or new is None:
+            return [("resync", None)] if old != new else []
+        events = [("deleted", n) for n in old if n not in new]
+        for name, sig in new.items():
+            if name not in old: events.append(("created", name))
+            elif old[name] != sig: events.append(("modified", name))
+        return events
 
 # ============================================================================
 # 🖥️ INTERFACE E COMPONENTES UI (DIÁLOGOS E WIDGETS)
@@ -806,6 +3385,7 @@ class WallpaperPicker(ModalView):
     def load_images(self, folder):
         valid_exts = [".jpg", ".jpeg", ".png", ".webp"]
         if not os.path.exists(folder): return
+        app = MDApp.get_running_app()
 
         for f in sorted(os.listdir(folder)):
             if any(f.lower().endswith(ext) for ext in valid_exts):
@@ -814,7 +3394,10 @@ class WallpaperPicker(ModalView):
                 # Card da miniatura
                 # Usando MDCard com ripple=True para substituir o ButtonBehavior cru (mais estável)
                 img_card = MDCard(size_hint=(None, None), size=(dp(90), dp(160)), ripple_behavior=True)
-                img_widget = Image(source=full_path, allow_stretch=True, keep_ratio=False, size_hint=(1,1))
+                img_widget = Image(allow_stretch=True, keep_ratio=False, size_hint=(1,1))
+                # Miniatura decodificada fora da UI; sem Pillow, cai no arquivo original
+                if not app.thumbnails.request(full_path, "picker", lambda tex, w=img_widget: setattr(w, "texture", tex)):
+                    img_widget.source = full_path
                 img_card.add_widget(img_widget)
 
                 # O Pulo do Gato: Bind com lambda pra passar o caminho certo
@@ -842,10 +3425,6 @@ class SmartIcon(ButtonBehavior, FloatLayout):
             self.source_path = value
             return
 
-        targets = [value]
-        if value in ICON_ALIASES: targets.extend(ICON_ALIASES[value])
-        if value not in targets: targets.append(value)
-
         if not os.path.exists(ICONS_ROOT):
              self.source_path = ""
              return
@@ -853,27 +3432,9 @@ class SmartIcon(ButtonBehavior, FloatLayout):
         app_instance = MDApp.get_running_app()
         current_theme_style = app_instance.theme_cls.theme_style if app_instance else "Light"
         theme_folder = "Colloid-Light" if current_theme_style == "Light" else "Colloid-Dark"
-        SYMBOLIC_PATH = os.path.join(ICONS_ROOT, theme_folder, "status", "symbolic")
 
-        for t in targets:
-            icon_file = f"{t}-symbolic.png"
-            full_symbolic = os.path.join(SYMBOLIC_PATH, icon_file)
-            if os.path.exists(full_symbolic):
-                self.source_path = full_symbolic
-                return
-            icon_file_pure = f"{t}.png"
-            full_pure = os.path.join(SYMBOLIC_PATH, icon_file_pure)
-            if os.path.exists(full_pure):
-                self.source_path = full_pure
-                return
-
-        for root, dirs, files in os.walk(ICONS_ROOT):
-            for t in targets:
-                if f"{t}.png" in files:
-                    full = os.path.join(root, f"{t}.png")
-                    self.source_path = full
-                    return
-        self.source_path = ""
+        # Um acesso ao dicionário (aliases já expandidos no índice)
+        self.source_path = ICON_INDEX.resolve(value, theme_folder)
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -905,6 +3466,8 @@ class AppGridIcon(SmartIcon):
         self.size = (dp(64), dp(64))
 
 class HistoryDialog(ModalView):
+    PAGE_SIZE = 20  # Históricos longos carregam página a página conforme a rolagem
+
     def __init__(self, file_path, callback_refresh, **kwargs):
         super().__init__(**kwargs)
         self.file_path = file_path
@@ -913,28 +3476,50 @@ class HistoryDialog(ModalView):
         self.height = dp(450)
         self.background_color = (0, 0, 0, 0.6)
         self.auto_dismiss = True
+        self.loaded = 0
+        self.total = None  # Só se sabe depois da primeira página (que roda fora da UI)
+        self.loading = False
         card = MDCard(orientation='vertical', radius=[20,], md_bg_color=(0.98, 0.98, 0.98, 1), padding=dp(20), spacing=dp(10))
         card.add_widget(MDLabel(text="Histórico de Versões", halign="center", font_style="H6", bold=True, size_hint_y=None, height=dp(40)))
-        scroll = ScrollView(size_hint=(1, 1))
+        self.count_label = MDLabel(text="Carregando...", halign="center", theme_text_color="Secondary", font_style="Caption", size_hint_y=None, height=dp(20))
+        card.add_widget(self.count_label)
+        self.scroll = ScrollView(size_hint=(1, 1))
         self.list_layout = BoxLayout(orientation='vertical', size_hint_y=None)
         self.list_layout.bind(minimum_height=self.list_layout.setter('height'))
-        versions = MetadataManager.get_versions(file_path)
-        if not versions: self.list_layout.add_widget(MDLabel(text="Nenhuma versão salva.", halign="center", theme_text_color="Hint"))
-        else:
-            for v_path in versions:
-                fname = os.path.basename(v_path)
-                try:
-                    parts = fname.split('_', 2)
-                    date_str = f"{parts[0]} {parts[1].replace('-', ':')}"
-                except: date_str = fname
-                item = OneLineAvatarIconListItem(text=date_str, on_release=lambda x, p=v_path: self.confirm_restore(p))
-                item.add_widget(MDIconButton(icon="backup-restore", pos_hint={"center_x": .9, "center_y": .5}))
-                self.list_layout.add_widget(item)
-        scroll.add_widget(self.list_layout)
+        self.load_next_page()
+        self.scroll.bind(scroll_y=self._on_scroll)
+        self.scroll.add_widget(self.list_layout)
+        card.add_widget(self.scroll)
         card.add_widget(MDIconButton(icon="close", on_release=self.dismiss, pos_hint={'center_x': .5}))
         self.add_widget(card)
-    def confirm_restore(self, version_path):
-        if MetadataManager.restore_version(self.file_path, version_path):
+    def load_next_page(self):
+        if self.loading: return
+        self.loading = True
+        threading.Thread(target=self._fetch_page, args=(self.loaded,), daemon=True).start()
+    def _fetch_page(self, offset):
+        # Fora da UI: na primeira vez a pasta ainda importa as cópias antigas de .versions
+        total = MetadataManager.count_versions(self.file_path) if self.total is None else self.total
+        versions = MetadataManager.get_versions(self.file_path, offset, self.PAGE_SIZE)
+        Clock.schedule_once(lambda dt: self._show_page(total, versions))
+    def _show_page(self, total, versions):
+        self.loading = False
+        if self.total is None:
+            self.total = total
+            self.count_label.text = f"{total} versões"
+            if not total: self.list_layout.add_widget(MDLabel(text="Nenhuma versão salva.", halign="center", theme_text_color="Hint"))
+        self.loaded += len(versions)
+        for version in versions:
+            date_str = datetime.fromtimestamp(version["ts"]).strftime("%Y-%m-%d %H:%M:%S")
+            item = TwoLineAvatarIconListItem(text=date_str, secondary_text=f"{version['size'] / 1024:.1f} KB",
+                                             on_release=lambda x, v=version["id"]: self.confirm_restore(v))
+            item.add_widget(MDIconButton(icon="backup-restore", pos_hint={"center_x": .9, "center_y": .5}))
+            self.list_layout.add_widget(item)
+    def _on_scroll(self, instance, scroll_y):
+        # Chegou perto do fim: busca a próxima página (uma de cada vez)
+        if scroll_y <= 0.05 and not self.loading and self.total and self.loaded < self.total:
+            self.load_next_page()
+    def confirm_restore(self, version_id):
+        if MetadataManager.restore_version(self.file_path, version_id):
             self.callback_refresh()
             self.dismiss()
 
@@ -990,10 +3575,12 @@ class PropertiesDialog(ModalView):
     def save_properties(self, *args):
         raw_tags = self.tags_field.text
         tags_list = [t.strip() for t in raw_tags.split(',') if t.strip()]
-        MetadataManager.set_attribute(self.file_path, "tags", tags_list)
-        MetadataManager.set_attribute(self.file_path, "description", self.desc_field.text)
-        MetadataManager.set_attribute(self.file_path, "origin_url", self.url_field.text)
-        MetadataManager.set_attribute(self.file_path, "state", self.selected_state)
+        MetadataManager.set_attributes(self.file_path, {
+            "tags": tags_list,
+            "description": self.desc_field.text,
+            "origin_url": self.url_field.text,
+            "state": self.selected_state
+        })
         self.callback_refresh()
         self.dismiss()
 
@@ -1013,7 +3600,16 @@ class ContextMenu(ModalView):
         card.add_widget(self._build_btn("folder-open", "Abrir", self.action_open))
         card.add_widget(self._build_btn("pencil", "Renomear", self.action_rename))
         card.add_widget(self._build_btn("information-outline", "Propriedades", self.action_properties))
+        self.height += dp(45)
+        if file_path in MDApp.get_running_app().selected_paths:
+            card.add_widget(self._build_btn("checkbox-marked-outline", "Desmarcar", self.action_select))
+        else:
+            card.add_widget(self._build_btn("checkbox-blank-outline", "Selecionar", self.action_select))
         if not os.path.isdir(file_path): card.add_widget(self._build_btn("history", "Histórico / Salvar", self.action_history))
+        app = MDApp.get_running_app()
+        if not os.path.isdir(file_path) and app.is_connected and "xfer" in app.network.features:
+            self.height += dp(45)
+            card.add_widget(self._build_btn("monitor-arrow-down", "Enviar para o PC", self.action_send_to_pc))
         card.add_widget(MDLabel(text="Status:", font_style="Caption", size_hint_y=None, height=dp(20)))
         status_box = BoxLayout(size_hint_y=None, height=dp(40), spacing=dp(5))
         status_box.add_widget(self._build_color_btn((0.2, 0.8, 0.2, 1), "aprovado"))
@@ -1039,6 +3635,10 @@ class ContextMenu(ModalView):
         self.dismiss()
         SofiaShell.execute(self.file_path)
     def action_rename(self, *args): self.dismiss()
+    def action_select(self, *args):
+        self.dismiss(); MDApp.get_running_app().toggle_selection(self.file_path)
+    def action_send_to_pc(self, *args):
+        self.dismiss(); MDApp.get_running_app().send_file_to_pc(self.file_path)
     def action_history(self, *args):
         self.dismiss(); MetadataManager.save_version(self.file_path)
         HistoryDialog(self.file_path, self.callback_refresh).open()
@@ -1046,10 +3646,8 @@ class ContextMenu(ModalView):
         try:
             if os.path.isdir(self.file_path): shutil.rmtree(self.file_path)
             else: os.remove(self.file_path)
-            sidecar = MetadataManager.get_sidecar_path(self.file_path)
-            if os.path.exists(sidecar): os.remove(sidecar)
-            v_dir = MetadataManager.get_versions_dir(self.file_path)
-            if os.path.exists(v_dir): shutil.rmtree(v_dir)
+            MetadataManager.forget(self.file_path)
+            MetadataManager.forget_versions(self.file_path)
             self.callback_refresh(); self.dismiss()
         except: pass
     def action_set_status(self, status):
@@ -1082,7 +3680,10 @@ class UniversalViewer(ModalView):
              content_area.add_widget(Widget())
 
         elif mime_type and mime_type.startswith('image'):
-            img = Image(source=file_path, allow_stretch=True, keep_ratio=True)
+            # Versão reduzida para a tela (a foto inteira nunca é decodificada na thread da UI)
+            img = Image(allow_stretch=True, keep_ratio=True)
+            if not MDApp.get_running_app().thumbnails.request(file_path, "preview", lambda tex: setattr(img, "texture", tex)):
+                img.source = file_path
             content_area.add_widget(img)
 
         elif mime_type and (mime_type.startswith('text') or file_path.endswith(('.py', '.json', '.md', '.txt'))):
@@ -1119,6 +3720,819 @@ class UniversalViewer(ModalView):
             self.dismiss()
         except: pass
 
+# ============================================================================
+# 🧩 ÍNDICE DE DESPACHO DOS APPLETS (MIME -> AÇÃO)
+# ============================================================================
+
+def _compile_schema(spec, where="applet"):
+    """
+    Transforma a descrição do schema numa função de validação (uma vez só).
+    tipo/tupla -> isinstance; [sub] -> lista de sub; {str: sub} -> mapa;
+    {"campo": (sub, obrigatório)} -> objeto. Levanta ValueError no primeiro erro.
+    """
+    if isinstance(spec, list):
+        item = _compile_schema(spec[0], where + "[]")
+        def check_list(value):
+            if not isinstance(value, list): raise ValueError(f"{where}: esperava lista")
+            for v in value: item(v)
+        return check_list
+    if isinstance(spec, dict) and len(spec) == 1 and str in spec:
+        item = _compile_schema(spec[str], where + "{}")
+        def check_map(value):
+            if not isinstance(value, dict) or not all(isinstance(k, str) for k in value):
+                raise ValueError(f"{where}: esperava objeto")
+            for v in value.values(): item(v)
+        return check_map
+    if isinstance(spec, dict):
+        fields = [(name, _compile_schema(sub, f"{where}.{name}"), required) for name, (sub, required) in spec.items()]
+        def check_object(value):
+            if not isinstance(value, dict): raise ValueError(f"{where}: esperava objeto")
+            for name, check, required in fields:
+                if name in value: check(value[name])
+                elif required: raise ValueError(f"{where}.{name}: obrigatório")
+        return check_object
+    def check_type(value):
+        # bool é subclasse de int: não aceita True como número
+        if not isinstance(value, spec) or (isinstance(value, bool) and spec is not bool):
+            raise ValueError(f"{where}: tipo inválido")
+    return check_type
+
+APPLET_SCHEMA = {
+    "name": (str, False),
+    "icon": (str, False),
+    "display_on_desktop": (bool, False),
+    "drop_triggers": ({str: str}, False),
+    "hints": (dict, False),
+    "actions": ([{
+        "id": (str, True),
+        "command": (str, False),
+        "pipeline": ([{"name": (str, False), "command": (str, True)}], False),
+        "output": (str, False),
+        "triggers": ({"mimetype": ([str], False)}, False),
+        "priority": ((int, float), False),
+        "timeout": ((int, float), False),
+        "job_class": (str, False),
+        "cost_class": (str, False),
+        "batch": ({"stdin": (bool, False), "max": (int, False)}, False),
+    }], False),
+}
+
+class AppletRegistry:
+    """
+    Definições dos applets (Sistema/Applets/*.json) já lidas e validadas,
+    guardadas por arquivo com (mtime_ns, tamanho). refresh() só relê o que
+    mudou e diz o que entrou, saiu ou mudou; o cache vai para disco
+    (Sistema/applets_cache.json) para a abertura não reparsear tudo.
+    """
+    CACHE_VERSION = 2
+    _check_schema = staticmethod(_compile_schema(APPLET_SCHEMA))
+
+    @classmethod
+    def validate(cls, applet):
+        cls._check_schema(applet)
+        for action in applet.get("actions", []):
+            if not action.get("command") and not action.get("pipeline"):
+                raise ValueError(f"applet.actions[{action['id']}]: sem command nem pipeline")
+
+    def __init__(self, applets_dir, cache_path):
+        self.dir = applets_dir
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        self._entries = {}  # nome -> [mtime_ns, tamanho, applet ou None se inválido]
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get("version") == self.CACHE_VERSION:
+                self._entries = {k: list(v) for k, v in cached.get("entries", {}).items()}
+        except (OSError, ValueError, AttributeError):
+            pass
+
+    def refresh(self, names=None):
+        """Relê só os arquivos alterados (todos se names=None). Retorna (added, removed, changed)"""
+        if names is None:
+            try:
+                with os.scandir(self.dir) as it:
+                    present = {e.name: e for e in it if e.name.endswith(".json") and e.is_file()}
+            except OSError:
+                present = {}
+            candidates = set(present) | set(self._entries)
+        else:
+            present = None
+            candidates = {n for n in names if n.endswith(".json")}
+
+        added, removed, changed = [], [], []
+        for name in sorted(candidates):
+            try:
+                if present is None: st = os.stat(os.path.join(self.dir, name))
+                elif name in present: st = present[name].stat()
+                else: raise FileNotFoundError(name)
+            except OSError:
+                if self._entries.pop(name, None) is not None: removed.append(name)
+                continue
+            old = self._entries.get(name)
+            if old and old[0] == st.st_mtime_ns and old[1] == st.st_size: continue
+            applet = self._parse(name)
+            self._entries[name] = [st.st_mtime_ns, st.st_size, applet]
+            (changed if old else added).append(name)
+
+        if added or removed or changed: self._save()
+        return added, removed, changed
+
+    def _parse(self, name):
+        try:
+            with open(os.path.join(self.dir, name), 'r', encoding='utf-8') as f:
+                applet = json.load(f)
+            self.validate(applet)
+            return applet
+        except Exception as e:
+            print(f"Erro ao ler o applet {name}: {e}")
+            return None
+
+    def get(self, name):
+        entry = self._entries.get(name)
+        return entry[2] if entry else None
+
+    def items(self):
+        """(nome, applet) válidos, em ordem de nome"""
+        return [(name, e[2]) for name, e in sorted(self._entries.items()) if e[2] is not None]
+
+    def _save(self):
+        snapshot = {"version": self.CACHE_VERSION, "entries": dict(self._entries)}
+        threading.Thread(target=self._write, args=(snapshot,), daemon=True).start()
+
+    def _write(self, snapshot):
+        tmp = self.cache_path + ".tmp"
+        try:
+            with self._lock:
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump(snapshot, f)
+                os.replace(tmp, self.cache_path)
+        except Exception as e:
+            print(f"⚠️ Erro ao salvar cache dos applets: {e}")
+
+class AppletCommand:
+    """
+    Monta a linha de comando de uma ação para um ou vários arquivos. %F/%f
+    recebem um arquivo; ações em lote recebem vários numa só execução, via
+    %FILES (lista no argv) ou "batch": {"stdin": true} (caminhos terminados
+    em \0 na entrada padrão, como o xargs -0), em lotes de até "max".
+    Ações com "pipeline" encadeiam estágios por pipes e gravam só o stdout
+    do último em "output" (%n = nome do primeiro arquivo sem extensão).
+    """
+    DEFAULT_BATCH = 64
+    ARG_BUDGET = 96 * 1024  # Folga grande abaixo do ARG_MAX do Android
+
+    @staticmethod
+    def _templates(action):
+        if action.get("pipeline"): return [stage["command"] for stage in action["pipeline"]]
+        return [action.get("command", "")]
+
+    @classmethod
+    def is_batch(cls, action):
+        return any("%FILES" in t for t in cls._templates(action)) or bool(action.get("batch"))
+
+    @classmethod
+    def uses_stdin(cls, action):
+        return not any("%FILES" in t for t in cls._templates(action)) and bool(action.get("batch", {}).get("stdin"))
+
+    @staticmethod
+    def _substitute(template, quoted):
+        # %FILES antes de %F, senão sobra "ILES"
+        command = template.replace("%FILES", " ".join(quoted))
+        return command.replace("%F", quoted[0]).replace("%f", quoted[0])
+
+    @classmethod
+    def chunks(cls, action, paths):
+        """Divide a seleção em lotes (um por arquivo se a ação não aceita lote)"""
+        if not cls.is_batch(action): return [[p] for p in paths]
+        limit = max(1, int(action.get("batch", {}).get("max", cls.DEFAULT_BATCH)))
+        out, current, length = [], [], 0
+        for path in paths:
+            n = len(shlex.quote(path)) + 1
+            if current and (len(current) >= limit or length + n > cls.ARG_BUDGET):
+                out.append(current)
+                current, length = [], 0
+            current.append(path)
+            length += n
+        if current: out.append(current)
+        return out
+
+    @classmethod
+    def build(cls, action, paths):
+        """(comando, bytes para o stdin ou None)"""
+        command = cls._substitute(action.get("command", ""), [shlex.quote(p) for p in paths])
+        stdin = b"".join(os.fsencode(p) + b"\0" for p in paths) if cls.uses_stdin(action) else None
+        return command, stdin
+
+    @classmethod
+    def build_pipeline(cls, action, paths, dest_dir):
+        """([(nome, comando)], caminho do artefato final, bytes para o stdin ou None)"""
+        quoted = [shlex.quote(p) for p in paths]
+        stages = [(stage.get("name") or stage["command"].split()[0], cls._substitute(stage["command"], quoted))
+                  for stage in action["pipeline"]]
+        base = os.path.splitext(os.path.basename(paths[0]))[0]
+        name = action.get("output", "%n.out").replace("%n", base)
+        stem, ext = os.path.splitext(name)
+        output, n = os.path.join(dest_dir, name), 2
+        while os.path.exists(output):
+            output = os.path.join(dest_dir, f"{stem} ({n}){ext}")
+            n += 1
+        stdin = b"".join(os.fsencode(p) + b"\0" for p in paths) if cls.uses_stdin(action) else None
+        return stages, output, stdin
+
+class AppletDispatchIndex:
+    """
+    Os gatilhos de todos os applets compilados uma vez: MIME exato, curinga
+    do tipo principal ("image/*") e pega-tudo ("*"). Responde em O(1) (com
+    cache por MIME) qual ação um applet executa para um arquivo e quais
+    applets aceitam o arquivo — usado no drop e no destaque da prateleira
+    durante o arrasto. A precedência é a mesma de sempre: drop_triggers
+    exato, depois curinga, depois a primeira ação cujo triggers.mimetype aceita.
+    """
+    def __init__(self, applets=()):
+        self.build(applets)
+
+    def build(self, applets):
+        self.applets = list(applets)
+        self._slot = {id(a): i for i, a in enumerate(self.applets)}
+        self._compiled = [self._compile(a) for a in self.applets]
+        # Índice global: quem aceita o quê
+        self._accept_exact, self._accept_major, self._accept_any = {}, {}, set()
+        for i, (drop_exact, drop_major, act_exact, act_major, act_any) in enumerate(self._compiled):
+            for mime in set(drop_exact) | set(act_exact):
+                self._accept_exact.setdefault(mime, set()).add(i)
+            for major in set(drop_major) | set(act_major):
+                self._accept_major.setdefault(major, set()).add(i)
+            if act_any: self._accept_any.add(i)
+        self._accepting_cache = {}
+        self._resolve_cache = {}
+
+    @staticmethod
+    def _compile(applet):
+        actions = applet.get("actions", [])
+        by_id = {}
+        for action in actions:
+            by_id.setdefault(action.get("id"), action)
+        drop_exact, drop_major = {}, {}
+        for key, trigger_id in applet.get("drop_triggers", {}).items():
+            action = by_id.get(trigger_id)
+            if action is None: continue
+            if key.endswith("/*"): drop_major.setdefault(key[:-2], action)
+            else: drop_exact.setdefault(key, action)
+        # Nas ações vale a ordem da lista: guarda (posição, ação) para desempatar
+        act_exact, act_major, act_any = {}, {}, None
+        for pos, action in enumerate(actions):
+            for mime in action.get("triggers", {}).get("mimetype", []):
+                if mime == "*":
+                    if act_any is None: act_any = (pos, action)
+                elif mime.endswith("/*"):
+                    act_major.setdefault(mime[:-2], (pos, action))
+                else:
+                    act_exact.setdefault(mime, (pos, action))
+        return drop_exact, drop_major, act_exact, act_major, act_any
+
+    @staticmethod
+    def _major(mime_type):
+        return mime_type.split("/", 1)[0]
+
+    def resolve(self, applet, mime_type):
+        """Ação que o applet roda para esse MIME (ou None)"""
+        slot = self._slot.get(id(applet))
+        if slot is None:
+            # Applet fora do índice (ex: recarregado): compila na hora
+            self.build(self.applets + [applet])
+            slot = self._slot[id(applet)]
+        key = (slot, mime_type)
+        if key in self._resolve_cache: return self._resolve_cache[key]
+        drop_exact, drop_major, act_exact, act_major, act_any = self._compiled[slot]
+        major = self._major(mime_type)
+        action = drop_exact.get(mime_type) or drop_major.get(major)
+        if action is None:
+            candidates = [c for c in (act_exact.get(mime_type), act_major.get(major), act_any) if c]
+            action = min(candidates, key=lambda c: c[0])[1] if candidates else None
+        self._resolve_cache[key] = action
+        return action
+
+    def accepting(self, mime_type):
+        """Conjunto (frozenset) das posições dos applets que aceitam esse MIME"""
+        cached = self._accepting_cache.get(mime_type)
+        if cached is None:
+            cached = frozenset(self._accept_exact.get(mime_type, set())
+                               | self._accept_major.get(self._major(mime_type), set())
+                               | self._accept_any)
+            self._accepting_cache[mime_type] = cached
+        return cached
+
+    def slot_of(self, applet):
+        return self._slot.get(id(applet))
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _mime_for_ext(ext):
+        mime_type, _ = mimetypes.guess_type("x" + ext)
+        return mime_type or "application/octet-stream"
+
+    @classmethod
+    def mime_for(cls, path):
+        """guess_type com cache por extensão"""
+        if os.path.isdir(path): return "inode/directory"
+        return cls._mime_for_ext(os.path.splitext(path)[1].lower())
+
+# ============================================================================
+# ⚙️ GERENCIADOR DE TAREFAS (APPLETS)
+# ============================================================================
+
+class Job:
+    """Uma execução de comando; o estado é escrito pelo worker e lido pela UI"""
+    def __init__(self, job_id, command, name, job_class, priority, timeout, cwd, group, meta, stdin=None,
+                 stages=None, output=None):
+        self.id = job_id
+        self.command = command
+        self.stdin = stdin  # bytes entregues na entrada padrão (lotes com caminhos \0)
+        # Pipeline: [(nome, comando)] ligados por pipes; output recebe o stdout do último estágio
+        self.stage_names = [name for name, _ in stages] if stages else []
+        self.stages = [cmd for _, cmd in stages] if stages else None
+        self.output = output
+        self.stage_times = []
+        self.name = name
+        self.job_class = job_class
+        self.priority = priority
+        self.timeout = timeout
+        self.cwd = cwd
+        self.group = group  # Jobs do mesmo drop/applet dividem um card no feed
+        self.meta = meta or {}
+        self.state = "queued"  # queued, running, done, failed, timeout, cancelled
+        self.returncode = None
+        self.stdout = ""
+        self.stderr = ""
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.on_done = None
+        self._proc = None
+
+    @property
+    def is_finished(self):
+        return self.state in ("done", "failed", "timeout", "cancelled")
+
+    @property
+    def duration(self):
+        if not self.started: return 0.0
+        return (self.finished or time.time()) - self.started
+
+class JobManager:
+    """
+    Fila de comandos com prioridade e limite de concorrência por classe:
+    "cpu" (ffmpeg, convert, 7z...) roda no máximo um por núcleo livre, "io"
+    (cópias, downloads, scripts leves) tem mais vagas. Cada job vira um
+    subprocesso com stdout/stderr capturados, timeout e cancelamento (mata o
+    grupo de processos inteiro, não só o shell).
+    """
+    LIMITS = {"cpu": max(1, (os.cpu_count() or 2) // 2), "io": 4}
+    DEFAULT_TIMEOUT = 600
+    OUTPUT_LIMIT = 64 * 1024  # Guarda só o fim da saída de cada job
+
+    def __init__(self, on_update=None, limits=None):
+        self.limits = dict(limits or self.LIMITS)
+        self.on_update = on_update  # Chamado na thread da UI a cada mudança de estado
+        self.jobs = {}
+        self._queues = {cls: [] for cls in self.limits}
+        self._cond = threading.Condition()
+        self._ids = itertools.count(1)
+        self._workers = {cls: 0 for cls in self.limits}
+        self._stopping = False
+
+    def submit(self, command, name=None, job_class="cpu", priority=5, timeout=None, cwd=None,
+               group=None, meta=None, on_done=None, stdin=None, stages=None, output=None):
+        """
+        Enfileira (prioridade menor roda antes). Devolve o Job. Com stages
+        ([(nome, comando)]) o job é um pipeline e command é só a descrição.
+        """
+        if job_class not in self.limits: job_class = "cpu"
+        with self._cond:
+            job = Job(next(self._ids), command, name or command.split()[0], job_class, priority,
+                      timeout or self.DEFAULT_TIMEOUT, cwd, group, meta, stdin, stages, output)
+            job.on_done = on_done
+            self.jobs[job.id] = job
+            heapq.heappush(self._queues[job_class], (priority, job.id, job))
+            # Workers nascem sob demanda, até o limite da classe
+            if self._workers[job_class] < self.limits[job_class]:
+                self._workers[job_class] += 1
+                threading.Thread(target=self._worker, args=(job_class,), daemon=True,
+                                 name=f"job-{job_class}-{self._workers[job_class]}").start()
+            self._cond.notify_all()
+        self._notify(job)
+        return job
+
+    def cancel(self, job_id):
+        with self._cond:
+            job = self.jobs.get(job_id)
+            if not job or job.is_finished: return False
+            if job.state == "queued":
+                # Sai da fila na hora; o worker ignora entradas canceladas
+                job.state = "cancelled"
+                job.finished = time.time()
+            proc = job._proc
+            job.meta["cancel_requested"] = True
+        if proc: self._kill(proc)
+        if job.state == "cancelled": self._finish(job)
+        return True
+
+    def cancel_group(self, group):
+        for job in [j for j in self.jobs.values() if j.group == group]:
+            self.cancel(job.id)
+
+    def group_stats(self, group):
+        stats = {"total": 0, "queued": 0, "running": 0, "done": 0, "failed": 0}
+        with self._cond:
+            for job in self.jobs.values():
+                if job.group != group: continue
+                stats["total"] += 1
+                if job.state in ("queued", "running", "done"): stats[job.state] += 1
+                else: stats["failed"] += 1
+        return stats
+
+    def queue_depth(self, job_class):
+        """Jobs da classe ainda esperando vaga (cancelados que seguem no heap não contam)"""
+        with self._cond:
+            return sum(1 for _, _, job in self._queues.get(job_class, ()) if job.state == "queued")
+
+    def forget_group(self, group):
+        """Remove jobs terminados do grupo (o card do feed já mostrou o resultado)"""
+        with self._cond:
+            for job_id in [j.id for j in self.jobs.values() if j.group == group and j.is_finished]:
+                del self.jobs[job_id]
+
+    def shutdown(self):
+        with self._cond:
+            self._stopping = True
+            running = [j._proc for j in self.jobs.values() if j._proc]
+            self._cond.notify_all()
+        for proc in running: self._kill(proc)
+
+    # --- WORKERS ---
+    def _worker(self, job_class):
+        queue_ = self._queues[job_class]
+        while True:
+            with self._cond:
+                while not queue_ and not self._stopping:
+                    self._cond.wait()
+                if self._stopping: return
+                _, _, job = heapq.heappop(queue_)
+                if job.state != "queued": continue  # Cancelado enquanto esperava
+                job.state = "running"
+                job.started = time.time()
+            self._notify(job)
+            self._run(job)
+            self._finish(job)
+
+    def _run(self, job):
+        if job.stages: return self._run_pipeline(job)
+        try:
+            proc = subprocess.Popen(
+                job.command, shell=True, cwd=job.cwd,
+                stdin=subprocess.PIPE if job.stdin is not None else subprocess.DEVNULL,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                start_new_session=True  # Grupo próprio: cancelar mata o shell e os filhos
+            )
+        except Exception as e:
+            job.state, job.stderr = "failed", str(e)
+            return
+        with self._cond:
+            job._proc = proc
+            cancel_now = job.meta.get("cancel_requested")
+        if cancel_now: self._kill(proc)
+        try:
+            out, err = proc.communicate(input=job.stdin, timeout=job.timeout)
+        except subprocess.TimeoutExpired:
+            self._kill(proc)
+            out, err = proc.communicate()
+            job.state = "timeout"
+        job.stdout = out[-self.OUTPUT_LIMIT:].decode('utf-8', 'replace')
+        job.stderr = err[-self.OUTPUT_LIMIT:].decode('utf-8', 'replace')
+        job.returncode = proc.returncode
+        with self._cond:
+            job._proc = None
+            if job.state == "running":
+                if job.meta.get("cancel_requested"): job.state = "cancelled"
+                else: job.state = "done" if proc.returncode == 0 else "failed"
+
+    def _run_pipeline(self, job):
+        """
+        Estágios ligados por pipes, sem arquivos intermediários. Todos ficam no
+        grupo de processos do primeiro (cancelar/timeout mata a cadeia toda).
+        Só a saída do último estágio é gravada, num .part oculto (o watcher
+        ignora) que vira o artefato final com os.replace se tudo deu certo.
+        """
+        part = None
+        if job.output:
+            part = os.path.join(os.path.dirname(job.output), f".{os.path.basename(job.output)}.part")
+        err_log = tempfile.TemporaryFile()
+        out_f = open(part, 'wb') if part else tempfile.TemporaryFile()
+        procs, ended = [], {}
+        started = time.time()
+        try:
+            for i, stage in enumerate(job.stages):
+                last = i == len(job.stages) - 1
+                # Grupo novo (não sessão nova: de outra sessão os demais estágios não poderiam entrar nele)
+                if not procs:
+                    stdin, group = (subprocess.PIPE if job.stdin is not None else subprocess.DEVNULL), self._join_group(0)
+                else:
+                    stdin, group = procs[-1].stdout, self._join_group(procs[0].pid)
+                proc = subprocess.Popen(stage, shell=True, cwd=job.cwd, stdin=stdin,
+                                        stdout=out_f if last else subprocess.PIPE, stderr=err_log, **group)
+                # O pai não segura o pipe: se um estágio morre, o anterior recebe SIGPIPE
+                if procs: procs[-1].stdout.close()
+                procs.append(proc)
+        except Exception as e:
+            for proc in procs: self._kill(proc)
+            job.state, job.stderr = "failed", str(e)
+            out_f.close()
+            if part and os.path.exists(part): os.remove(part)
+            return
+        out_f.close()
+
+        with self._cond:
+            job._proc = procs[0]
+            cancel_now = job.meta.get("cancel_requested")
+        if cancel_now: self._kill(procs[0])
+
+        def feed():
+            try:
+                procs[0].stdin.write(job.stdin)
+                procs[0].stdin.close()
+            except (BrokenPipeError, OSError): pass
+        if job.stdin is not None: threading.Thread(target=feed, daemon=True).start()
+
+        # Tempo de cada estágio = quando ele terminou, contado do início da cadeia
+        deadline = started + job.timeout
+        try:
+            for i, proc in enumerate(procs):
+                proc.wait(timeout=max(0.0, deadline - time.time()))
+                ended[i] = time.time() - started
+        except subprocess.TimeoutExpired:
+            self._kill(procs[0])
+            for proc in procs: proc.wait()
+            job.state = "timeout"
+        job.stage_times = [(name, ended.get(i)) for i, name in enumerate(job.stage_names)]
+
+        err_log.seek(0, os.SEEK_END)
+        err_log.seek(max(0, err_log.tell() - self.OUTPUT_LIMIT))
+        job.stderr = err_log.read().decode('utf-8', 'replace')
+        err_log.close()
+        # Estágio anterior morto por SIGPIPE não é erro se o último terminou bem (ex: "| head");
+        # via shell o código vem como 128 + sinal
+        ok_codes = (0, -signal.SIGPIPE, 128 + signal.SIGPIPE)
+        codes = [p.returncode for p in procs]
+        failed = codes[-1] != 0 or any(c not in ok_codes for c in codes[:-1])
+        job.returncode = next((c for c in codes if c not in ok_codes), codes[-1])
+        with self._cond:
+            job._proc = None
+            if job.state == "running":
+                if job.meta.get("cancel_requested"): job.state = "cancelled"
+                else: job.state = "failed" if failed else "done"
+        if part:
+            if job.state == "done": os.replace(part, job.output)
+            elif os.path.exists(part): os.remove(part)
+
+    @staticmethod
+    def _join_group(pgid):
+        """Popen kwargs para entrar no grupo de processos pgid (0 = criar um novo)"""
+        if sys.version_info >= (3, 11): return {"process_group": pgid}
+        return {"preexec_fn": lambda: os.setpgid(0, pgid)}
+
+    @staticmethod
+    def _kill(proc):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError, AttributeError):
+            try: proc.kill()
+            except Exception: pass
+
+    def _finish(self, job):
+        job.finished = job.finished or time.time()
+        print(f"⚙️ Job {job.id} ({job.name}) {job.state} em {job.duration:.1f}s (rc={job.returncode})")
+        for name, elapsed in job.stage_times:
+            print(f"   ↳ {name}: " + (f"{elapsed:.2f}s" if elapsed is not None else "não terminou"))
+        if job.on_done:
+            Clock.schedule_once(lambda dt: job.on_done(job), 0)
+        self._notify(job)
+
+    def _notify(self, job):
+        if self.on_update:
+            Clock.schedule_once(lambda dt: self.on_update(job), 0)
+
+class OffloadDecision:
+    def __init__(self, side, est_local, est_remote, heuristic_side, reason, job_class="cpu"):
+        self.side = side  # "local" ou "remote"
+        self.job_class = job_class  # Fila do JobManager se rodar no celular
+        self.est_local = est_local
+        self.est_remote = est_remote
+        self.heuristic_side = heuristic_side  # O que a regra antiga das palavras-chave faria
+        self.reason = reason
+        self.decision_id = None
+
+class OffloadScheduler:
+    """
+    Decide onde rodar cada ação de applet (celular ou PC pelo Vigia) comparando
+    o tempo estimado de cada lado:
+      local  = espera na fila do JobManager + execução × carga da CPU × bateria
+      remoto = RTT + envio do arquivo + execução no PC + volta do resultado
+    A execução vem do histórico de cada ação em cada lado (a + b × MB, mínimos
+    quadrados com esquecimento). Sem histórico, o cost_class do applet (ou a
+    antiga lista de palavras-chave) dá o palpite inicial. Cada decisão fica
+    registrada junto com o que a heurística antiga faria, para comparar.
+    """
+    # Palpite inicial no celular: (segundos fixos, segundos por MB)
+    PRIORS = {"light": (0.2, 0.02), "io": (0.5, 0.05), "cpu": (2.0, 0.8), "heavy": (5.0, 3.0)}
+    REMOTE_SPEEDUP = {"light": 1.0, "io": 1.0, "cpu": 4.0, "heavy": 6.0}
+    HEAVY_KEYWORDS = ["ffmpeg", "convert", "7z", "tar", "make", "docker", "gimp"]
+    DECAY = 0.9                          # Peso das execuções antigas a cada nova
+    DEFAULT_BANDWIDTH = 2 * 1024 * 1024  # Bytes/s até a primeira transferência medida
+    LOW_BATTERY = 20
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS runtimes (
+            action TEXT NOT NULL,
+            side TEXT NOT NULL,
+            n REAL, sx REAL, sy REAL, sxx REAL, sxy REAL,
+            PRIMARY KEY (action, side)
+        );
+        CREATE TABLE IF NOT EXISTS decisions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts REAL, action TEXT, size INTEGER, side TEXT, heuristic TEXT,
+            est_local REAL, est_remote REAL, actual REAL
+        );
+    """
+
+    def __init__(self, db_path):
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(self.SCHEMA)
+        self.conn.commit()
+
+    # --- MODELO DE TEMPO ---
+    def _sums(self, action, side):
+        with self._lock:
+            row = self.conn.execute("SELECT n, sx, sy, sxx, sxy FROM runtimes WHERE action = ? AND side = ?",
+                                    (action, side)).fetchone()
+        return row or (0.0, 0.0, 0.0, 0.0, 0.0)
+
+    def predict(self, action, side, size_mb, cost_class):
+        """Segundos de execução previstos para a ação nesse lado"""
+        a0, b0 = self.PRIORS.get(cost_class, self.PRIORS["cpu"])
+        if side == "remote":
+            speedup = self.REMOTE_SPEEDUP.get(cost_class, 1.0)
+            a0, b0 = a0 / speedup, b0 / speedup
+        n, sx, sy, sxx, sxy = self._sums(action, side)
+        if n < 0.5:
+            return a0 + b0 * size_mb
+        mean_x, mean_y = sx / n, sy / n
+        var_x = sxx / n - mean_x * mean_x
+        if n >= 3 and var_x > 0.01:
+            b = max((sxy / n - mean_x * mean_y) / var_x, 0.0)
+            a = max(mean_y - b * mean_x, 0.0)
+            return a + b * size_mb
+        # Pouco histórico (ou sempre o mesmo tamanho): formato do palpite, escala medida
+        return (a0 + b0 * size_mb) * (mean_y / max(a0 + b0 * mean_x, 1e-6))
+
+    def record(self, action, side, size_bytes, seconds, decision=None):
+        """Execução real terminada: atualiza o histórico (e a decisão, para o relatório)"""
+        x = size_bytes / 1048576
+        d = self.DECAY
+        with self._lock, self.conn:
+            n, sx, sy, sxx, sxy = self.conn.execute(
+                "SELECT n, sx, sy, sxx, sxy FROM runtimes WHERE action = ? AND side = ?", (action, side)
+            ).fetchone() or (0.0, 0.0, 0.0, 0.0, 0.0)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO runtimes (action, side, n, sx, sy, sxx, sxy) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (action, side, n * d + 1, sx * d + x, sy * d + seconds, sxx * d + x * x, sxy * d + x * seconds)
+            )
+            if decision and decision.decision_id:
+                self.conn.execute("UPDATE decisions SET actual = ? WHERE id = ?", (seconds, decision.decision_id))
+
+    # --- DECISÃO ---
+    @staticmethod
+    def _local_load():
+        try:
+            return os.getloadavg()[0] / (os.cpu_count() or 1)
+        except (OSError, AttributeError):
+            return 0.0  # Android novo esconde /proc/loadavg
+
+    @classmethod
+    def cost_class(cls, hints, command):
+        return hints.get("cost_class") or ("heavy" if any(k in command for k in cls.HEAVY_KEYWORDS) else "io")
+
+    @classmethod
+    def job_class(cls, hints, command):
+        """Classe do JobManager: a que o applet pediu, se existir, senão a do cost_class"""
+        if hints.get("job_class") in JobManager.LIMITS: return hints["job_class"]
+        return "io" if cls.cost_class(hints, command) in ("light", "io") else "cpu"
+
+    def decide(self, action, command, size_bytes, hints, client=None, jobs=None, battery=(100, True)):
+        """
+        hints: cost_class ("light", "io", "cpu", "heavy"), job_class, offloadable (bool), output_ratio.
+        client: VigiaNetworkClient conectado (ou None); jobs: JobManager para medir a fila local.
+        """
+        heuristic = "remote" if client and any(k in command for k in self.HEAVY_KEYWORDS) else "local"
+        cost_class = self.cost_class(hints, command)
+        job_class = self.job_class(hints, command)
+        size_mb = size_bytes / 1048576
+
+        run_local = self.predict(action, "local", size_mb, cost_class)
+        load_factor = 1.0 + max(0.0, self._local_load() - 0.5)
+        level, charging = battery
+        battery_factor = 1.0
+        if not charging and job_class == "cpu":
+            battery_factor = 3.0 if level <= self.LOW_BATTERY else 1.2
+        waiting = 0
+        if jobs:
+            waiting = jobs.queue_depth(job_class) / max(jobs.limits.get(job_class, 1), 1)
+        est_local = (waiting + 1) * run_local * load_factor * battery_factor
+
+        est_remote = float("inf")
+        reason = "Vigia desconectado"
+        if client and client.connected and hints.get("offloadable", True):
+            bandwidth = client.bandwidth_bps or self.DEFAULT_BANDWIDTH
+            rtt = (client.rtt_avg_ms or 50) / 1000
+            moved = size_bytes * (1 + float(hints.get("output_ratio", 1.0)))
+            est_remote = rtt * 4 + moved / bandwidth + self.predict(action, "remote", size_mb, cost_class)
+            reason = f"local {est_local:.1f}s x PC {est_remote:.1f}s"
+        elif client and client.connected:
+            reason = "applet não permite offload"
+
+        side = "remote" if est_remote < est_local else "local"
+        decision = OffloadDecision(side, est_local, est_remote, heuristic, reason, job_class)
+        with self._lock, self.conn:
+            cur = self.conn.execute(
+                "INSERT INTO decisions (ts, action, size, side, heuristic, est_local, est_remote) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), action, size_bytes, side, heuristic, est_local, est_remote if est_remote != float("inf") else None)
+            )
+            decision.decision_id = cur.lastrowid
+        print(f"🧮 {action}: {side} ({reason}; heurística antiga: {heuristic})")
+        return decision
+
+    def report(self, since=0):
+        """
+        Compara as decisões com a heurística das palavras-chave: quantas
+        divergiram e quanto tempo (estimado) o modelo economizou nelas.
+        """
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT side, heuristic, est_local, est_remote, actual FROM decisions WHERE ts >= ?", (since,)
+            ).fetchall()
+        summary = {"decisions": len(rows), "offloaded": 0, "agree": 0, "disagree": 0,
+                   "est_seconds_saved": 0.0, "measured": 0, "mean_abs_error": 0.0}
+        errors = []
+        for side, heuristic, est_local, est_remote, actual in rows:
+            if side == "remote": summary["offloaded"] += 1
+            if side == heuristic:
+                summary["agree"] += 1
+            else:
+                summary["disagree"] += 1
+                est = {"local": est_local, "remote": est_remote}
+                if est[heuristic] is not None and est[side] is not None:
+                    summary["est_seconds_saved"] += est[heuristic] - est[side]
+            if actual is not None:
+                predicted = est_local if side == "local" else est_remote
+                if predicted is not None: errors.append(abs(predicted - actual))
+        summary["measured"] = len(errors)
+        summary["mean_abs_error"] = sum(errors) / len(errors) if errors else 0.0
+        return summary
+
+    # --- EXECUÇÃO NO PC ---
+    async def run_remote(self, client, file_paths, spec, action, decision):
+        """
+        Offload completo (gateway com "exec_reply"): envia os arquivos do lote,
+        roda a ação (spec) uma vez no PC, traz os arquivos gerados de volta
+        para a pasta de origem e mede. Devolve (ok, mensagem).
+        """
+        size = 0
+        remote_inputs = []
+        for file_path in file_paths:
+            file_size = os.path.getsize(file_path) if os.path.isfile(file_path) else 0
+            remote_input = f"Offload/{os.path.basename(file_path)}"
+            if file_size:
+                t = await client.transfers.run("upload", file_path, remote_input)
+                if t.state != "done": return False, f"envio falhou: {t.error or t.state}"
+            size += file_size
+            remote_inputs.append(remote_input)
+        command, stdin = AppletCommand.build(spec, remote_inputs)
+        request = {"command": "remote_exec_raw", "shell_command": command, "origin_file": file_paths[0],
+                   "origin_files": list(file_paths), "cwd": "Offload", "collect_outputs": True}
+        if stdin is not None: request["stdin"] = stdin.decode('utf-8', 'surrogateescape')
+        resp = await client._request(request, JobManager.DEFAULT_TIMEOUT)
+        if resp.get("status") != "ok" or resp.get("returncode", 0) != 0:
+            return False, resp.get("error") or f"código {resp.get('returncode')}"
+        elapsed = float(resp.get("elapsed", 0) or 0)
+        if elapsed: self.record(action, "remote", size, elapsed, decision)
+        dest_dir = os.path.dirname(file_paths[0])
+        fetched = 0
+        for remote_out in resp.get("outputs", []):
+            t = await client.transfers.run("download", os.path.join(dest_dir, os.path.basename(remote_out)), remote_out)
+            if t.state == "done": fetched += 1
+        return True, f"{fetched} arquivo(s) de volta em {elapsed:.1f}s no PC"
+
 # ============================================================================
 # 🔔 CARDS DE NOTIFICAÇÃO E RSS
 # ============================================================================
@@ -1135,25 +4549,28 @@ class NotificationCard(MDCard):
         self.ripple_behavior = True
 
         # Ícone à esquerda
-        self.add_widget(MDIcon(
+        self.icon_widget = MDIcon(
             icon=icon_name,
             theme_text_color="Custom",
             text_color=(1,1,1,1),
             pos_hint={"center_y": .5},
             font_size="28sp"
-        ))
+        )
+        self.add_widget(self.icon_widget)
 
         # Textos (Título e Descrição)
-        text_box = BoxLayout(orientation='vertical', pos_hint={"center_y": .5})
-        text_box.add_widget(MDLabel(
+        self.text_box = BoxLayout(orientation='vertical', pos_hint={"center_y": .5})
+        self.title_label = MDLabel(
             text=title, font_style="Subtitle2", bold=True,
             theme_text_color="Custom", text_color=(1,1,1,1), shorten=True
-        ))
-        text_box.add_widget(MDLabel(
+        )
+        self.text_label = MDLabel(
             text=text, font_style="Caption",
             theme_text_color="Custom", text_color=(0.9,0.9,0.9,1), shorten=True
-        ))
-        self.add_widget(text_box)
+        )
+        self.text_box.add_widget(self.title_label)
+        self.text_box.add_widget(self.text_label)
+        self.add_widget(self.text_box)
 
         # Botão de Fechar à direita
         close_btn = MDIconButton(
@@ -1171,6 +4588,23 @@ class NotificationCard(MDCard):
         anim.bind(on_complete=lambda *x: self.parent.remove_widget(self) if self.parent else None)
         anim.start(self)
 
+class ProgressNotificationCard(NotificationCard):
+    """Card do feed com barra de progresso (transferências, tarefas longas)"""
+    def __init__(self, title, text, icon_name="progress-upload", **kwargs):
+        super().__init__(title, text, icon_name, **kwargs)
+        self.height = dp(90)
+        self.progress_bar = MDProgressBar(value=0, max=1, size_hint_y=None, height=dp(4), color=(1, 1, 1, 0.9))
+        self.text_box.add_widget(self.progress_bar)
+
+    def set_progress(self, fraction, text=None):
+        self.progress_bar.value = max(0.0, min(1.0, fraction))
+        if text is not None: self.text_label.text = text
+
+    def finish(self, text, icon_name="check-circle-outline"):
+        self.progress_bar.value = 1
+        self.text_label.text = text
+        self.icon_widget.icon = icon_name
+
 class RSSFeedCard(MDCard):
     def __init__(self, title, source_name, link, **kwargs):
         super().__init__(**kwargs)
@@ -1214,21 +4648,135 @@ class RSSFeedCard(MDCard):
         anim.bind(on_complete=lambda *x: self.parent.remove_widget(self) if self.parent else None)
         anim.start(self)
 
+# ============================================================================
+# ⏱️ AGENDADOR DE TRABALHO DE UI (ORÇAMENTO POR FRAME)
+# ============================================================================
+
+class UIWorkScheduler:
+    """
+    Espalha a construção de widgets por vários frames. Cada tarefa é um
+    gerador: cada next() faz um pedaço pequeno (um widget, um lote de
+    registros) e o agendador roda pedaços até estourar o orçamento do frame.
+    Prioridade menor roda antes (o que está na tela primeiro). Uma tarefa
+    nova com a mesma chave cancela a antiga (refresh novo invalida o velho);
+    flush() termina uma tarefa na hora, para quem precisa do resultado já.
+    """
+    def __init__(self, budget_ms=6.0):
+        self.budget = budget_ms / 1000.0
+        self._heap = []  # (prioridade, seq, tarefa)
+        self._tasks = {}  # chave -> tarefa ativa
+        self._seq = itertools.count()
+        self._event = None
+        self._last_frame = None
+        self.stats = {"frames": 0, "steps": 0, "cancelled": 0, "over_budget": 0,
+                      "work_ms_avg": 0.0, "work_ms_max": 0.0, "frame_ms_max": 0.0}
+
+    def submit(self, key, work, priority=5, on_done=None, eager=False):
+        """work: gerador. eager: o primeiro pedaço (o que aparece na tela) roda já. Devolve a tarefa"""
+        self.cancel(key)
+        task = {"key": key, "work": work, "on_done": on_done, "cancelled": False}
+        self._tasks[key] = task
+        if eager:
+            try:
+                next(work)
+            except StopIteration:
+                self._finish(task)
+                return task
+            except Exception as e:
+                print(f"⚠️ [UI] Tarefa '{key}' falhou: {e}")
+                self._finish(task)
+                return task
+        heapq.heappush(self._heap, (priority, next(self._seq), task))
+        self._wake()
+        return task
+
+    def cancel(self, key):
+        task = self._tasks.pop(key, None)
+        if task:
+            task["cancelled"] = True
+            task["work"].close()
+            self.stats["cancelled"] += 1
+
+    def pending(self, key):
+        return key in self._tasks
+
+    def flush(self, key):
+        """Roda o que falta da tarefa agora (ex: antes de aplicar um patch por índice)"""
+        task = self._tasks.get(key)
+        if not task: return
+        try:
+            for _ in task["work"]: pass
+        except Exception as e:
+            print(f"⚠️ [UI] Tarefa '{key}' falhou: {e}")
+        self._finish(task)
+
+    def _wake(self):
+        if self._event is None:
+            self._event = Clock.schedule_once(self._run_frame, 0)
+
+    def _finish(self, task):
+        if task["cancelled"]: return
+        task["cancelled"] = True  # Sai do heap na próxima passada
+        if self._tasks.get(task["key"]) is task: del self._tasks[task["key"]]
+        if task["on_done"]: task["on_done"]()
+
+    def _run_frame(self, dt):
+        self._event = None
+        start = time.perf_counter()
+        # Intervalo real entre frames com trabalho pendente (o "jank" que o usuário sente)
+        if self._last_frame is not None:
+            self.stats["frame_ms_max"] = max(self.stats["frame_ms_max"], (start - self._last_frame) * 1000)
+        deadline = start + self.budget
+        while self._heap:
+            _, _, task = self._heap[0]
+            if task["cancelled"]:
+                heapq.heappop(self._heap)
+                continue
+            try:
+                next(task["work"])
+                self.stats["steps"] += 1
+            except StopIteration:
+                heapq.heappop(self._heap)
+                self._finish(task)
+            except Exception as e:
+                print(f"⚠️ [UI] Tarefa '{task['key']}' falhou: {e}")
+                heapq.heappop(self._heap)
+                self._finish(task)
+            if time.perf_counter() >= deadline: break
+
+        elapsed = (time.perf_counter() - start) * 1000
+        stats = self.stats
+        stats["frames"] += 1
+        stats["work_ms_avg"] += (elapsed - stats["work_ms_avg"]) * 0.1
+        stats["work_ms_max"] = max(stats["work_ms_max"], elapsed)
+        if elapsed > self.budget * 1000 * 1.5: stats["over_budget"] += 1  # Um pedaço só já passou do orçamento
+        if self._heap:
+            self._last_frame = time.perf_counter()
+            self._wake()
+        else:
+            self._last_frame = None
+
 # ============================================================================
 # 🖱️ DESKTOP ITEM COM DRAG & DROP (FÍSICA + INTEGRAÇÃO VIGIA + GRAB FIX)
 # ============================================================================
-class DesktopItem(ButtonBehavior, BoxLayout):
+class DesktopItem(RecycleDataViewBehavior, ButtonBehavior, BoxLayout):
     icon_name = StringProperty("unknown")
     label_text = StringProperty("Arquivo")
     file_path = StringProperty("")
+    status = StringProperty("")  # Vem em lote do MetadataStore junto com os dados da grade
+    mtime = NumericProperty(0)  # Do stat do scandir (DirectoryModel): sem getmtime por item
     status_color = ListProperty([0, 0, 0, 0])
     flash_color = ListProperty([0, 0, 0, 0])
     is_remote = BooleanProperty(False)
+    selected = BooleanProperty(False)  # Parte da seleção múltipla (estado mora no app, sobrevive à reciclagem)
 
     # Variáveis internas de controle do Drag
     _touch_start_pos = None
     _is_dragging = False
     _drag_avatar = None
+    _drag_paths = None
+    _thumb_for = None  # Arquivo cuja miniatura está no ícone agora
+    _generic_texture = None
     _long_press_timer = None
 
     def __init__(self, refresh_callback=None, **kwargs):
@@ -1241,10 +4789,13 @@ class DesktopItem(ButtonBehavior, BoxLayout):
         self.spacing = dp(2)
 
         with self.canvas.before:
+            self.select_instruction = Color(rgba=(0, 0, 0, 0))
+            self.select_rect = Rectangle(pos=self.pos, size=self.size)
             self.flash_instruction = Color(rgba=self.flash_color)
             self.flash_rect = Rectangle(pos=self.pos, size=self.size)
 
-        self.bind(pos=self._update_rect, size=self._update_rect, flash_color=self._update_color)
+        self.bind(pos=self._update_rect, size=self._update_rect, flash_color=self._update_color, selected=self._update_selected)
+        self.bind(pos=self._draw_status_dot, size=self._draw_status_dot)
 
         # Construção Visual
         self.icon_widget = SmartIcon(icon_name=self.icon_name, icon_size=dp(48))
@@ -1261,10 +4812,51 @@ class DesktopItem(ButtonBehavior, BoxLayout):
         self.add_widget(self.icon_widget)
         self.add_widget(self.label_widget)
         self.bind(icon_name=self._update_icon, label_text=self._update_label)
+        if self.file_path:
+            self.update_status_visual()
+            self.check_if_new()
+
+    # --- RECICLAGEM (RecycleView reaproveita o widget para outro arquivo) ---
+
+    def refresh_view_attrs(self, rv, index, data):
+        if self._long_press_timer:
+            self._long_press_timer.cancel()
+            self._long_press_timer = None
+        Animation.cancel_all(self, 'flash_color')
+        self.flash_color = [0, 0, 0, 0]
+        self.opacity = 1.0
+        self._touch_start_pos = None
+        self._restore_generic_icon()
+        super().refresh_view_attrs(rv, index, data)
+        self.selected = not self.is_remote and self.file_path in MDApp.get_running_app().selected_paths
         self.update_status_visual()
         self.check_if_new()
-
-    def _update_rect(self, *args): self.flash_rect.pos = self.pos; self.flash_rect.size = self.size
+        self._request_thumbnail()
+
+    # --- MINIATURA (ThumbnailService entrega a textura pronta, fora da thread da UI) ---
+
+    def _request_thumbnail(self):
+        if self.is_remote or self.icon_name != "image" or not self.file_path: return
+        path = self.file_path
+        MDApp.get_running_app().thumbnails.request(path, "icon", lambda tex: self._apply_thumbnail(path, tex))
+
+    def _apply_thumbnail(self, path, texture):
+        # A view pode ter sido reciclada para outro arquivo enquanto a miniatura era gerada
+        if path != self.file_path or self.icon_name != "image": return
+        if self._thumb_for is None: self._generic_texture = self.icon_widget.image.texture
+        self._thumb_for = path
+        self.icon_widget.image.texture = texture
+
+    def _restore_generic_icon(self):
+        # Mesmo icon_name ("image") não recarrega o source: devolve a textura genérica na mão
+        if self._thumb_for is None: return
+        self._thumb_for = None
+        self.icon_widget.image.texture = self._generic_texture
+
+    def _update_rect(self, *args):
+        self.flash_rect.pos = self.select_rect.pos = self.pos
+        self.flash_rect.size = self.select_rect.size = self.size
+    def _update_selected(self, *args): self.select_instruction.rgba = (0.3, 0.6, 1, 0.35) if self.selected else (0, 0, 0, 0)
     def _update_color(self, *args): self.flash_instruction.rgba = self.flash_color
     def _update_icon(self, instance, value): self.icon_widget.icon_name = value
     def _update_label(self, instance, value): self.label_widget.text = value
@@ -1318,6 +4910,7 @@ class DesktopItem(ButtonBehavior, BoxLayout):
                     if touch.y > Window.height - dp(100) and not app.is_shelf_open:
                         app.toggle_top_shelf()
                         self.vibrate_light()
+                    if app.is_shelf_open: app.update_drop_hover(touch.pos)
 
             return True
         return super().on_touch_move(touch)
@@ -1335,6 +4928,7 @@ class DesktopItem(ButtonBehavior, BoxLayout):
             # --- LÓGICA DO DROP (SOLTAR) ---
             if self._is_dragging:
                 app = MDApp.get_running_app()
+                app.end_drop_highlight()
                 shelf = app.root.ids.top_shelf
                 dropped_on_applet = False
 
@@ -1344,8 +4938,9 @@ class DesktopItem(ButtonBehavior, BoxLayout):
                     # Itera sobre os cards dos applets
                     for applet_card in grid.children:
                         if applet_card.collide_point(touch.x, touch.y):
-                            self._trigger_applet_action(applet_card.applet_data)
+                            self._trigger_applet_action(applet_card.applet_data, self._drag_paths)
                             dropped_on_applet = True
+                            if len(self._drag_paths) > 1: app.clear_selection()
                             break
 
                 # 2. A MÁGICA DA ANIMAÇÃO (Bumerangue ou Sucesso)
@@ -1394,6 +4989,13 @@ class DesktopItem(ButtonBehavior, BoxLayout):
     def _start_drag(self, touch):
         """Inicializa o modo de arrasto e cria o avatar visual"""
         self._is_dragging = True
+        # A view pode ser reciclada durante o arrasto; guarda os arquivos arrastados
+        app = MDApp.get_running_app()
+        # Arrastar um item selecionado leva a seleção inteira (um lote só no applet)
+        if not self.is_remote and self.file_path in app.selected_paths:
+            self._drag_paths = [p for p in app.selected_paths if os.path.exists(p)] or [self.file_path]
+        else:
+            self._drag_paths = [self.file_path]
 
         # Cancela o menu de contexto, pois virou arrasto
         if self._long_press_timer:
@@ -1405,14 +5007,14 @@ class DesktopItem(ButtonBehavior, BoxLayout):
         from kivymd.uix.card import MDCard
         from kivymd.uix.label import MDIcon
 
-        app = MDApp.get_running_app()
         # Cria o fantasma
         self._drag_avatar = MDCard(
             size_hint=(None, None), size=self.size,
             md_bg_color=(1, 1, 1, 0.3), radius=[16,], elevation=4
         )
         icon = MDIcon(icon=self.icon_name, font_size="48sp", pos_hint={"center_x": .5, "center_y": .6})
-        lbl = MDLabel(text=self.label_text, halign="center", font_style="Caption", pos_hint={"center_x": .5, "y": 0.1}, theme_text_color="Custom", text_color=(1,1,1,1))
+        lbl_text = self.label_text if len(self._drag_paths) == 1 else f"{len(self._drag_paths)} itens"
+        lbl = MDLabel(text=lbl_text, halign="center", font_style="Caption", pos_hint={"center_x": .5, "y": 0.1}, theme_text_color="Custom", text_color=(1,1,1,1))
 
         self._drag_avatar.add_widget(icon)
         self._drag_avatar.add_widget(lbl)
@@ -1424,76 +5026,100 @@ class DesktopItem(ButtonBehavior, BoxLayout):
         app.root.add_widget(self._drag_avatar)
         self.opacity = 0.4
 
-    def _trigger_applet_action(self, applet_data):
-        """O Cérebro Mágico: Decide o comando e onde executar (Local vs Vigia)"""
-        app = MDApp.get_running_app()
-
-        # 1. Identifica MIME Type
-        mime_type, _ = mimetypes.guess_type(self.file_path)
-        if not mime_type: mime_type = "application/octet-stream"
-
-        print(f"🧩 Drop detectado! Arquivo: {self.file_path} ({mime_type}) -> Applet: {applet_data.get('name')}")
+        # Destaca na prateleira só os applets que aceitam este arquivo (calculado uma vez)
+        if not self.is_remote: app.begin_drop_highlight(self._drag_paths)
 
-        target_action = None
-
-        # 2. Busca Trigger Específico (Drop Triggers)
-        # Ex: "image/png": "converter_png"
-        drop_triggers = applet_data.get("drop_triggers", {})
-        trigger_id = drop_triggers.get(mime_type)
+    def _trigger_applet_action(self, applet_data, file_paths=None):
+        """O Cérebro Mágico: Decide o comando e onde executar (Local vs Vigia), para um arquivo ou uma seleção"""
+        app = MDApp.get_running_app()
+        file_paths = file_paths or self.file_path
+        if isinstance(file_paths, str): file_paths = [file_paths]
 
-        # Tenta wildcard (ex: image/*)
-        if not trigger_id:
-            for key, val in drop_triggers.items():
-                if key.endswith("/*") and mime_type.startswith(key[:-2]):
-                    trigger_id = val
-                    break
+        # 1/2/3. MIME (cache por extensão) e ação (índice compilado); a seleção é agrupada por ação
+        by_action = {}
+        for path in file_paths:
+            target_action = app.applet_index.resolve(applet_data, AppletDispatchIndex.mime_for(path))
+            if target_action: by_action.setdefault(id(target_action), (target_action, []))[1].append(path)
 
-        if trigger_id:
-            # Acha a ação correspondente ao ID
-            target_action = next((a for a in applet_data.get("actions", []) if a.get("id") == trigger_id), None)
-
-        # 3. Fallback: Busca a primeira ação compatível na lista de ações
-        if not target_action:
-            for action in applet_data.get("actions", []):
-                triggers = action.get("triggers", {})
-                accepted_mimes = triggers.get("mimetype", [])
-                if any(m == "*" or m == mime_type or (m.endswith("/*") and mime_type.startswith(m[:-2])) for m in accepted_mimes):
-                    target_action = action
-                    break
+        print(f"🧩 Drop detectado! {len(file_paths)} arquivo(s) -> Applet: {applet_data.get('name')}")
 
-        if not target_action:
+        if not by_action:
             app.spawn_bubble("Este applet não aceita este arquivo.", "file-cancel")
             return
 
-        # 4. Monta o Comando
-        cmd_template = target_action.get("command", "")
-        if not cmd_template:
-            app.spawn_bubble("Applet sem comando definido.", "alert")
-            return
+        app.spawn_bubble(f"Executando: {applet_data.get('name')}", "rocket-launch")
+        for target_action, paths in by_action.values():
+            # 4. Monta o Comando
+            if not (target_action.get("command") or target_action.get("pipeline")):
+                app.spawn_bubble("Applet sem comando definido.", "alert")
+                continue
+            # Ações em lote (%FILES ou stdin) rodam uma vez por lote, não uma vez por arquivo
+            for batch in AppletCommand.chunks(target_action, paths):
+                self._dispatch_applet_batch(app, applet_data, target_action, batch)
+
+    def _dispatch_applet_batch(self, app, applet_data, target_action, paths):
+        applet_name = applet_data.get('name', 'Applet')
+        label = os.path.basename(paths[0]) if len(paths) == 1 else f"{len(paths)} arquivos"
+        hints = {**applet_data.get("hints", {}), **{k: target_action[k] for k in ("cost_class", "job_class", "offloadable", "output_ratio") if k in target_action}}
+        job_args = dict(
+            priority=target_action.get("priority", 5),
+            timeout=target_action.get("timeout"),
+            group=f"{applet_name}:{target_action.get('id', '')}",
+            meta={"file": paths[0], "files": paths, "applet": applet_data.get("name"), "action": target_action.get("id")},
+        )
 
-        # Escapa o caminho do arquivo para evitar injeção/erros de espaço
-        safe_path = shlex.quote(self.file_path)
-        real_cmd = cmd_template.replace("%F", safe_path).replace("%f", safe_path)
+        if target_action.get("pipeline"):
+            # Pipeline: um job só, estágios ligados por pipes; só o artefato final cai na pasta atual
+            # (sempre local: o gateway executa um comando por vez e não devolve stdout em fluxo)
+            stages, output, stdin = AppletCommand.build_pipeline(target_action, paths, app.current_path)
+            print(f"⚙️ Pipeline local: {' | '.join(cmd for _, cmd in stages)} > {output}")
+            command = " | ".join(cmd for _, cmd in stages)
+            app.jobs.submit(command, name=f"{applet_name}: {label}", job_class=OffloadScheduler.job_class(hints, command),
+                            cwd=os.path.dirname(paths[0]) or None, stdin=stdin, stages=stages, output=output,
+                            **job_args)
+            return
 
-        app.spawn_bubble(f"Executando: {applet_data.get('name')}", "rocket-launch")
+        # Escapa os caminhos para evitar injeção/erros de espaço
+        real_cmd, stdin = AppletCommand.build(target_action, paths)
 
         # 5. DECISÃO HÍBRIDA: PC (Vigia) ou Celular (Local)?
-        # Comandos pesados vão para o PC se estiver conectado
-        heavy_keywords = ["ffmpeg", "convert", "7z", "tar", "make", "docker", "gimp"]
-        is_heavy = any(k in real_cmd for k in heavy_keywords)
+        # O OffloadScheduler estima o tempo de cada lado (histórico + rede + carga + bateria)
+        action_key = f"{applet_name}:{target_action.get('id', real_cmd)}"
+        if stdin is not None and "exec_stdin" not in app.network.features:
+            hints["offloadable"] = False  # Gateway não repassa stdin: o lote fica no celular
+        size = sum(os.path.getsize(p) for p in paths if os.path.isfile(p))
+        decision = app.offload.decide(
+            action_key, real_cmd, size, hints,
+            client=app.network if app.is_connected else None, jobs=app.jobs,
+            battery=(app.battery_level, app.battery_charging)
+        )
 
-        if app.is_connected and is_heavy:
+        if decision.side == "remote":
             # Manda pro Vigia
             app.spawn_bubble("Enviando processamento para o PC...", "monitor-share")
-            app.network.send_command({
-                "command": "remote_exec_raw",
-                "shell_command": real_cmd,
-                "origin_file": self.file_path
-            })
+            if {"exec_reply", "xfer"} <= app.network.features:
+                app.run_offloaded(paths, target_action, action_key, decision, applet_name)
+            else:
+                # Gateway antigo: só dispara o comando (sem retorno nem medição)
+                app.network.send_command({
+                    "command": "remote_exec_raw",
+                    "shell_command": real_cmd,
+                    "origin_file": paths[0],
+                    "origin_files": paths
+                })
         else:
-            # Executa no Android (Termux environment ou shell simples)
-            print(f"⚙️ Executando localmente: {real_cmd}")
-            threading.Thread(target=lambda: os.system(real_cmd)).start()
+            # Executa no Android (Termux environment ou shell simples), pela fila do JobManager:
+            # 50 arquivos soltos no applet não viram 50 ffmpegs ao mesmo tempo
+            print(f"⚙️ Enfileirando localmente: {real_cmd}")
+            app.jobs.submit(
+                real_cmd,
+                name=f"{applet_name}: {label}",
+                cwd=os.path.dirname(paths[0]) or None,
+                on_done=lambda job: job.state == "done" and app.offload.record(action_key, "local", size, job.duration, decision),
+                stdin=stdin,
+                job_class=decision.job_class,
+                **job_args
+            )
 
     # --- UTILITÁRIOS ---
 
@@ -1508,11 +5134,8 @@ class DesktopItem(ButtonBehavior, BoxLayout):
             except: pass
 
     def check_if_new(self):
-        if self.is_remote: return
-        try:
-            mtime = os.path.getmtime(self.file_path)
-            if (time.time() - mtime) < 3.0: self.trigger_flash()
-        except: pass
+        if self.is_remote or not self.file_path: return
+        if self.mtime and (time.time() - self.mtime) < 3.0: self.trigger_flash()
 
     def trigger_flash(self):
         self.flash_color = [1, 1, 0, 0.6]
@@ -1520,13 +5143,18 @@ class DesktopItem(ButtonBehavior, BoxLayout):
         anim.start(self)
 
     def update_status_visual(self):
-        if self.is_remote: return
-        attrs = MetadataManager.get_attributes(self.file_path)
-        status = attrs.get("status")
+        if self.is_remote or not self.file_path:
+            self.status_color = [0, 0, 0, 0]
+            self._draw_status_dot()
+            return
+        status = self.status
         if status == "aprovado": self.status_color = [0.2, 0.8, 0.2, 1]
         elif status == "revisao": self.status_color = [1, 0.8, 0, 1]
         elif status == "pendente": self.status_color = [1, 0.3, 0.3, 1]
         else: self.status_color = [0, 0, 0, 0]
+        self._draw_status_dot()
+
+    def _draw_status_dot(self, *args):
         self.canvas.after.clear()
         if self.status_color[3] > 0:
             with self.canvas.after:
@@ -1544,6 +5172,9 @@ class DesktopItem(ButtonBehavior, BoxLayout):
         app = MDApp.get_running_app()
         if self.is_remote:
              app.send_remote_open(self.label_text)
+        elif app.selected_paths:
+            # Com seleção ativa, o toque marca/desmarca em vez de abrir
+            app.toggle_selection(self.file_path, self)
         else:
             SofiaShell.execute(self.file_path)
 
@@ -1710,6 +5341,20 @@ KV = '''
         size_hint: 1, 1
         pos_hint: {"center_x": .5, "center_y": .5}
 
+# Grade virtualizada: o RecycleView só cria DesktopItems para o que está visível
+<DesktopGridView@RecycleView>:
+    viewclass: "DesktopItem"
+    effect_cls: "ScrollEffect"
+
+    RecycleGridLayout:
+        cols: 4
+        padding: dp(0)
+        spacing: dp(10)
+        size_hint_y: None
+        height: self.minimum_height
+        default_size: dp(85), dp(100)
+        default_size_hint: None, None
+
 <ControlBar@MDCard>:
     size_hint_y: None
     height: dp(54)
@@ -1724,7 +5369,7 @@ MDFloatLayout:
 
     Image:
         id: wallpaper_image
-        source: app.current_wallpaper
+        source: app.wallpaper_display
         allow_stretch: True
         keep_ratio: False
         size_hint: 1, 1
@@ -1836,26 +5481,16 @@ MDFloatLayout:
                         size: dp(45), dp(45)
                         on_release: app.open_creation_menu()
 
-                ScrollView:
+                DesktopGridView:
+                    id: desktop_grid
                     size_hint: 1, 1
-                    effect_cls: "ScrollEffect"
-
-                    GridLayout:
-                        id: desktop_grid
-                        cols: 4
-                        padding: dp(0)
-                        spacing: dp(10)
-                        size_hint_y: None
-                        height: self.minimum_height
-                        row_default_height: dp(100)
-                        row_force_default: True
 
         # 3. PÁGINA DIREITA: VIGIA
         MDFloatLayout:
             id: page_remote
 
             MDLabel:
-                text: "Vigia PC Link" if app.is_connected else "Vigia Desconectado"
+                text: ("Vigia Reconectando..." if app.vigia_reconnecting else "Vigia PC Link" + ("  ·  %d ms" % app.vigia_rtt_ms if app.vigia_rtt_ms else "")) if app.is_connected else "Vigia Desconectado"
                 pos_hint: {"center_x": .5, "top": 0.96}
                 halign: "center"
                 font_style: "H6"
@@ -1864,28 +5499,28 @@ MDFloatLayout:
                 size_hint_y: None
                 height: dp(30)
 
+            MDIconButton:
+                icon: "sync-off" if app.mesa_sync_paused else "sync"
+                pos_hint: {"right": 0.98, "top": 0.975}
+                theme_text_color: "Custom"
+                text_color: 1, 1, 1, 0.8
+                opacity: 1 if app.is_connected and app.mesa_sync_active else 0
+                disabled: not (app.is_connected and app.mesa_sync_active)
+                on_release: app.open_sync_menu(self)
+
             BoxLayout:
                 orientation: 'vertical'
                 pos_hint: {'top': 0.9}
                 size_hint_y: None
                 height: root.height - dp(100)
                 padding: [dp(15), dp(10), dp(15), 0]
-                opacity: 1 if app.is_connected else 0
-                disabled: not app.is_connected
+                # Offline a grade continua com o cache da última listagem; só as ações ao vivo exigem conexão
+                opacity: 1 if app.is_connected or app.remote_files else 0
 
-                ScrollView:
+                DesktopGridView:
+                    id: remote_grid
                     size_hint: 1, 1
-                    effect_cls: "ScrollEffect"
-
-                    GridLayout:
-                        id: remote_grid
-                        cols: 4
-                        padding: dp(0)
-                        spacing: dp(10)
-                        size_hint_y: None
-                        height: self.minimum_height
-                        row_default_height: dp(100)
-                        row_force_default: True
+                    opacity: 0.5 if app.remote_stale else 1
 
             MDCard:
                 size_hint: None, None
@@ -2322,6 +5957,11 @@ class SophiaMobileApp(MDApp):
 
     is_vigia_open = False
     is_connected = BooleanProperty(False)
+    vigia_reconnecting = BooleanProperty(False)
+    vigia_rtt_ms = NumericProperty(0)
+    remote_stale = BooleanProperty(False)  # Grade remota mostrando cache/estado antigo
+    mesa_sync_active = BooleanProperty(False)
+    mesa_sync_paused = BooleanProperty(False)
     remote_files = ListProperty([])
     stored_ip = StringProperty("192.168.0.100")
     stored_pin = StringProperty("")
@@ -2335,6 +5975,8 @@ class SophiaMobileApp(MDApp):
     clock_time = StringProperty("00:00")
     clock_date = StringProperty("")
     battery_percent = StringProperty("50%")
+    battery_level = NumericProperty(100)
+    battery_charging = BooleanProperty(True)
     theme_style_str = StringProperty("Light")
 
     # Nome da Rede Wi-Fi (Dinâmico)
@@ -2345,6 +5987,9 @@ class SophiaMobileApp(MDApp):
 
     # Novo: Papel de Parede Atual (com persistência)
     current_wallpaper = StringProperty("assets/wallpaper.jpg")
+    # O que a tela mostra: a variante no tamanho da janela (WallpaperCache)
+    wallpaper_display = StringProperty("")
+    _wallpaper_event = None
 
     known_mesa_files = ListProperty([])
     current_path = StringProperty("")
@@ -2377,6 +6022,20 @@ class SophiaMobileApp(MDApp):
         self.theme_cls.primary_palette = "Blue"
         self.theme_style_str = self.theme_cls.theme_style
         self.network = VigiaNetworkClient(self)
+        self.remote_cache = None
+        self._remote_cache_key = None
+        self._transfer_cards = {}
+        self.jobs = JobManager(on_update=self.on_job_update)
+        self.dir_model = DirectoryModel()
+        self.ui_work = UIWorkScheduler()
+        self.applet_index = AppletDispatchIndex()
+        self._drop_targets, self._drop_hover = [], None
+        self.selected_paths = {}  # Ordenado (dict) para o lote seguir a ordem em que o usuário marcou
+        self._job_cards = {}
+        self.mesa_sync = None
+        self._remote_cache_event = None
+        self.search_engine = DesktopSearchEngine()
+        self._search_event = None
 
         Clock.schedule_interval(self.update_clock, 1)
         self.update_clock(0)
@@ -2408,12 +6067,17 @@ class SophiaMobileApp(MDApp):
         self.APPS_DIR = os.path.join(self.SOPHIA_ROOT, "Aplicativos")
         self.SYS_DIR = os.path.join(self.SOPHIA_ROOT, "Sistema")
         self.APPLETS_DIR = os.path.join(self.SYS_DIR, "Applets")
+        self.applet_registry = AppletRegistry(self.APPLETS_DIR, os.path.join(self.SYS_DIR, "applets_cache.json"))
+        self._shelf_cards = {}
+        self.thumbnails = ThumbnailService(os.path.join(self.SYS_DIR, "Thumbs"), THUMBNAIL_POOL)
         self.WALLPAPERS_DIR = os.path.join(self.SOPHIA_ROOT, "Wallpapers")
+        self.wallpapers = WallpaperCache(os.path.join(self.SYS_DIR, "WallpaperCache"))
         
         # --- A NOVA ROTA DOS ÍCONES ---
         self.ICONS_DIR = os.path.join(self.SOPHIA_ROOT, "mobile_icons")
         global ICONS_ROOT # Avisa que vamos alterar a variável global lá de cima
         ICONS_ROOT = self.ICONS_DIR
+        ICON_INDEX.invalidate()
 
         pastas_essenciais = [self.MESA_DIR, self.APPS_DIR, self.SYS_DIR, self.APPLETS_DIR, self.WALLPAPERS_DIR, self.ICONS_DIR]
         for pasta in pastas_essenciais:
@@ -2428,6 +6092,12 @@ class SophiaMobileApp(MDApp):
             except Exception as e:
                 print(f"Erro ao copiar wallpaper padrão: {e}")
 
+        # Banco de metadados único (substitui os sidecars .<nome>.json)
+        MetadataManager.init_store(os.path.join(self.SYS_DIR, "metadata.db"), migrate_root=self.SOPHIA_ROOT)
+        MetadataManager.init_versions(os.path.join(self.SYS_DIR, "Versoes"))
+        self.remote_cache = RemoteListingCache(os.path.join(self.SYS_DIR, "Vigia"))
+        self.offload = OffloadScheduler(os.path.join(self.SYS_DIR, "offload.db"))
+
         print(f"🌌 Universo Sophia iniciado em: {self.SOPHIA_ROOT}")
 
     def on_start(self):
@@ -2444,18 +6114,30 @@ class SophiaMobileApp(MDApp):
             public_wp = os.path.join(self.WALLPAPERS_DIR, "wallpaper.jpg")
             if os.path.exists(public_wp):
                 self.current_wallpaper = public_wp
+        self.load_wallpaper_variant()
+        # Miniaturas do seletor geradas em segundo plano: ele abre lendo arquivos pequenos
+        Clock.schedule_once(self.prefetch_wallpaper_thumbs, 2)
+
+        # Último gateway usado: a página remota já abre com a listagem em cache
+        if self.store.exists('vigia'):
+            self.stored_ip = self.store.get('vigia').get('ip', self.stored_ip)
+            self.show_cached_remote(self.stored_ip)
 
         self.current_path = self.get_mesa_path()
         self.current_folder_name = os.path.basename(self.current_path)
         Clock.schedule_once(self.refresh_dock_icons)
         Clock.schedule_once(self.setup_creation_menu)
-        Clock.schedule_interval(self.check_mesa_changes, 2)
         self.ensure_mesa_dir()
+        # Observador de eventos (inotify) no lugar do polling de 2s na UI
+        self.mesa_watcher = FolderWatcher(self.on_mesa_fs_events)
+        self.mesa_watcher.watch(self.current_path)
         self.refresh_desktop_items()
         self.scan_android_apps()
 
         # --- CARREGA OS APPLETS (JSON) ---
         self.populate_top_shelf_applets()
+        self.applets_watcher = FolderWatcher(self.on_applets_fs_events)
+        self.applets_watcher.watch(self.APPLETS_DIR)
 
         # --- INICIA SERVIÇO DE NOTÍCIAS RSS ---
         self.start_rss_service()
@@ -2466,6 +6148,16 @@ class SophiaMobileApp(MDApp):
             vol = AndroidUtils.get_volume()
             self.root.ids.volume_slider.value = vol
 
+    def on_stop(self):
+        if getattr(self, 'mesa_watcher', None): self.mesa_watcher.stop()
+        if getattr(self, 'applets_watcher', None): self.applets_watcher.stop()
+        print(f"⏱️ [UI] Trabalho fatiado: {self.ui_work.stats}")
+        if getattr(self, 'thumbnails', None): self.thumbnails.shutdown()
+        if getattr(self, 'wallpapers', None): self.wallpapers.shutdown()
+        self.stop_mesa_sync()
+        self.network.disconnect()
+        self.jobs.shutdown()
+
     # --- CARREGADOR DINÂMICO DE APPS ---
     def launch_dynamic_widget(self, app_path, entry_point, app_id, manifest):
         """Transforma um arquivo .py solto em uma janela do sistema (COM GESTOS)"""
@@ -2500,6 +6192,7 @@ class SophiaMobileApp(MDApp):
                 self.running_internal_apps[app_id] = {
                     "widget": app_window,
                     "manifest": manifest,
+                    "path": app_path,
                     "timestamp": time.time()
                 }
 
@@ -2562,20 +6255,26 @@ class SophiaMobileApp(MDApp):
         """Monta a bandeja puxando de dois mundos diferentes"""
         task_list = self.root.ids.task_list
         task_list.clear_widgets()
+        # Um card por frame (o primeiro já): a bandeja sobe sem travar a animação
+        self.ui_work.submit("tasks", self._task_cards_work(task_list), priority=0, eager=True)
 
+    def _task_cards_work(self, task_list):
         # 1. CARREGA OS APPS INTERNOS (NOSSOS .APPICON)
-        for app_id, data in self.running_internal_apps.items():
+        for app_id, data in list(self.running_internal_apps.items()):
+            # Mesmo nome/ícone resolvido que a Mesa e o lançador mostram
+            bundle = ManifestCache.get(data["path"]) if data.get("path") else None
             manifest = data["manifest"]
             task_data = {
-                "name": manifest.get("nome_exibicao", "Ferramenta"),
-                "icon": manifest.get("icon", "application"),
+                "name": bundle.display_name if bundle else manifest.get("nome_exibicao", "Ferramenta"),
+                "icon": bundle.icon if bundle else manifest.get("icon", "application"),
                 "pkg": f"internal:{app_id}",
                 "info": f"Folha Kivy\nStatus: Ativa"
             }
             task_list.add_widget(self._create_task_card(task_data))
+            yield
 
         # 2. CARREGA OS APPS ANDROID (O HOSPEDEIRO)
-        for pkg, data in self.running_android_apps.items():
+        for pkg, data in list(self.running_android_apps.items()):
             task_data = {
                 "name": data["name"],
                 "icon": "android",
@@ -2583,6 +6282,7 @@ class SophiaMobileApp(MDApp):
                 "info": f"Android Nativo\nInício: {data['time_started']}"
             }
             task_list.add_widget(self._create_task_card(task_data))
+            yield
 
     def _create_task_card(self, task_data):
         from kivymd.uix.card import MDCard
@@ -2707,6 +6407,15 @@ class SophiaMobileApp(MDApp):
         if show_bubble:
             self.spawn_bubble(text, icon_name)
 
+        self._add_feed_card(NotificationCard(title=title, text=text, icon_name=icon_name))
+
+    def push_progress_card(self, title, text, icon_name="progress-upload"):
+        """Card com barra de progresso no topo do feed; quem chamou atualiza via set_progress/finish"""
+        card = ProgressNotificationCard(title=title, text=text, icon_name=icon_name)
+        self._add_feed_card(card)
+        return card
+
+    def _add_feed_card(self, card):
         feed_list = self.root.ids.feed_list
         empty_label = self.root.ids.empty_feed_label
 
@@ -2714,9 +6423,7 @@ class SophiaMobileApp(MDApp):
         if empty_label in feed_list.children:
             feed_list.remove_widget(empty_label)
 
-        # Cria o card e adiciona no TOPO da lista (index=len garante ir pro começo no Kivy)
-        card = NotificationCard(title=title, text=text, icon_name=icon_name)
-
+        # Adiciona no TOPO da lista (index=len garante ir pro começo no Kivy)
         # Começa invisível e com altura zero para nascer animado
         target_height = card.height
         card.height = 0
@@ -2725,6 +6432,172 @@ class SophiaMobileApp(MDApp):
 
         Animation(height=target_height, opacity=1, d=0.4, t='out_back').start(card)
 
+    # --- SINCRONIZAÇÃO MESA <-> PC ---
+    SYNC_THROTTLE_OPTIONS = [(0, "Sem limite de banda"), (1024 * 1024, "Limite de 1 MB/s"), (256 * 1024, "Limite de 256 KB/s")]
+
+    def _sync_settings(self):
+        # Chave própria: o store.put('vigia', ip=...) da conexão reescreve a chave inteira
+        settings = {"remote_root": "Mesa", "max_bytes_per_sec": 0, "paused": False}
+        if self.store.exists('vigia'):
+            # Configuração antiga, de quando ficava junto do IP
+            old = self.store.get('vigia')
+            settings.update({k[len('sync_'):]: v for k, v in old.items() if k.startswith('sync_')})
+        if self.store.exists('sync'):
+            settings.update(self.store.get('sync'))
+        return settings
+
+    def _save_sync_settings(self, **changes):
+        settings = self._sync_settings()
+        settings.update(changes)
+        self.store.put('sync', **settings)
+
+    def start_mesa_sync(self):
+        settings = self._sync_settings()
+        if not self.mesa_sync:
+            self.mesa_sync = MesaSyncEngine(
+                self.network, os.path.join(self.SYS_DIR, "sync.db"), self.MESA_DIR,
+                remote_root=settings['remote_root'],
+                max_bytes_per_sec=settings['max_bytes_per_sec']
+            )
+        if settings['paused']: self.mesa_sync.pause()
+        self.mesa_sync_paused = self.mesa_sync.paused
+        self.mesa_sync.start()
+        self.mesa_sync_active = True
+
+    def stop_mesa_sync(self):
+        if self.mesa_sync: self.mesa_sync.stop()
+        self.mesa_sync_active = False
+
+    def open_sync_menu(self, caller):
+        paused = self.mesa_sync_paused
+        current = self.mesa_sync.max_bytes_per_sec if self.mesa_sync else self._sync_settings()['max_bytes_per_sec']
+        menu_items = [{
+            "text": "Retomar sincronização" if paused else "Pausar sincronização",
+            "viewclass": "OneLineIconListItem", "icon": "sync" if paused else "sync-off", "height": dp(56),
+            "on_release": lambda: self._sync_menu_callback(self.set_sync_paused, not paused)
+        }]
+        for bps, label in self.SYNC_THROTTLE_OPTIONS:
+            menu_items.append({
+                "text": label, "viewclass": "OneLineIconListItem", "height": dp(56),
+                "icon": "check" if bps == current else "speedometer",
+                "on_release": lambda x=bps: self._sync_menu_callback(self.set_sync_throttle, x)
+            })
+        self.sync_menu = MDDropdownMenu(caller=caller, items=menu_items, width_mult=4)
+        self.sync_menu.open()
+
+    def _sync_menu_callback(self, action, value):
+        self.sync_menu.dismiss()
+        action(value)
+
+    def set_sync_paused(self, paused):
+        self._save_sync_settings(paused=paused)
+        self.mesa_sync_paused = paused
+        if self.mesa_sync:
+            if paused: self.mesa_sync.pause()
+            else: self.mesa_sync.resume()
+        SofiaShell.show_toast("Sincronização da Mesa pausada" if paused else "Sincronização da Mesa retomada")
+
+    def set_sync_throttle(self, max_bytes_per_sec):
+        self._save_sync_settings(max_bytes_per_sec=max_bytes_per_sec)
+        if self.mesa_sync: self.mesa_sync.set_throttle(max_bytes_per_sec)
+
+    def on_sync_finished(self, summary):
+        changed = summary["pushed"] + summary["pulled"] + summary["deleted"]
+        if not changed and not summary["conflicts"]: return
+        text = f"{summary['pushed']} enviados, {summary['pulled']} recebidos, {summary['deleted']} apagados"
+        if summary["conflicts"]:
+            text += f" · {summary['conflicts']} conflitos (perdedor no histórico)"
+        self.push_notification("Mesa sincronizada", text, "sync", show_bubble=bool(summary["conflicts"]))
+
+    def run_offloaded(self, file_paths, spec, action_key, decision, title):
+        """Offload (de um lote) com ida e volta de arquivos, rodando no loop do Vigia"""
+        label = os.path.basename(file_paths[0]) if len(file_paths) == 1 else f"{len(file_paths)} arquivos"
+        card = self.push_progress_card(title, f"{label} · no PC ({decision.reason})", "monitor-share")
+        future = asyncio.run_coroutine_threadsafe(
+            self.offload.run_remote(self.network, file_paths, spec, action_key, decision),
+            self.network._ensure_loop()
+        )
+
+        def done(f):
+            try:
+                ok, message = f.result()
+            except Exception as e:
+                ok, message = False, str(e) or repr(e)
+            Clock.schedule_once(lambda dt: card.finish(message, "check-circle-outline" if ok else "alert-circle-outline"), 0)
+        future.add_done_callback(done)
+
+    # --- TAREFAS (JobManager) NO FEED ---
+    def on_job_update(self, job):
+        """Um card por grupo (applet + ação) com o andamento do lote inteiro"""
+        group = job.group or f"job-{job.id}"
+        stats = self.jobs.group_stats(job.group) if job.group else {
+            "total": 1, "queued": int(job.state == "queued"), "running": int(job.state == "running"),
+            "done": int(job.state == "done"), "failed": int(job.is_finished and job.state != "done")}
+        card = self._job_cards.get(group)
+        if card is None:
+            title = job.meta.get("applet") or job.name
+            card = self.push_progress_card(title, "Na fila...", "cog-outline")
+            card.bind(on_release=lambda *x, g=job.group, jid=job.id: self.jobs.cancel_group(g) if g else self.jobs.cancel(jid))
+            self._job_cards[group] = card
+        finished = stats["done"] + stats["failed"]
+        if finished < stats["total"]:
+            card.set_progress(finished / stats["total"],
+                              f"{stats['running']} rodando · {stats['queued']} na fila · {finished}/{stats['total']} prontos")
+            return
+        del self._job_cards[group]
+        if stats["failed"]:
+            detail = (job.stderr.strip().splitlines() or [job.state])[-1] if job.state != "done" else ""
+            card.finish(f"{stats['done']}/{stats['total']} ok, {stats['failed']} com erro {detail}".strip(), "alert-circle-outline")
+        else:
+            if stats["total"] > 1: card.finish(f"{stats['total']} concluídos")
+            elif job.stage_times:
+                card.finish(" · ".join(f"{name} {t:.1f}s" for name, t in job.stage_times if t is not None))
+            else: card.finish(f"Concluído em {job.duration:.1f}s")
+        if job.group: self.jobs.forget_group(job.group)
+
+    # --- TRANSFERÊNCIAS DO VIGIA ---
+    def send_file_to_pc(self, file_path):
+        if not self._can_transfer(): return None
+        return self.network.transfers.upload(file_path)
+
+    def fetch_file_from_pc(self, remote_name, dest_dir=None):
+        if not self._can_transfer(): return None
+        local_path = os.path.join(dest_dir or self.current_path, os.path.basename(remote_name))
+        return self.network.transfers.download(remote_name, local_path)
+
+    def _can_transfer(self):
+        if not self.is_connected:
+            SofiaShell.show_toast("Conecte o Vigia primeiro.")
+            return False
+        if "xfer" not in self.network.features:
+            SofiaShell.show_toast("Este Vigia não recebe arquivos (atualize o gateway).")
+            return False
+        return True
+
+    def on_transfer_progress(self, transfer):
+        card = self._transfer_cards.get(transfer.xfer_id)
+        if card is None:
+            upload = transfer.direction == "upload"
+            card = self.push_progress_card("Enviando para o PC" if upload else "Baixando do PC",
+                                           transfer.name, "progress-upload" if upload else "progress-download")
+            self._transfer_cards[transfer.xfer_id] = card
+        if transfer.state == "waiting":
+            card.set_progress(transfer.fraction, f"{transfer.name} · aguardando conexão...")
+        else:
+            card.set_progress(transfer.fraction, f"{transfer.name} · {int(transfer.fraction * 100)}% · {transfer.throughput / 1048576:.1f} MB/s")
+
+    def on_transfer_finished(self, transfer):
+        self.on_transfer_progress(transfer)
+        card = self._transfer_cards.pop(transfer.xfer_id)
+        if transfer.state == "done":
+            card.finish(f"{transfer.name} · concluído ({transfer.throughput / 1048576:.1f} MB/s)")
+            if transfer.direction == "download" and os.path.dirname(transfer.local_path) == self.current_path:
+                self.check_mesa_changes(0)
+        elif transfer.state == "cancelled":
+            card.finish(f"{transfer.name} · cancelado", "close-circle-outline")
+        else:
+            card.finish(f"{transfer.name} · falhou: {transfer.error}", "alert-circle-outline")
+
     def start_rss_service(self):
         """Inicia a busca de notícias em segundo plano para não travar a UI"""
         # Suas fontes de leitura diária
@@ -2780,73 +6653,133 @@ class SophiaMobileApp(MDApp):
         Animation(height=target_height, opacity=1, d=0.4, t='out_back').start(card)
 
     # --- LOGICA DE APPLETS (JSON) ---
-    def load_pluggable_applets(self):
-        """Lê os arquivos JSON e guarda na memória do celular"""
-        self.mobile_applets = []
-        applets_dir = self.APPLETS_DIR # Usa o diretório do Universo Sophia
-
-        if not os.path.exists(applets_dir):
+    def load_pluggable_applets(self, names=None):
+        """Atualiza o registro (só relê JSONs alterados) e recompila o índice de despacho"""
+        if not os.path.exists(self.APPLETS_DIR):
             try:
-                os.makedirs(applets_dir)
+                os.makedirs(self.APPLETS_DIR)
             except: pass
-            return
 
-        for filename in os.listdir(applets_dir):
-            if filename.endswith(".json"):
-                try:
-                    with open(os.path.join(applets_dir, filename), 'r', encoding='utf-8') as f:
-                        applet_data = json.load(f)
-                        self.mobile_applets.append(applet_data)
-                except Exception as e:
-                    print(f"Erro ao ler o applet {filename}: {e}")
+        added, removed, changed = self.applet_registry.refresh(names)
+        if added or removed or changed or not self.mobile_applets:
+            self.mobile_applets = [applet for _, applet in self.applet_registry.items()]
+            self.applet_index = AppletDispatchIndex(self.mobile_applets)
+            print(f"📚 Luz carregou {len(self.mobile_applets)} applets com sucesso!")
+        return added, removed, changed
+
+    def populate_top_shelf_applets(self, names=None):
+        """Gera/atualiza os ícones na gaveta superior: só mexe nos cards afetados"""
+        # Cards de uma atualização anterior ainda na fila entram antes (os nomes já saíram do registro)
+        self.ui_work.flush("shelf")
+        added, removed, changed = self.load_pluggable_applets(names)
+        shelf_grid = self.root.ids.shelf_grid
 
-        print(f"📚 Luz carregou {len(self.mobile_applets)} applets com sucesso!")
+        for name in removed + changed:
+            card = self._shelf_cards.pop(name, None)
+            if card: shelf_grid.remove_widget(card)
 
-    def populate_top_shelf_applets(self):
-        """Gera os ícones físicos na gaveta superior baseados nos JSONs"""
-        self.load_pluggable_applets()
+        self.ui_work.submit("shelf", self._shelf_cards_work(sorted(added + changed)), priority=3)
 
+    def _shelf_cards_work(self, names):
         shelf_grid = self.root.ids.shelf_grid
-        shelf_grid.clear_widgets()
-
-        for applet in self.mobile_applets:
+        for name in names:
+            applet = self.applet_registry.get(name)
             # Só carrega os que fazem sentido ter ícone na mesa/gaveta
-            if applet.get("display_on_desktop", False) or "drop_triggers" in applet:
-
-                # Cria o Card (AppletDropZone)
-                applet_card = MDCard(
-                    orientation='vertical',
-                    size_hint=(None, None),
-                    size=(dp(80), dp(100)),
-                    md_bg_color=(1, 1, 1, 0.1),
-                    radius=[16,],
-                    padding=dp(8),
-                    ripple_behavior=True
-                )
-
-                # Ícone do Applet
-                icon_name = applet.get("icon", "application-x-executable")
-                applet_icon = SmartIcon(icon_name=icon_name, icon_size=dp(42))
-                applet_icon.pos_hint = {"center_x": .5}
-
-                # Nome do Applet
-                applet_label = MDLabel(
-                    text=applet.get("name", "Applet"),
-                    halign="center",
-                    font_style="Caption",
-                    theme_text_color="Custom",
-                    text_color=(1,1,1,1),
-                    shorten=True,
-                    shorten_from="right"
-                )
+            if applet is None or not (applet.get("display_on_desktop", False) or "drop_triggers" in applet): continue
+            self._shelf_cards[name] = card = self._make_applet_card(applet)
+            # children fica em ordem inversa: index = quantos cards vêm depois na ordem por nome
+            after = sum(1 for other in self._shelf_cards if other > name)
+            shelf_grid.add_widget(card, index=after)
+            yield
+
+        # As posições no índice mudam a cada recompilação
+        for name, card in self._shelf_cards.items():
+            card.applet_data = self.applet_registry.get(name)
+            card.applet_slot = self.applet_index.slot_of(card.applet_data)
+
+    def on_applets_fs_events(self, path, events):
+        """Mudanças em Sistema/Applets: recarrega só os arquivos citados"""
+        if any(e[0] == "resync" for e in events):
+            self.populate_top_shelf_applets()
+            return
+        names = set()
+        for event in events:
+            names.update(n for n in event[1:] if n)
+        self.populate_top_shelf_applets(names)
+
+    def _make_applet_card(self, applet):
+        # Cria o Card (AppletDropZone)
+        applet_card = MDCard(
+            orientation='vertical',
+            size_hint=(None, None),
+            size=(dp(80), dp(100)),
+            md_bg_color=(1, 1, 1, 0.1),
+            radius=[16,],
+            padding=dp(8),
+            ripple_behavior=True
+        )
 
-                applet_card.add_widget(applet_icon)
-                applet_card.add_widget(applet_label)
+        # Ícone do Applet
+        icon_name = applet.get("icon", "application-x-executable")
+        applet_icon = SmartIcon(icon_name=icon_name, icon_size=dp(42))
+        applet_icon.pos_hint = {"center_x": .5}
 
-                # Salva os dados do JSON no próprio widget dinamicamente
-                applet_card.applet_data = applet
+        # Nome do Applet
+        applet_label = MDLabel(
+            text=applet.get("name", "Applet"),
+            halign="center",
+            font_style="Caption",
+            theme_text_color="Custom",
+            text_color=(1,1,1,1),
+            shorten=True,
+            shorten_from="right"
+        )
 
-                shelf_grid.add_widget(applet_card)
+        applet_card.add_widget(applet_icon)
+        applet_card.add_widget(applet_label)
+
+        # Salva os dados do JSON no próprio widget dinamicamente
+        applet_card.applet_data = applet
+        applet_card.applet_slot = self.applet_index.slot_of(applet)
+        return applet_card
+
+    # --- SELEÇÃO MÚLTIPLA NA MESA ---
+    def toggle_selection(self, path, view=None):
+        if path in self.selected_paths: del self.selected_paths[path]
+        else: self.selected_paths[path] = True
+        if view is not None: view.selected = path in self.selected_paths
+        else: self.root.ids.desktop_grid.refresh_from_data()
+
+    def clear_selection(self):
+        if not self.selected_paths: return
+        self.selected_paths = {}
+        self.root.ids.desktop_grid.refresh_from_data()
+
+    # --- DESTAQUE DOS ALVOS DURANTE O ARRASTO ---
+    def begin_drop_highlight(self, file_paths):
+        """Apaga os applets que não aceitam nenhum dos arquivos; cada MIME distinto sai do índice em O(1)"""
+        if isinstance(file_paths, str): file_paths = [file_paths]
+        accepted = frozenset().union(*(self.applet_index.accepting(m) for m in {AppletDispatchIndex.mime_for(p) for p in file_paths}))
+        self._drop_targets = []
+        for card in self.root.ids.shelf_grid.children:
+            ok = getattr(card, 'applet_slot', None) in accepted
+            card.opacity = 1 if ok else 0.3
+            if ok: self._drop_targets.append(card)
+        self._drop_hover = None
+
+    def update_drop_hover(self, pos):
+        """Só testa colisão com os alvos válidos; realça o que está sob o dedo"""
+        hovered = next((c for c in self._drop_targets if c.collide_point(*pos)), None)
+        if hovered is self._drop_hover: return
+        if self._drop_hover: self._drop_hover.md_bg_color = (1, 1, 1, 0.1)
+        if hovered: hovered.md_bg_color = (0.3, 0.8, 0.4, 0.45)
+        self._drop_hover = hovered
+
+    def end_drop_highlight(self):
+        for card in self.root.ids.shelf_grid.children:
+            card.opacity = 1
+            card.md_bg_color = (1, 1, 1, 0.1)
+        self._drop_targets, self._drop_hover = [], None
 
     def set_wallpaper(self, path):
         # Atualiza a variável (o KV detecta sozinho)
@@ -2859,6 +6792,32 @@ class SophiaMobileApp(MDApp):
         # Feedback visual
         SofiaShell.show_toast("Visual atualizado!")
 
+    def on_current_wallpaper(self, instance, value): self.load_wallpaper_variant()
+
+    def load_wallpaper_variant(self, *args):
+        """Mostra o wallpaper no tamanho da janela; o original só aparece se não der para gerar"""
+        self._wallpaper_event = None
+        src = self.current_wallpaper
+        if not getattr(self, 'wallpapers', None) or not os.path.exists(src):
+            self.wallpaper_display = src
+            return
+        size = (int(Window.width), int(Window.height))
+        self.wallpapers.request(src, size, lambda path: self._show_wallpaper(src, size, path))
+
+    def _show_wallpaper(self, src, size, path):
+        # Resposta atrasada de outro wallpaper ou de outro tamanho de janela: ignora
+        if src != self.current_wallpaper or size != (int(Window.width), int(Window.height)): return
+        self.wallpaper_display = path
+
+    def prefetch_wallpaper_thumbs(self, *args):
+        valid_exts = (".jpg", ".jpeg", ".png", ".webp")
+        try:
+            with os.scandir(self.WALLPAPERS_DIR) as it:
+                paths = [e.path for e in it if e.name.lower().endswith(valid_exts)]
+        except OSError:
+            return
+        for path in paths: self.thumbnails.prefetch(path, "picker")
+
     def on_keyboard(self, window, key, scancode, codepoint, modifier):
         if key == 27: # ESC/Back
             if self.is_task_switcher_open:
@@ -2925,7 +6884,10 @@ class SophiaMobileApp(MDApp):
             self.current_path = path
             self.current_folder_name = os.path.basename(path)
             self.root.ids.search_field.text = ""
+            self.clear_selection()
+            self.mesa_watcher.watch(path)
             self.refresh_desktop_items()
+            self.root.ids.desktop_grid.scroll_y = 1
 
     def navigate_up(self):
         if self.current_path == self.get_mesa_path(): return
@@ -2933,6 +6895,7 @@ class SophiaMobileApp(MDApp):
         self.navigate_to(parent)
 
     def check_mesa_changes(self, dt):
+        """Ressincronização completa (callback dos diálogos e reserva do watcher)"""
         if self.root.ids.search_field.text: return
         path = self.current_path
         if not os.path.exists(path): return
@@ -2940,10 +6903,82 @@ class SophiaMobileApp(MDApp):
             current_files = sorted(os.listdir(path))
             current_files = [f for f in current_files if not f.startswith('.')]
             if current_files != self.known_mesa_files:
-                self.known_mesa_files = current_files
-                self.refresh_desktop_items(current_files)
+                # Releitura completa pelo DirectoryModel (atualiza known_mesa_files)
+                self.refresh_desktop_items()
+            else:
+                # Nada entrou ou saiu: só atualiza o status (uma consulta) dos itens
+                self._refresh_desktop_statuses()
         except Exception as e: print(f"Erro ao ler Mesa: {e}")
 
+    def _refresh_desktop_statuses(self):
+        self.ui_work.flush("desktop")
+        desktop_grid = self.root.ids.desktop_grid
+        attrs_by_name = MetadataManager.get_directory_attributes(self.current_path)
+        changed = False
+        for record in desktop_grid.data:
+            status = attrs_by_name.get(os.path.basename(record["file_path"]), {}).get("status") or ""
+            if record.get("status") != status:
+                record["status"] = status
+                changed = True
+        if changed: desktop_grid.refresh_from_data()
+
+    def on_mesa_fs_events(self, path, events):
+        """Aplica os eventos do FolderWatcher como patches na grade (sem rebuild)"""
+        if self.mesa_sync and path.startswith(self.MESA_DIR): self.mesa_sync.request_run()
+        if path != self.current_path: return
+        self.search_engine.invalidate()
+        search_text = self.root.ids.search_field.text
+        if search_text:
+            self.filter_desktop_items(search_text)
+            return
+        if any(e[0] == "resync" for e in events):
+            self.check_mesa_changes(0)
+            return
+
+        for event in events:
+            kind, name = event[0], event[1]
+            for bundle in event[1:]:
+                if bundle and bundle.endswith(".appicon"): ManifestCache.invalidate(os.path.join(path, bundle))
+            if kind == "created":
+                self._patch_desktop_item(name)
+            elif kind == "deleted":
+                self._patch_desktop_item(name, remove=True)
+            elif kind == "modified":
+                self._patch_desktop_item(name)
+            elif kind == "renamed":
+                # Os atributos acompanham o arquivo renomeado
+                MetadataManager.move(os.path.join(path, name), os.path.join(path, event[2]))
+                self._patch_desktop_item(name, remove=True)
+                self._patch_desktop_item(event[2])
+
+    def _patch_desktop_item(self, name, remove=False):
+        # O patch é por índice: a grade precisa estar completa
+        self.ui_work.flush("desktop")
+        data = self.root.ids.desktop_grid.data
+        known = self.known_mesa_files
+        idx = bisect.bisect_left(known, name)
+        present = idx < len(known) and known[idx] == name
+        full_path = os.path.join(self.current_path, name)
+
+        if remove:
+            if present:
+                known.pop(idx)
+                data.pop(idx)
+            return
+
+        entry = self.dir_model.entry(self.current_path, name, MetadataManager.get_attributes(full_path))
+        if entry is None:
+            if present:
+                known.pop(idx)
+                data.pop(idx)
+            return
+        record = self._build_desktop_record(entry)
+        if present:
+            data[idx] = record
+        else:
+            known.insert(idx, name)
+            data.insert(idx, record)
+
     def check_hardware_status(self, dt):
         """Verifica o estado real do hardware e atualiza os botões"""
         self.current_ssid = AndroidUtils.get_current_ssid()
@@ -2951,75 +6986,78 @@ class SophiaMobileApp(MDApp):
         self.is_bt_on = AndroidUtils.is_bluetooth_enabled()
 
     def filter_desktop_items(self, text):
-        text = text.lower().strip()
+        """Busca com debounce: só consulta quando o usuário para de digitar"""
+        if self._search_event: self._search_event.cancel()
+        text = text.strip()
+        if not text:
+            # Busca limpa: volta à listagem completa (e ressincroniza known_mesa_files)
+            self.search_engine.cancel()
+            self.refresh_desktop_items()
+            return
         path = self.current_path
-        if not os.path.exists(path): return
-        try:
-            all_items = sorted(os.listdir(path))
-        except: return
-        filtered_items = []
-        for item in all_items:
-            if item.startswith('.'): continue
-            if not text:
-                filtered_items.append(item)
-                continue
-            if text in item.lower():
-                filtered_items.append(item)
-                continue
-            full_path = os.path.join(path, item)
-            attrs = MetadataManager.get_attributes(full_path)
-            tags = attrs.get("tags", [])
-            match_tag = any(text in tag.lower() for tag in tags)
-            status = attrs.get("status", "")
-            match_status = text in status.lower() if status else False
-            state = attrs.get("state", "")
-            match_state = text in state.lower() if state else False
-            if match_tag or match_status or match_state:
-                filtered_items.append(item)
-        self.refresh_desktop_items(filtered_items)
-
-    def refresh_desktop_items(self, items_to_show=None):
-        desktop_grid = self.root.ids.desktop_grid
-        desktop_grid.clear_widgets()
+        self._search_event = Clock.schedule_once(
+            lambda dt: self.search_engine.search(path, text, self._on_search_batch), 0.15
+        )
+
+    def _on_search_batch(self, names, attrs_by_name, first, last):
+        if first:
+            self.refresh_desktop_items(names, attrs_by_name)
+            self.root.ids.desktop_grid.scroll_y = 1
+        else:
+            self.ui_work.flush("desktop")
+            self.root.ids.desktop_grid.data.extend(
+                self._build_desktop_record(e) for e in self.dir_model.entries(self.current_path, names, attrs_by_name)
+            )
+
+    def refresh_desktop_items(self, items_to_show=None, attrs_by_name=None):
         path = self.current_path
+        # Uma passada de scandir e uma consulta ao banco para a pasta inteira; o stat de cada
+        # item (e o manifesto dos .appicon) é feito em fatias pelo UIWorkScheduler
+        if attrs_by_name is None: attrs_by_name = MetadataManager.get_directory_attributes(path)
         if items_to_show is None:
-            try: items_to_show = sorted(os.listdir(path))
-            except: items_to_show = []
+            sources = self.dir_model.listing(path)
+            self.known_mesa_files = [d.name for d in sources]
+            make = lambda d: self.dir_model.from_dir_entry(d, attrs_by_name.get(d.name, {}))
+        else:
+            sources = [n for n in items_to_show if not n.startswith('.')]
+            make = lambda n: self.dir_model.entry(path, n, attrs_by_name.get(n, {}))
+        known = self.known_mesa_files if items_to_show is None else None
+        self.ui_work.submit("desktop", self._desktop_records_work(sources, make, known), priority=0, eager=True)
 
-        for item in items_to_show:
-            if item.startswith('.'): continue
-            full_path = os.path.join(path, item)
+    DESKTOP_FIRST_SCREEN = 48  # Itens que entram já no primeiro frame (o que cabe na tela)
+    DESKTOP_CHUNK = 32
 
-            app_icon = AppIcon.factory(full_path)
+    def _desktop_records_work(self, sources, make, known):
+        desktop_grid = self.root.ids.desktop_grid
+        records = []
+        i, step = 0, self.DESKTOP_FIRST_SCREEN
+        while i < len(sources):
+            for source in sources[i:i + step]:
+                entry = make(source)
+                if entry is None:
+                    # Sumiu entre a listagem e o stat: tira também de known_mesa_files (alinhados por índice)
+                    if known is not None: known.remove(source.name)
+                    continue
+                # Só o dicionário; o widget nasce (ou é reciclado) quando fica visível
+                records.append(self._build_desktop_record(entry))
+            if i == 0: desktop_grid.data = list(records)
+            i, step = i + step, self.DESKTOP_CHUNK
+            yield
+        desktop_grid.data = records
+
+    def _build_desktop_record(self, entry):
+        return {
+            "refresh_callback": self._desktop_refresh_callback,
+            "label_text": entry.display_name,
+            "icon_name": entry.icon,
+            "file_path": entry.path,
+            "status": entry.status,
+            "mtime": entry.mtime,
+            "is_remote": False
+        }
 
-            if app_icon:
-                display_text = app_icon.get_display_name()
-                icon_name = app_icon.get_display_icon()
-            elif os.path.isdir(full_path):
-                display_text = item
-                icon_name = "folder"
-            else:
-                display_text = item
-                icon_name = "text"
-                if item.endswith(".webicon"): icon_name = "text-html"
-                elif item.endswith((".png", ".jpg", ".jpeg", ".webp")): icon_name = "image"
-                elif item.endswith((".mp4", ".mkv", ".webm")): icon_name = "video"
-                elif item.endswith((".mp3", ".wav", ".ogg")): icon_name = "audio"
-                elif "pdf" in item.lower(): icon_name = "pdf"
-                elif item.endswith((".txt", ".md", ".json", ".py", ".sh")): icon_name = "text"
-                else:
-                    mime_type, _ = mimetypes.guess_type(full_path)
-                    if mime_type and mime_type.startswith('image'): icon_name = "image"
-                    elif mime_type and mime_type.startswith('text'): icon_name = "text"
-
-            desktop_item = DesktopItem(
-                refresh_callback=lambda: self.check_mesa_changes(0),
-                label_text=display_text,
-                icon_name=icon_name,
-                file_path=full_path,
-                is_remote=False
-            )
-            desktop_grid.add_widget(desktop_item)
+    def _desktop_refresh_callback(self):
+        self.check_mesa_changes(0)
 
     def scan_android_apps(self):
         """
@@ -3027,7 +7065,10 @@ class SophiaMobileApp(MDApp):
         """
         menu_grid = self.root.ids.main_menu_grid
         menu_grid.clear_widgets()
+        # Gaveta fechada na hora da varredura: prioridade baixa, um ícone por pedaço
+        self.ui_work.submit("launcher", self._launcher_icons_work(menu_grid), priority=5)
 
+    def _launcher_icons_work(self, menu_grid):
         # 1. Ferramenta Interna de Arquivos (Atalho Fixo)
         icon_files = AppGridIcon(icon_name="folder")
         icon_files.bind(on_release=lambda x: self.navigate_to(self.get_mesa_path()))
@@ -3041,26 +7082,26 @@ class SophiaMobileApp(MDApp):
 
         for directory in search_paths:
             if os.path.exists(directory):
-                for item_name in os.listdir(directory):
-                    full_path = os.path.join(directory, item_name)
-
-                    # Verifica se é um App Sophia (.appicon)
-                    if os.path.isdir(full_path) and item_name.endswith(".appicon"):
-                        if item_name in found_apps: continue
-                        found_apps.add(item_name)
-
-                        # Usa a Factory para ler o manifesto e pegar o ícone certo
-                        app_obj = AppIcon.factory(full_path)
-
-                        if app_obj:
-                            # Cria o ícone visual
-                            icon = AppGridIcon(icon_name=app_obj.get_display_icon())
-                            # O Pulo do Gato: Bind que chama o execute() do objeto AppIcon
-                            icon.bind(on_release=lambda x, app=app_obj: app.execute())
-                            menu_grid.add_widget(icon)
+                # Só Apps Sophia (.appicon); o tipo vem do DirEntry, sem isdir por item
+                with os.scandir(directory) as it:
+                    bundles = sorted((e for e in it if e.name.endswith(".appicon") and e.is_dir()), key=lambda e: e.name)
+                for dir_entry in bundles:
+                    if dir_entry.name in found_apps: continue
+                    found_apps.add(dir_entry.name)
+
+                    # Manifesto e ícone vêm do ManifestCache (compartilhado com a Mesa)
+                    app_obj = UniversalDotAppIcon(dir_entry.path)
+
+                    # Cria o ícone visual
+                    icon = AppGridIcon(icon_name=app_obj.get_display_icon())
+                    # O Pulo do Gato: Bind que chama o execute() do objeto AppIcon
+                    icon.bind(on_release=lambda x, app=app_obj: app.execute())
+                    menu_grid.add_widget(icon)
+                    yield
 
         # 3. Apps do Sistema Android (Real)
         if platform == 'android':
+            yield  # A consulta ao PackageManager é lenta: começa num frame novo
             try:
                 PythonActivity = autoclass('org.kivy.android.PythonActivity')
                 pm = PythonActivity.mActivity.getPackageManager()
@@ -3078,6 +7119,7 @@ class SophiaMobileApp(MDApp):
                     icon = AppGridIcon(icon_name="app-native") # Futuramente podemos extrair o ícone real via JNI
                     icon.bind(on_release=lambda x, p=pkg_name: SofiaShell.execute_android_package(p))
                     menu_grid.add_widget(icon)
+                    yield
 
                     count += 1
                     if count > 60: break # Limite para não pesar a memória
@@ -3086,8 +7128,11 @@ class SophiaMobileApp(MDApp):
 
     def toggle_vigia_connection(self):
         if self.is_connected:
-            self.network.connected = False
+            self.stop_mesa_sync()
+            self.network.disconnect()
             self.on_connection_lost()
+        elif self.network.connecting:
+            return
         else:
             ip_text = self.root.ids.ip_input.text
             pin_text = self.root.ids.pin_input.text
@@ -3098,63 +7143,137 @@ class SophiaMobileApp(MDApp):
 
             self.stored_ip = ip_text
             self.stored_pin = pin_text
+            # put reescreve a chave inteira: preserva o que mais estiver guardado nela
+            saved = self.store.get('vigia') if self.store.exists('vigia') else {}
+            self.store.put('vigia', **{**saved, 'ip': ip_text})
+            self.show_cached_remote(ip_text)
+
+            # Passa o PIN para a conexão (em segundo plano, a UI segue livre)
+            self.network.connect(self.stored_ip, self.stored_pin, callback=self._on_vigia_connect_result)
+
+    def _on_vigia_connect_result(self, success):
+        if success:
+            self.is_connected = True
+            if {"sync", "xfer"} <= self.network.features: self.start_mesa_sync()
+        else:
+            SofiaShell.show_toast("Falha: Verifique IP ou PIN.")
 
-            # Passa o PIN para a conexão
-            success = self.network.connect(self.stored_ip, self.stored_pin)
-            if success:
-                self.is_connected = True
-            else:
-                SofiaShell.show_toast("Falha: Verifique IP ou PIN.")
+    def on_connection_interrupted(self):
+        """Queda transitória: a grade remota fica como está enquanto o cliente reconecta"""
+        self.vigia_reconnecting = True
+        self.remote_stale = True
+
+    def on_connection_resumed(self):
+        self.vigia_reconnecting = False
+        self.remote_stale = False
+
+    def on_vigia_rtt(self, rtt_ms):
+        self.vigia_rtt_ms = rtt_ms
 
     def on_connection_lost(self):
         self.is_connected = False
-        self.remote_files = []
-        self.root.ids.remote_grid.clear_widgets()
+        self.vigia_reconnecting = False
+        self.vigia_rtt_ms = 0
+        # Sem rede a página remota continua com a última listagem, marcada como antiga
+        self.network.listing.invalidate()
+        self.remote_stale = True
         print("Vigia desconectado.")
 
     def update_remote_files(self, files):
         print(f"📦 Processando {len(files)} arquivos remotos...")
         self.remote_files = files
-        remote_grid = self.root.ids.remote_grid
-        remote_grid.clear_widgets()
+        self.ui_work.submit("remote", self._remote_records_work(files), priority=1, eager=True)
 
-        for f in files:
-            fname = f.get('name', 'Desconhecido')
-            is_dir = f.get('is_dir', False)
-            attrs = f.get('attributes', {})
-
-            icon_name = "unknown"
-            fname_lower = fname.lower()
-
-            if is_dir:
-                icon_name = "folder"
-            elif fname_lower.endswith(".webicon"):
-                icon_name = "text-html"
-            elif fname_lower.endswith(".appimage") or fname_lower.endswith(".desktop"):
-                icon_name = "console"
-            elif fname_lower.endswith((".png", ".jpg", ".jpeg", ".webp")):
-                icon_name = "image"
-            elif fname_lower.endswith((".mp4", ".mkv", ".webm")):
-                icon_name = "video"
-            elif fname_lower.endswith((".mp3", ".wav", ".ogg")):
-                icon_name = "audio"
-            elif fname_lower.endswith(".pdf"):
-                icon_name = "pdf"
-            elif fname_lower.endswith((".txt", ".md", ".json", ".py", ".sh")):
-                icon_name = "text"
-
-            if attrs and attrs.get("__mimetype__") == "inode/directory":
-                 icon_name = "folder"
-
-            item = DesktopItem(
-                icon_name=icon_name,
-                label_text=fname,
-                is_remote=True,
-                file_path=fname
-            )
-            remote_grid.add_widget(item)
+    def _remote_records_work(self, files):
+        remote_grid = self.root.ids.remote_grid
+        records = [self._build_remote_record(f) for f in files[:self.DESKTOP_FIRST_SCREEN]]
+        remote_grid.data = list(records)
+        for i in range(len(records), len(files), self.DESKTOP_CHUNK * 4):
+            yield
+            records.extend(self._build_remote_record(f) for f in files[i:i + self.DESKTOP_CHUNK * 4])
+        if len(records) > self.DESKTOP_FIRST_SCREEN: remote_grid.data = records
+
+    def apply_remote_ops(self, ops, full=False):
+        """Aplica na grade as operações de um listing_delta/diff (sem recriar tudo)"""
+        listing = self.network.listing
+        self.ui_work.flush("remote")  # Operações são por índice
+        data = self.root.ids.remote_grid.data
+        if len(ops) > 64 and len(ops) > len(data) // 2:
+            # Mudança grande (ou grade vazia): recriar sai mais barato que N inserções
+            self.update_remote_files(listing.entries_in_order())
+        else:
+            for op, idx, entry in ops:
+                if op == "remove":
+                    data.pop(idx)
+                elif op == "insert":
+                    data.insert(idx, self._build_remote_record(entry))
+                else:
+                    data[idx] = self._build_remote_record(entry)
+            self.remote_files = listing.entries_in_order()
+        if full: self.remote_stale = False
+        if ops or full: self._schedule_remote_cache_save()
+
+    def show_cached_remote(self, ip):
+        """Pinta na hora a última listagem conhecida desse gateway (marcada como antiga)"""
+        key = RemoteListingCache.key(ip)
+        if key == self._remote_cache_key: return
+        self._remote_cache_key = key
+        files = self.remote_cache.load(key) if self.remote_cache else None
+        self.network.listing.load(files or [])
+        self.update_remote_files(self.network.listing.entries_in_order())
+        self.remote_stale = bool(files)
+
+    def _schedule_remote_cache_save(self):
+        if self._remote_cache_event: self._remote_cache_event.cancel()
+        self._remote_cache_event = Clock.schedule_once(self._save_remote_cache, 2)
+
+    def _save_remote_cache(self, dt):
+        self._remote_cache_event = None
+        if not self.remote_cache or not self._remote_cache_key: return
+        listing = self.network.listing
+        self.remote_cache.save(self._remote_cache_key, listing.entries_in_order(), listing.generation)
+
+    def _build_remote_record(self, f):
+        fname = f.get('name', 'Desconhecido')
+        is_dir = f.get('is_dir', False)
+        attrs = f.get('attributes', {})
+
+        icon_name = "unknown"
+        fname_lower = fname.lower()
+
+        if is_dir:
+            icon_name = "folder"
+        elif fname_lower.endswith(".webicon"):
+            icon_name = "text-html"
+        elif fname_lower.endswith(".appimage") or fname_lower.endswith(".desktop"):
+            icon_name = "console"
+        elif fname_lower.endswith((".png", ".jpg", ".jpeg", ".webp")):
+            icon_name = "image"
+        elif fname_lower.endswith((".mp4", ".mkv", ".webm")):
+            icon_name = "video"
+        elif fname_lower.endswith((".mp3", ".wav", ".ogg")):
+            icon_name = "audio"
+        elif fname_lower.endswith(".pdf"):
+            icon_name = "pdf"
+        elif fname_lower.endswith((".txt", ".md", ".json", ".py", ".sh")):
+            icon_name = "text"
+
+        if attrs and attrs.get("__mimetype__") == "inode/directory":
+             icon_name = "folder"
+
+        return {
+            "refresh_callback": None,
+            "icon_name": icon_name,
+            "label_text": fname,
+            "status": "",
+            "is_remote": True,
+            "file_path": fname
+        }
 
     def send_remote_open(self, filename):
+        if not self.network.connected:
+            SofiaShell.show_toast("Conecte o Vigia primeiro.")
+            return
         print(f"Pedindo para abrir no PC: {filename}")
         self.network.send_command({
             "command": "remote_exec",
@@ -3280,7 +7399,11 @@ class SophiaMobileApp(MDApp):
             self.refresh_desktop_items()
         except Exception as e: print(f"Erro ao criar: {e}")
 
-    def on_window_resize(self, window, width, height): self.refresh_dock_icons()
+    def on_window_resize(self, window, width, height):
+        self.refresh_dock_icons()
+        # Rotação/redimensionamento: nova variante do wallpaper quando a janela parar de mudar
+        if self._wallpaper_event: self._wallpaper_event.cancel()
+        self._wallpaper_event = Clock.schedule_once(self.load_wallpaper_variant, 0.4)
 
     def refresh_dock_icons(self, *args):
         dock_box = self.root.ids.dock_apps_box
@@ -3334,10 +7457,13 @@ class SophiaMobileApp(MDApp):
                 bm = activity.getSystemService(Context.BATTERY_SERVICE)
                 level = bm.getIntProperty(BatteryManager.BATTERY_PROPERTY_CAPACITY)
                 self.battery_percent = f"{level}%"
+                self.battery_level = level
+                self.battery_charging = bool(bm.isCharging())
             except:
                 self.battery_percent = "N/A"
         else:
             self.battery_percent = "100%"
+            self.battery_level, self.battery_charging = 100, True
 
     def on_dock_swipe(self, instance, touch):
         if self.root.ids.dock_pill.collide_point(*touch.pos):
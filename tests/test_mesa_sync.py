@@ -0,0 +1,108 @@
+"""
+Laço de sincronização da Mesa (MesaSyncEngine) contra o gateway de mentira:
+rodadas disparadas por request_run, delta nos dois sentidos, pausa e limite
+de banda.
+"""
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from test_vigia_client import RecordingApp, core
+from mock_gateway import MockGateway
+
+class MesaSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.pc = tempfile.mkdtemp()
+        self.mesa = tempfile.mkdtemp()
+        self.sys_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.pc, "Mesa"))
+        self.gateway = MockGateway(core, root=self.pc)
+        port = self.gateway.start()
+        self.app = RecordingApp()
+        self.client = core.VigiaNetworkClient(self.app, post=lambda fn, *args: fn(*args))
+        result = queue.Queue()
+        self.client.connect("127.0.0.1", "1234", port, callback=result.put)
+        self.assertTrue(result.get(timeout=10))
+        self.engine = core.MesaSyncEngine(self.client, os.path.join(self.sys_dir, "sync.db"), self.mesa)
+        self.engine.DEBOUNCE = 0.01
+
+    def tearDown(self):
+        self.engine.stop()
+        self.client.disconnect()
+        self.gateway.stop()
+        self.engine.conn.close()
+        for path in (self.pc, self.mesa, self.sys_dir): shutil.rmtree(path)
+
+    def write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f: f.write(data)
+
+    def read(self, path):
+        with open(path, "rb") as f: return f.read()
+
+    def next_round(self, timeout=30):
+        return self.app.wait_for("on_sync_finished", timeout)[1]
+
+    def test_rounds_sync_both_ways_with_deltas(self):
+        doc = b"".join(b"linha %06d do relat\xc3\xb3rio\n" % i for i in range(50000))
+        self.write(os.path.join(self.mesa, "doc.txt"), doc)
+        self.write(os.path.join(self.mesa, "sub", "a.txt"), b"A")
+        self.write(os.path.join(self.pc, "Mesa", "do_pc.txt"), b"PC")
+        self.engine.start()
+        summary = self.next_round()
+        self.assertEqual((summary["pushed"], summary["pulled"]), (2, 1))
+        self.assertEqual(self.read(os.path.join(self.pc, "Mesa", "sub", "a.txt")), b"A")
+        self.assertEqual(self.read(os.path.join(self.mesa, "do_pc.txt")), b"PC")
+
+        # Edição no meio do arquivo: só o trecho novo vai pela rede
+        edited = doc[:len(doc) // 2] + b"EDITADO\n" + doc[len(doc) // 2:]
+        self.write(os.path.join(self.mesa, "doc.txt"), edited)
+        self.gateway.patch_bytes = 0
+        self.engine.request_run()
+        self.assertEqual(self.next_round()["pushed"], 1)
+        self.assertEqual(self.read(os.path.join(self.pc, "Mesa", "doc.txt")), edited)
+        self.assertLess(self.gateway.patch_bytes, len(doc) // 10)
+
+        # Mudança do lado do PC volta por delta
+        with open(os.path.join(self.pc, "Mesa", "doc.txt"), "ab") as f: f.write(b"fim do pc\n")
+        received = self.engine.stats["bytes_received"]
+        self.engine.request_run()
+        self.assertEqual(self.next_round()["pulled"], 1)
+        self.assertEqual(self.read(os.path.join(self.mesa, "doc.txt")), edited + b"fim do pc\n")
+        self.assertLess(self.engine.stats["bytes_received"] - received, len(doc) // 10)
+
+        os.remove(os.path.join(self.mesa, "do_pc.txt"))
+        self.engine.request_run()
+        self.assertEqual(self.next_round()["deleted"], 1)
+        self.assertFalse(os.path.exists(os.path.join(self.pc, "Mesa", "do_pc.txt")))
+        self.assertEqual([n for n in os.listdir(self.mesa) if n.startswith(".")], [])
+
+    def test_paused_engine_skips_rounds_until_resumed(self):
+        self.engine.pause()
+        self.engine.start()
+        self.write(os.path.join(self.mesa, "nota.txt"), b"escrito offline")
+        self.engine.request_run()
+        with self.assertRaises(AssertionError):
+            self.next_round(timeout=0.5)
+        self.assertFalse(os.path.exists(os.path.join(self.pc, "Mesa", "nota.txt")))
+        self.engine.resume()
+        self.assertEqual(self.next_round()["pushed"], 1)
+        self.assertEqual(self.read(os.path.join(self.pc, "Mesa", "nota.txt")), b"escrito offline")
+
+    def test_throttle_limits_bytes_per_second(self):
+        rate = 256 * 1024
+        self.engine.set_throttle(rate)
+        self.write(os.path.join(self.mesa, "aleatorio.bin"), os.urandom(3 * rate))
+        start = time.monotonic()
+        self.engine.start()
+        self.assertEqual(self.next_round()["pushed"], 1)
+        # Rajada de 1s liberada, o resto a rate bytes/s
+        self.assertGreaterEqual(time.monotonic() - start, 1.5)
+
+if __name__ == '__main__':
+    unittest.main()
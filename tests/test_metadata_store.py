@@ -0,0 +1,96 @@
+"""
+MetadataStore e VersionStore: mover/apagar pastas leva junto o que está dentro.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+from sophia_core import load
+
+core = load("MetadataStore", "VersionStore")
+
+class MetadataStoreMoveTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = core.MetadataStore(os.path.join(self.tmp, "metadata.db"))
+        self.root = os.path.join(self.tmp, "Mesa")
+
+    def tearDown(self):
+        self.store.conn.close()
+        shutil.rmtree(self.tmp)
+
+    def p(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def test_move_folder_carries_everything_inside(self):
+        self.store.update_many({
+            self.p("Projetos"): {"status": "ativo"},
+            self.p("Projetos", "a.txt"): {"tags": ["urgente"]},
+            self.p("Projetos", "sub", "b.txt"): {"state": "revisar"},
+            self.p("Projetos2", "c.txt"): {"tags": ["fica"]},  # Mesmo começo de nome, não é filho
+        })
+        self.store.move(self.p("Projetos"), self.p("Arquivo"))
+        self.assertEqual(self.store.get(self.p("Arquivo")), {"status": "ativo"})
+        self.assertEqual(self.store.get(self.p("Arquivo", "a.txt")), {"tags": ["urgente"]})
+        self.assertEqual(self.store.get_directory(self.p("Arquivo", "sub")), {"b.txt": {"state": "revisar"}})
+        self.assertEqual(self.store.get(self.p("Projetos", "a.txt")), {})
+        self.assertEqual(self.store.get(self.p("Projetos2", "c.txt")), {"tags": ["fica"]})
+        tagged = self.store.conn.execute("SELECT path FROM tags WHERE tag = 'urgente'").fetchall()
+        self.assertEqual(tagged, [(self.p("Arquivo", "a.txt"),)])
+
+    def test_move_file_replaces_destination_tags(self):
+        self.store.update_many({self.p("a.txt"): {"tags": ["novo"]}, self.p("b.txt"): {"tags": ["velho"]}})
+        self.store.move(self.p("a.txt"), self.p("b.txt"))
+        self.assertEqual(self.store.get(self.p("b.txt")), {"tags": ["novo"]})
+        tags = self.store.conn.execute("SELECT tag FROM tags WHERE path = ?", (self.p("b.txt"),)).fetchall()
+        self.assertEqual(tags, [("novo",)])
+
+class VersionStoreMoveTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.versions = core.VersionStore(os.path.join(self.tmp, "Versoes"))
+        self.root = os.path.join(self.tmp, "Mesa")
+        os.makedirs(os.path.join(self.root, "Pasta", "sub"))
+
+    def tearDown(self):
+        self.versions.conn.close()
+        shutil.rmtree(self.tmp)
+
+    def save(self, rel, data):
+        path = os.path.join(self.root, *rel.split("/"))
+        with open(path, "wb") as f: f.write(data)
+        self.versions.save(path)
+        return path
+
+    def test_move_folder_keeps_history_of_files_inside(self):
+        self.save("Pasta/a.txt", b"um")
+        self.save("Pasta/a.txt", b"dois")
+        self.save("Pasta/sub/b.txt", b"b")
+        os.rename(os.path.join(self.root, "Pasta"), os.path.join(self.root, "Nova"))
+        self.versions.move(os.path.join(self.root, "Pasta"), os.path.join(self.root, "Nova"))
+        self.assertEqual(self.versions.count(os.path.join(self.root, "Nova", "a.txt")), 2)
+        self.assertEqual(self.versions.count(os.path.join(self.root, "Nova", "sub", "b.txt")), 1)
+        self.assertEqual(self.versions.count(os.path.join(self.root, "Pasta", "a.txt")), 0)
+
+    def test_restore_writes_through_a_hidden_temp_file(self):
+        path = self.save("Pasta/a.txt", b"um")
+        first = self.versions.list(path)[0]["id"]
+        self.save("Pasta/a.txt", b"dois")
+        seen = []
+        real_replace = core.os.replace
+        def spy(src, dst):
+            seen.append(os.path.basename(src))
+            real_replace(src, dst)
+        core.os.replace = spy
+        try:
+            self.assertTrue(self.versions.restore(path, first))
+        finally:
+            core.os.replace = real_replace
+        self.assertEqual(seen, [".a.txt.restore.tmp"])
+        with open(path, "rb") as f: self.assertEqual(f.read(), b"um")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+VigiaNetworkClient contra o gateway de mentira (tools/mock_gateway.py).
+
+    python -m unittest discover tests
+"""
+import os
+import queue
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+from sophia_core import load
+from mock_gateway import MockGateway
+
+core = load()
+
+class RecordingApp:
+    """Faz o papel do app: guarda cada callback que o cliente entrega"""
+    def __init__(self):
+        self.events = queue.Queue()
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.events.put((name,) + args + (kwargs,))
+
+    def wait_for(self, name, timeout=10):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                event = self.events.get(timeout=max(deadline - time.monotonic(), 0.01))
+            except queue.Empty:
+                break
+            if event[0] == name: return event
+        raise AssertionError(f"{name} não chegou em {timeout}s")
+
+def wait_until(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate(): return True
+        time.sleep(0.02)
+    return False
+
+class VigiaClientTest(unittest.TestCase):
+    def setUp(self):
+        self.gateway = MockGateway(core, files=[{"name": "a.txt", "is_dir": False}])
+        self.port = self.gateway.start()
+        self.app = RecordingApp()
+        self.client = core.VigiaNetworkClient(self.app, post=lambda fn, *args: fn(*args))
+        self.client.RECONNECT_BASE = 0.05
+
+    def tearDown(self):
+        self.client.disconnect()
+        self.gateway.stop()
+
+    def connect(self, pin="1234"):
+        result = queue.Queue()
+        self.client.connect("127.0.0.1", pin, self.port, callback=result.put)
+        return result.get(timeout=10)
+
+    def test_connect_negotiates_framing_and_features(self):
+        self.assertTrue(self.connect())
+        self.assertEqual(self.client.codec.mode, core.VigiaWireCodec.FRAMED)
+        self.assertIn("listing_delta", self.client.features)
+        ops = self.app.wait_for("apply_remote_ops")
+        self.assertEqual(self.client.listing.names(), ["a.txt"])
+        self.assertTrue(ops[-1].get("full"))
+
+    def test_wrong_pin_is_refused(self):
+        self.assertFalse(self.connect(pin="0000"))
+        self.assertFalse(self.client.connected)
+
+    def test_request_matches_reply_by_req_id(self):
+        self.assertTrue(self.connect())
+        resp = self.client.request({"command": "ping"}).result(5)
+        self.assertEqual(resp["type"], "pong")
+        self.assertNotIn(resp["req_id"], self.client._pending)
+
+    def test_outbox_slots_come_back_after_reconnects(self):
+        """Frames presos na fila quando a conexão cai devolvem a vaga (antes a fila 'enchia' sozinha)"""
+        limit = 8
+        self.client._outbox_slots = core.threading.BoundedSemaphore(limit)
+        self.assertTrue(self.connect())
+        for _ in range(3):
+            # Transporte "cheio": o writer para e tudo fica na fila até a queda
+            self.client._loop.call_soon_threadsafe(self.client._can_write.clear)
+            time.sleep(0.05)
+            sent = sum(self.client.send_command({"command": "noop"}) for _ in range(limit))
+            self.assertEqual(sent, limit)
+            self.gateway.drop_all()
+            self.app.wait_for("on_connection_interrupted")
+            self.app.wait_for("on_connection_resumed")
+        self.assertTrue(wait_until(lambda: self.client._outbox_slots._value == limit))
+        resp = self.client.request({"command": "ping"}).result(5)
+        self.assertEqual(resp["type"], "pong")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+Canal de arquivos (VigiaTransferManager) contra o gateway de mentira, com e
+sem queda no meio da transferência.
+"""
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from test_vigia_client import RecordingApp, core
+from mock_gateway import MockGateway
+
+class VigiaTransferTest(unittest.TestCase):
+    def setUp(self):
+        self.pc = tempfile.mkdtemp()
+        self.phone = tempfile.mkdtemp()
+        self.gateway = MockGateway(core, root=self.pc)
+        port = self.gateway.start()
+        self.app = RecordingApp()
+        self.client = core.VigiaNetworkClient(self.app, post=lambda fn, *args: fn(*args))
+        self.client.RECONNECT_BASE = 0.05
+        self.client.transfers.CHUNK_SIZE = 64 * 1024
+        result = queue.Queue()
+        self.client.connect("127.0.0.1", "1234", port, callback=result.put)
+        self.assertTrue(result.get(timeout=10))
+        # Metade repetitiva (zlib compensa), metade aleatória (não compensa)
+        self.blob = b"linha de texto repetitiva " * 20000 + os.urandom(512 * 1024)
+
+    def tearDown(self):
+        self.client.disconnect()
+        self.gateway.stop()
+        shutil.rmtree(self.pc)
+        shutil.rmtree(self.phone)
+
+    def finished(self):
+        return self.app.wait_for("on_transfer_finished", timeout=30)[1]
+
+    def read(self, path):
+        with open(path, "rb") as f: return f.read()
+
+    def upload(self):
+        local = os.path.join(self.phone, "grande.bin")
+        with open(local, "wb") as f: f.write(self.blob)
+        self.client.transfers.upload(local)
+        return self.finished()
+
+    def test_upload(self):
+        t = self.upload()
+        self.assertEqual((t.state, t.error), ("done", None))
+        self.assertEqual(self.read(os.path.join(self.pc, "grande.bin")), self.blob)
+        self.assertLess(t.wire_bytes, len(self.blob))
+        self.assertEqual(self.client.transfers.transfers, {})
+
+    def test_upload_resumes_after_drop(self):
+        self.gateway.drop_after_chunks = 5
+        t = self.upload()
+        self.assertEqual(t.state, "done")
+        self.assertGreaterEqual(t.resumes, 1)
+        self.assertEqual(self.read(os.path.join(self.pc, "grande.bin")), self.blob)
+
+    def download(self):
+        with open(os.path.join(self.pc, "grande.bin"), "wb") as f: f.write(self.blob)
+        local = os.path.join(self.phone, "copia.bin")
+        self.client.transfers.download("grande.bin", local)
+        return self.finished(), local
+
+    def test_download(self):
+        t, local = self.download()
+        self.assertEqual((t.state, t.error), ("done", None))
+        self.assertEqual(self.read(local), self.blob)
+        self.assertEqual(os.listdir(self.phone), ["copia.bin"])  # Sem .part esquecido
+        self.assertEqual(self.client.transfers.transfers, {})
+
+    def test_download_resumes_after_drop(self):
+        self.gateway.drop_after_chunks = 7
+        t, local = self.download()
+        self.assertEqual(t.state, "done")
+        self.assertGreaterEqual(t.resumes, 1)
+        self.assertEqual(self.read(local), self.blob)
+
+    def test_gateway_without_xfer_is_refused(self):
+        self.client.features.discard("xfer")
+        t = self.upload()
+        self.assertEqual(t.state, "error")
+        self.assertEqual(self.client.transfers.transfers, {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,312 @@
+"""
+Benchmark de vazão do protocolo Vigia contra um gateway falso local.
+
+O gateway de mentira responde ao handshake do VigiaWireCodec (escolhendo
+frame/1 ou o JSON concatenado) e despeja listagens "files" grandes, com nomes
+acentuados para cair em caracteres multibyte cortados entre dois recv.
+O cliente lê do socket como o app lê, e o laço antigo do listen_loop (str +
+strip + raw_decode) entra como referência.
+
+Depois o canal de arquivos: upload e download em pedaços (xfer_*) pelo
+VigiaNetworkClient de verdade contra o tools/mock_gateway.py, com conteúdo
+compressível e aleatório, e com uma queda no meio para medir a retomada.
+
+Por fim o OffloadScheduler: uma carga simulada de ações de applet (com
+tempos "reais" conhecidos em cada lado) é decidida pelo modelo e pela
+regra antiga das palavras-chave, e o tempo total de cada um é comparado
+com o melhor possível, em rede rápida e lenta.
+
+    python tools/bench_vigia.py [--files 5000] [--messages 10] [--repeat 3] [--xfer-mb 16] [--decisions 400]
+
+As classes vêm direto do main.py (sophia_core, sem subir o Kivy).
+"""
+import argparse
+import codecs
+import contextlib
+import io
+import json
+import os
+import queue
+import random
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import types
+
+from sophia_core import load
+import mock_gateway
+
+core = load()
+VigiaWireCodec = core.VigiaWireCodec
+
+# ============================================================================
+# 🧪 GATEWAY FALSO
+# ============================================================================
+
+class ListingGateway:
+    """
+    Um TCP local que fala o handshake do Vigia. Cada conexão recebe o mesmo
+    lote pré-montado de listagens e é fechada no fim (o cliente mede até o EOF).
+    """
+    def __init__(self, payloads, protocols):
+        self.payloads = payloads  # Mensagens já serializadas (bytes do JSON)
+        self.protocols = protocols  # O que este gateway sabe falar
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen()
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try: conn, _ = self.sock.accept()
+            except OSError: return
+            threading.Thread(target=self._session, args=(conn,), daemon=True).start()
+
+    def _session(self, conn):
+        with conn:
+            hello, buf, decoder = None, b"", json.JSONDecoder()
+            while hello is None:
+                chunk = conn.recv(4096)
+                if not chunk: return
+                buf += chunk
+                try: hello, _ = decoder.raw_decode(buf.decode("utf-8"))
+                except ValueError: continue
+            offered = hello.get("protocols", [])
+            protocol = next((p for p in offered if p in self.protocols), None)
+            reply = {"status": "auth_ok"}
+            # Gateway antigo (sem protocolo em comum) nem manda o campo
+            if protocol and protocol != VigiaWireCodec.LEGACY: reply["protocol"] = protocol
+            conn.sendall(json.dumps(reply).encode("utf-8"))
+            if protocol == VigiaWireCodec.FRAMED:
+                header = VigiaWireCodec.HEADER
+                conn.sendall(b"".join(header.pack(len(p)) + p for p in self.payloads))
+            else:
+                conn.sendall(b"".join(self.payloads))
+
+    def close(self):
+        self.sock.close()
+
+def build_payloads(files, messages):
+    listing = [{"name": f"relatório_ação_{i:06d}.txt", "is_dir": i % 17 == 0, "size": i * 31,
+                "mtime": 1700000000 + i} for i in range(files)]
+    body = json.dumps({"type": "files", "files": listing}).encode("utf-8")
+    return [body] * messages
+
+# ============================================================================
+# 📥 CLIENTES
+# ============================================================================
+
+def _handshake(sock, codec):
+    """Igual ao connect do app: só a primeira mensagem, o resto fica no codec"""
+    sock.sendall(codec.encode({"auth_pin": "0000", "protocols": VigiaWireCodec.SUPPORTED}))
+    received = 0
+    while True:
+        n = sock.recv_into(codec.get_buffer())
+        if not n: raise ConnectionError("gateway fechou durante o handshake")
+        received += n
+        codec.buffer_updated(n)
+        msgs = codec.messages()
+        if msgs: break
+    codec.switch_mode(msgs[0].get("protocol", VigiaWireCodec.LEGACY))
+    return msgs[1:], received
+
+def read_with_codec(port):
+    sock = socket.create_connection(("127.0.0.1", port))
+    codec = VigiaWireCodec(VigiaWireCodec.LEGACY)
+    with sock:
+        got, received = _handshake(sock, codec)
+        got.extend(codec.messages())
+        while True:
+            n = sock.recv_into(codec.get_buffer())
+            if not n: break
+            received += n
+            codec.buffer_updated(n)
+            got.extend(codec.messages())
+    return codec.mode, got, received
+
+def read_old_loop(port):
+    """O listen_loop de antes do codec (com decodificador incremental só para não quebrar)"""
+    sock = socket.create_connection(("127.0.0.1", port))
+    with sock:
+        sock.sendall(json.dumps({"auth_pin": "0000"}).encode("utf-8"))
+        utf8 = codecs.getincrementaldecoder("utf-8")()
+        decoder, buffer, got, received = json.JSONDecoder(), "", [], 0
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk: break
+            received += len(chunk)
+            buffer += utf8.decode(chunk)
+            while buffer:
+                buffer = buffer.strip()
+                if not buffer: break
+                try:
+                    obj, idx = decoder.raw_decode(buffer)
+                    got.append(obj)
+                    buffer = buffer[idx:]
+                except ValueError:
+                    break
+    return VigiaWireCodec.LEGACY, got[1:], received
+
+# ============================================================================
+# 📤 TRANSFERÊNCIAS
+# ============================================================================
+
+class BenchApp:
+    """O mínimo do app que o cliente chama; só o fim das transferências interessa"""
+    def __init__(self):
+        self.finished = queue.Queue()
+
+    def on_transfer_finished(self, transfer):
+        self.finished.put(transfer)
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+def run_transfers(mb, repeat):
+    pc, phone = tempfile.mkdtemp(), tempfile.mkdtemp()
+    gateway = mock_gateway.MockGateway(core, root=pc)
+    port = gateway.start()
+    app = BenchApp()
+    client = core.VigiaNetworkClient(app, post=lambda fn, *args: fn(*args))
+    client.RECONNECT_BASE = 0.05
+    done = queue.Queue()
+    client.connect("127.0.0.1", gateway.pin, port, callback=done.put)
+    if not done.get(timeout=10): raise SystemExit("❌ não conectou no gateway de mentira")
+    size = mb * 1024 * 1024
+    contents = {
+        "texto": b"".join(b"linha de relat\xc3\xb3rio %07d\n" % i for i in range(size // 16))[:size],
+        "aleatório": os.urandom(size),
+    }
+    chunks = size // client.transfers.CHUNK_SIZE
+    try:
+        for kind, blob in contents.items():
+            local, remote = os.path.join(phone, "bench.bin"), os.path.join(pc, "bench.bin")
+            for direction in ("upload", "download"):
+                for drop in (None, chunks // 2):
+                    best, last = None, None
+                    for _ in range(repeat):
+                        for path in (local, remote):
+                            if os.path.exists(path): os.remove(path)
+                        with open(local if direction == "upload" else remote, "wb") as f: f.write(blob)
+                        gateway.chunks, gateway.drop_after_chunks = 0, drop
+                        start = time.perf_counter()
+                        if direction == "upload": client.transfers.upload(local, "bench.bin")
+                        else: client.transfers.download("bench.bin", local)
+                        last = app.finished.get(timeout=120)
+                        elapsed = time.perf_counter() - start
+                        with open(remote if direction == "upload" else local, "rb") as f:
+                            if last.state != "done" or f.read() != blob:
+                                raise SystemExit(f"❌ {direction} {kind}: {last.state} {last.error}")
+                        best = elapsed if best is None else min(best, elapsed)
+                    label = f"{direction} {kind}" + (" (com queda)" if drop else "")
+                    print(f"{label:<34} {mb:6d} MB {best:8.3f} s {mb / best:9.1f} MB/s "
+                          f"{last.wire_bytes / size:6.0%} no fio {last.resumes} retomada(s)")
+    finally:
+        client.disconnect()
+        gateway.stop()
+        shutil.rmtree(pc)
+        shutil.rmtree(phone)
+
+# ============================================================================
+# 🧮 ESCALONADOR (OFFLOAD)
+# ============================================================================
+
+# ação: (comando, hints, MB mín/máx, segundos no celular (a, b × MB), no PC (a, b × MB))
+WORKLOAD = {
+    "miniatura": ("convert in.jpg -resize 256x256 out.jpg", {"output_ratio": 0.05}, (0.5, 8), (0.15, 0.05), (0.1, 0.02)),
+    "transcodificar": ("ffmpeg -i in.mp4 out.webm", {"output_ratio": 0.5}, (5, 120), (4.0, 6.0), (1.0, 0.5)),
+    "ocr": ("python3 ocr.py in.png", {"cost_class": "cpu", "output_ratio": 0.01}, (0.2, 3), (3.0, 2.0), (0.5, 0.2)),
+    "contar_palavras": ("wc -w in.txt", {"cost_class": "light"}, (0.01, 2), (0.05, 0.01), (0.05, 0.01)),
+}
+NETWORKS = [("Wi-Fi bom", 20 * 1024 * 1024, 5), ("Wi-Fi fraco", 512 * 1024, 120)]
+
+def true_seconds(side, action, size, network, rng):
+    """Quanto a ação 'realmente' leva (com ruído), contando a rede no lado do PC"""
+    _command, hints, _sizes, local, remote = WORKLOAD[action]
+    _name, bandwidth, rtt_ms = network
+    size_mb = size / 1048576
+    a, b = local if side == "local" else remote
+    run = (a + b * size_mb) * rng.uniform(0.85, 1.15)
+    if side == "local": return run, run
+    moved = size * (1 + hints.get("output_ratio", 1.0))
+    return rtt_ms / 1000 * 4 + moved / bandwidth + run, run
+
+def run_scheduler(decisions):
+    print(f"{'rede':<12} {'decisões':>8} {'modelo':>9} {'palavras':>9} {'ótimo':>9} {'divergem':>9} {'no PC':>6}")
+    for network in NETWORKS:
+        rng = random.Random(42)
+        tmp = tempfile.mkdtemp()
+        scheduler = core.OffloadScheduler(os.path.join(tmp, "offload.db"))
+        scheduler._local_load = lambda: 0.0  # Não depende da máquina que roda o benchmark
+        client = types.SimpleNamespace(connected=True, bandwidth_bps=network[1], rtt_avg_ms=network[2])
+        totals = {"modelo": 0.0, "palavras": 0.0, "ótimo": 0.0}
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):  # decide() imprime cada decisão
+                for _ in range(decisions):
+                    action = rng.choice(list(WORKLOAD))
+                    command, hints, (lo, hi), _local, _remote = WORKLOAD[action]
+                    size = int(rng.uniform(lo, hi) * 1048576)
+                    decision = scheduler.decide(action, command, size, hints, client=client)
+                    cost = {side: true_seconds(side, action, size, network, rng) for side in ("local", "remote")}
+                    totals["modelo"] += cost[decision.side][0]
+                    totals["palavras"] += cost[decision.heuristic_side][0]
+                    totals["ótimo"] += min(total for total, _run in cost.values())
+                    # O modelo aprende só com o lado em que rodou (como no app)
+                    scheduler.record(action, decision.side, size, cost[decision.side][1], decision)
+            summary = scheduler.report()
+        finally:
+            scheduler.conn.close()
+            shutil.rmtree(tmp)
+        print(f"{network[0]:<12} {decisions:8d} {totals['modelo']:8.0f}s {totals['palavras']:8.0f}s {totals['ótimo']:8.0f}s "
+              f"{summary['disagree'] / decisions:9.0%} {summary['offloaded'] / decisions:6.0%}")
+
+# ============================================================================
+# ⏱️ MEDIÇÃO
+# ============================================================================
+
+def run_case(label, reader, port, expected, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        mode, msgs, received = reader(port)
+        elapsed = time.perf_counter() - start
+        files = [m for m in msgs if m.get("type") == "files"]
+        if len(files) != expected:
+            raise SystemExit(f"❌ {label}: {len(files)} listagens de {expected}")
+        best = elapsed if best is None else min(best, elapsed)
+    mb = received / (1024 * 1024)
+    print(f"{label:<28} {mode:<8} {mb:8.1f} MB {best:8.3f} s {mb / best:9.1f} MB/s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=5000, help="entradas por listagem")
+    parser.add_argument("--messages", type=int, default=10, help="listagens por conexão")
+    parser.add_argument("--repeat", type=int, default=3, help="rodadas (vale a melhor)")
+    parser.add_argument("--xfer-mb", type=int, default=16, help="tamanho do arquivo nas transferências (0 pula)")
+    parser.add_argument("--decisions", type=int, default=400, help="ações simuladas para o escalonador (0 pula)")
+    args = parser.parse_args()
+
+    payloads = build_payloads(args.files, args.messages)
+    print(f"📦 {args.messages} listagens de {args.files} arquivos ({len(payloads[0]) / 1024:.0f} KB cada)")
+    framed = ListingGateway(payloads, [VigiaWireCodec.FRAMED, VigiaWireCodec.LEGACY])
+    legacy = ListingGateway(payloads, [])
+    try:
+        run_case("codec, gateway novo", read_with_codec, framed.port, args.messages, args.repeat)
+        run_case("codec, gateway antigo", read_with_codec, legacy.port, args.messages, args.repeat)
+        run_case("listen_loop antigo", read_old_loop, legacy.port, args.messages, args.repeat)
+    finally:
+        framed.close()
+        legacy.close()
+    if args.xfer_mb:
+        print(f"📦 transferências de {args.xfer_mb} MB em pedaços de {core.VigiaTransferManager.CHUNK_SIZE // 1024} KB")
+        run_transfers(args.xfer_mb, args.repeat)
+    if args.decisions:
+        print(f"📦 escalonador: {len(WORKLOAD)} ações simuladas, tempo total de cada política")
+        run_scheduler(args.decisions)
+
+if __name__ == '__main__':
+    main()
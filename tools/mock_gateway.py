@@ -0,0 +1,223 @@
+"""
+Gateway Vigia de mentira (asyncio) para testes e benchmarks locais.
+
+Fala o handshake do VigiaNetworkClient (PIN, escolha do protocolo, features,
+token de sessão e retomada), manda a listagem inicial e responde aos comandos
+com o mesmo req_id. Cada comando é um método cmd_<nome>; o que não tem método
+é só registrado em .received. O canal de arquivos (xfer_*) e a sincronização
+da Mesa (sync_*) leem e gravam em root, a "área de trabalho" do PC. Roda num
+event loop em thread própria:
+
+    gateway = MockGateway(load(), pin="1234", root=tempfile.mkdtemp())
+    port = gateway.start()
+    ...
+    gateway.drop_all()  # Simula o Wi-Fi caindo (sem FIN)
+    gateway.stop()
+"""
+import asyncio
+import base64
+import hashlib
+import os
+import threading
+import zlib
+
+class MockGateway:
+    def __init__(self, core, pin="1234", features=("listing_delta", "resume", "heartbeat", "xfer", "sync"),
+                 protocol="frame/1", files=None, root=None):
+        self.core = core  # Namespace do sophia_core.load()
+        self.pin = pin
+        self.features = list(features)
+        self.protocol = protocol  # None = gateway antigo (JSON concatenado, sem o campo)
+        self.files = files or []
+        self.root = root
+        self.uploads = {}  # xfer_id -> {"path", "data": bytearray, "got": {offset: tamanho}}
+        self.drop_after_chunks = None  # Derruba a conexão no N-ésimo xfer_chunk/xfer_read (queda no meio)
+        self.chunks = 0
+        self.patch_bytes = 0  # Dados novos (literais) recebidos por sync_patch
+        self.generation = 1
+        self.session = "sessao-teste"
+        self.mute = False  # Engole os comandos sem responder (PC travado)
+        self.received = []
+        self.connections = 0
+        self._writers = set()
+        self._loop = None
+        self._thread = None
+        self._server = None
+
+    # --- CICLO DE VIDA ---
+    def start(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True, name="mock-gateway")
+        self._thread.start()
+        self._server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self._session_main, "127.0.0.1", 0), self._loop).result(5)
+        return self._server.sockets[0].getsockname()[1]
+
+    def stop(self):
+        async def close():
+            self._server.close()
+            for writer in list(self._writers): writer.transport.abort()
+            await self._server.wait_closed()
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in tasks: task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        asyncio.run_coroutine_threadsafe(close(), self._loop).result(5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
+        self._loop.close()
+
+    def drop_all(self):
+        """Derruba todas as conexões abertas"""
+        self._loop.call_soon_threadsafe(lambda: [w.transport.abort() for w in list(self._writers)])
+
+    # --- SESSÃO ---
+    async def _session_main(self, reader, writer):
+        self.connections += 1
+        self._writers.add(writer)
+        try:
+            await self._session(reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _session(self, reader, writer):
+        codec = self.core.VigiaWireCodec(self.core.VigiaWireCodec.LEGACY)
+        hello = None
+        while hello is None:
+            data = await reader.read(65536)
+            if not data: return
+            codec.feed(data)
+            msgs = codec.messages()
+            if msgs: hello = msgs[0]
+        if hello.get("auth_pin") != self.pin:
+            writer.write(codec.encode({"status": "auth_fail"}))
+            return
+        reply = {"status": "auth_ok", "features": self.features, "session": self.session}
+        offered = hello.get("protocols", [])
+        if self.protocol and self.protocol in offered: reply["protocol"] = self.protocol
+        resumed = hello.get("resume") == self.session and "resume" in self.features
+        if resumed: reply["resumed"] = True
+        writer.write(codec.encode(reply))  # Handshake sempre em JSON puro
+        codec.switch_mode(reply.get("protocol", codec.LEGACY))
+        if not resumed:
+            writer.write(codec.encode({"files": self.files, "generation": self.generation}))
+        while True:
+            data = await reader.read(1 << 20)
+            if not data: return
+            codec.feed(data)
+            for msg in codec.messages():
+                self.received.append(msg)
+                if self.mute: continue
+                handler = getattr(self, "cmd_" + str(msg.get("command")), None)
+                if handler is None: continue
+                resp = handler(msg)
+                if asyncio.iscoroutine(resp): resp = await resp
+                if resp is None: continue
+                if "req_id" in msg: resp["req_id"] = msg["req_id"]
+                writer.write(codec.encode(resp))
+            await writer.drain()
+
+    # --- COMANDOS ---
+    def cmd_ping(self, msg):
+        return {"type": "pong"}
+
+    def cmd_list_desktop(self, msg):
+        return {"files": self.files, "generation": self.generation}
+
+    # --- CANAL DE ARQUIVOS ---
+    def _path(self, rel):
+        return os.path.join(self.root, rel.replace("/", os.sep))
+
+    def _count_chunk(self):
+        self.chunks += 1
+        if self.drop_after_chunks and self.chunks == self.drop_after_chunks:
+            raise ConnectionResetError("queda simulada")
+
+    def cmd_xfer_open(self, msg):
+        if msg["direction"] == "download":
+            with open(self._path(msg["path"]), "rb") as f: data = f.read()
+            return {"status": "ok", "size": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+        upload = self.uploads.setdefault(msg["xfer_id"], {
+            "path": self._path(msg["path"]), "data": bytearray(msg["size"]), "got": {}})
+        offset = 0  # Retomada: o prefixo contíguo que já chegou
+        while offset in upload["got"]: offset += upload["got"][offset]
+        return {"status": "ok", "offset": offset}
+
+    def cmd_xfer_chunk(self, msg):
+        self._count_chunk()
+        upload = self.uploads[msg["xfer_id"]]
+        payload = base64.b64decode(msg["data"])
+        raw = zlib.decompress(payload) if msg.get("z") else payload
+        if zlib.crc32(raw) != msg["crc"]: return {"status": "bad_crc"}
+        upload["data"][msg["offset"]:msg["offset"] + len(raw)] = raw
+        upload["got"][msg["offset"]] = len(raw)
+        return {"status": "ok", "offset": msg["offset"] + len(raw)}
+
+    def cmd_xfer_read(self, msg):
+        self._count_chunk()
+        path = next(m["path"] for m in reversed(self.received)
+                    if m.get("command") == "xfer_open" and m.get("xfer_id") == msg["xfer_id"])
+        with open(self._path(path), "rb") as f:
+            f.seek(msg["offset"])
+            raw = f.read(msg["length"])
+        packed = zlib.compress(raw, 1) if msg.get("compress") else raw
+        return {"status": "ok", "data": base64.b64encode(packed).decode("ascii"),
+                "z": bool(msg.get("compress")), "crc": zlib.crc32(raw)}
+
+    def cmd_xfer_close(self, msg):
+        upload = self.uploads.pop(msg["xfer_id"], None)
+        if msg.get("abort") or upload is None: return None
+        with open(upload["path"], "wb") as f: f.write(upload["data"])
+        return {"status": "ok", "sha256": hashlib.sha256(upload["data"]).hexdigest()}
+
+    # --- SINCRONIZAÇÃO DA MESA ---
+    @staticmethod
+    def _sha256(path):
+        with open(path, "rb") as f: return hashlib.sha256(f.read()).hexdigest()
+
+    def _sync_path(self, msg):
+        return self._path(f"{msg['root']}/{msg['path']}")
+
+    def _chunks(self, path, chunking):
+        with open(path, "rb") as f:
+            return list(self.core.VersionStore.iter_content_chunks(f, chunking["min"], chunking["max"], chunking["mask"]))
+
+    def cmd_sync_manifest(self, msg):
+        base, files = self._path(msg["root"]), []
+        for dirpath, _dirs, names in os.walk(base):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                st = os.stat(path)
+                files.append({"path": os.path.relpath(path, base).replace(os.sep, "/"), "size": st.st_size,
+                              "mtime": st.st_mtime, "sha256": self._sha256(path)})
+        return {"status": "ok", "files": files}
+
+    def cmd_sync_signature(self, msg):
+        path = self._sync_path(msg)
+        signature = [[hashlib.sha256(c).hexdigest(), len(c)] for c in self._chunks(path, msg["chunking"])]
+        return {"status": "ok", "sha256": self._sha256(path), "signature": signature}
+
+    def cmd_sync_delta(self, msg):
+        """Operações que transformam a base do celular (assinatura) no arquivo daqui"""
+        path, chunking = self._sync_path(msg), msg["chunking"]
+        engine = self.core.MesaSyncEngine.__new__(self.core.MesaSyncEngine)
+        engine.SIG_MIN_CHUNK, engine.SIG_MAX_CHUNK, engine.SIG_CUT_MASK = chunking["min"], chunking["max"], chunking["mask"]
+        ops = engine._build_delta(path, msg["signature"])[0]
+        return {"status": "ok", "sha256": self._sha256(path), "mtime": os.stat(path).st_mtime, "ops": ops}
+
+    def cmd_sync_patch(self, msg):
+        path = self._sync_path(msg)
+        current = self._sha256(path) if os.path.exists(path) else None
+        if current != msg["base_sha256"]: return {"status": "conflict"}
+        self.patch_bytes += sum(len(op[1]) for op in msg["ops"] if op[0] == "d")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.core.MesaSyncEngine._apply_delta(path, msg["ops"], path + ".new", msg["sha256"])
+        os.replace(path + ".new", path)
+        return {"status": "ok"}
+
+    def cmd_sync_delete(self, msg):
+        path = self._sync_path(msg)
+        if os.path.exists(path) and self._sha256(path) == msg["base_sha256"]: os.remove(path)
+        return {"status": "ok"}
@@ -0,0 +1,55 @@
+"""
+Carrega classes do main.py sem subir o Kivy (para benchmarks e testes).
+
+O main.py é um script só e importá-lo abre a janela do Kivy. Aqui só os
+imports da biblioteca padrão (e o Pillow opcional) e as definições pedidas
+são executados, num namespace próprio. Serve para o que não toca em widget:
+codec e cliente do Vigia (com post= no lugar do Clock), transferências,
+sincronização, metadados, versões, JobManager e OffloadScheduler.
+
+    core = load("VigiaWireCodec", "VigiaNetworkClient")
+    client = core.VigiaNetworkClient(app, post=lambda fn, *a: fn(*a))
+"""
+import ast
+import os
+import types
+
+MAIN_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main.py")
+GUI_PACKAGES = ("kivy", "kivymd", "jnius", "android")
+
+# Tudo o que o núcleo de rede/arquivos usa, na ordem do main.py
+CORE = ("DEFAULT_PORT", "VigiaWireCodec", "RemoteListing", "RemoteListingCache", "VigiaProtocol",
+        "VigiaNetworkClient", "VigiaTransfer", "VigiaTransferManager", "MetadataStore", "MesaSyncEngine",
+        "VersionStore", "MetadataManager", "Job", "JobManager", "OffloadDecision", "OffloadScheduler")
+
+def _is_gui_import(node):
+    if isinstance(node, ast.ImportFrom):
+        return (node.module or "").split(".")[0] in GUI_PACKAGES
+    return any(alias.name.split(".")[0] in GUI_PACKAGES for alias in node.names)
+
+def _defined_names(node):
+    if isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+        return {node.name}
+    if isinstance(node, ast.Assign):
+        return {t.id for t in node.targets if isinstance(t, ast.Name)}
+    return set()
+
+def load(*names):
+    """Namespace com os imports da stdlib e as definições pedidas (todas do CORE se nenhuma)"""
+    wanted = set(names or CORE)
+    with open(MAIN_PY, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), MAIN_PY)
+    body, found = [], set()
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            if not _is_gui_import(node): body.append(node)
+        elif isinstance(node, ast.Try) and all(isinstance(n, (ast.Import, ast.ImportFrom)) for n in node.body):
+            body.append(node)  # Dependência opcional (Pillow)
+        elif _defined_names(node) & wanted:
+            body.append(node)
+            found |= _defined_names(node)
+    missing = wanted - found
+    if missing: raise LookupError(f"Não achei no main.py: {', '.join(sorted(missing))}")
+    namespace = {"__name__": "sophia_core"}
+    exec(compile(ast.Module(body=body, type_ignores=[]), MAIN_PY, "exec"), namespace)
+    return types.SimpleNamespace(**{k: v for k, v in namespace.items() if not k.startswith("__")})